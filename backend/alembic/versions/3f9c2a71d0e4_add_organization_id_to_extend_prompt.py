@@ -0,0 +1,72 @@
+"""add organization_id to extend_prompt
+
+Revision ID: 3f9c2a71d0e4
+Revises: b65b56d58370
+Create Date: 2026-10-19 03:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a71d0e4'
+down_revision: Union[str, None] = 'b65b56d58370'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 組織の分からない既存のプロンプトを紐づける組織
+BACKFILL_ORGANIZATION = "default"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite でも外部キーを追加できるよう batch モードで作り直す
+    with op.batch_alter_table('extend_prompt') as batch_op:
+        batch_op.add_column(sa.Column('organization_id', sa.Integer(), nullable=True))
+
+    # 既存の行を埋める: これまで組織との紐づけは保存されていなかったため、まとめて既定の組織に入れる
+    conn = op.get_bind()
+    orphans = conn.execute(sa.text("SELECT COUNT(*) FROM extend_prompt WHERE organization_id IS NULL")).scalar()
+    if orphans:
+        org_id = conn.execute(
+            sa.text("SELECT id FROM organization WHERE name = :name ORDER BY id LIMIT 1"),
+            {"name": BACKFILL_ORGANIZATION}
+        ).scalar()
+        if org_id is None:
+            conn.execute(
+                sa.text("INSERT INTO organization (name, created_at) VALUES (:name, CURRENT_TIMESTAMP)"),
+                {"name": BACKFILL_ORGANIZATION}
+            )
+            org_id = conn.execute(
+                sa.text("SELECT id FROM organization WHERE name = :name ORDER BY id LIMIT 1"),
+                {"name": BACKFILL_ORGANIZATION}
+            ).scalar()
+        conn.execute(
+            sa.text("UPDATE extend_prompt SET organization_id = :org_id WHERE organization_id IS NULL"),
+            {"org_id": org_id}
+        )
+        # 一意インデックスを張る前に、同じ組織・同じ名前の重複は最新(id が最大)の1件だけ残す
+        conn.execute(sa.text(
+            "DELETE FROM extend_prompt WHERE id NOT IN ("
+            " SELECT MAX(id) FROM extend_prompt GROUP BY organization_id, name"
+            ")"
+        ))
+
+    with op.batch_alter_table('extend_prompt') as batch_op:
+        batch_op.alter_column('organization_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key(
+            'fk_extend_prompt_organization_id_organization',
+            'organization', ['organization_id'], ['id'], ondelete='CASCADE'
+        )
+        batch_op.create_index('ix_extend_prompt_organization_id_name', ['organization_id', 'name'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('extend_prompt') as batch_op:
+        batch_op.drop_index('ix_extend_prompt_organization_id_name')
+        batch_op.drop_constraint('fk_extend_prompt_organization_id_organization', type_='foreignkey')
+        batch_op.drop_column('organization_id')
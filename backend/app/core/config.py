@@ -39,10 +39,129 @@ class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite+aiosqlite:///./dev.db"
     ALEMBIC_DATABASE_URL: str = "sqlite+aiosqlite:///./dev.db"
     
+    # データベースの接続
+    DB_ECHO: bool = False  # 発行する SQL をすべてログに出す（DEBUG とは別に、調査時だけ有効にする）
+    DB_POOL_SIZE: int = 5  # 常に保持する接続数
+    DB_MAX_OVERFLOW: int = 10  # 一時的に追加で開ける接続数
+    DB_POOL_TIMEOUT: float = 30.0  # 空き接続を待つ最大秒数
+    DB_POOL_PRE_PING: bool = True  # 貸し出し前に接続が生きているか確認する（DB 再起動・アイドル切断への対策）
+    DB_POOL_RECYCLE: int = 1800  # この秒数より古い接続は作り直す（-1 で無効）
+    DB_STATEMENT_CACHE_SIZE: int = 100  # asyncpg のプリペアドステートメントのキャッシュ数（pgbouncer の transaction モードでは 0）
+    # SQLite の PRAGMA
+    SQLITE_JOURNAL_MODE: str = "WAL"  # 読み込みと書き込みを並行できるようにする
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # WAL なら NORMAL でも破損しない（電源断時に直近のコミットが失われうる）
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # ロック中の書き込みを即エラーにせず待つ時間
+    SQLITE_CACHE_SIZE_KB: int = 20000  # ページキャッシュの大きさ
+
     # ファイル保存ディレクトリ
     IMAGES_DIR: str = "received_images"
     AUDIOS_DIR: str = "received_audios"
 
+    # 複数ワーカーで共有する接続・会話相手・追跡状態 ("memory" / "sqlite" / "redis")
+    # memory はワーカー1つのとき用。sqlite は1ノード内の複数ワーカー、redis は複数ノード向け
+    SHARED_STATE_BACKEND: str = "memory"
+    SHARED_STATE_URL: str = "shared_state.db"  # sqlite: ファイルパス / redis: redis://host:6379/0
+
+    # WebSocket の送信キュー
+    SEND_QUEUE_LIMIT: int = 64  # 未送信メッセージ数の上限
+    SLOW_CONSUMER_GRACE: float = 5.0  # 上限を超えたままこの秒数たったクライアントは切断する
+
+    # WebSocket の生存確認
+    WS_HEARTBEAT_INTERVAL: float = 20.0  # ping を送る間隔(秒)。プロトコルレベルの ping も同じ間隔で送る
+    WS_HEARTBEAT_TIMEOUT: float = 60.0  # pong を返すクライアントがこの秒数応答しなければ切断する
+    WS_IDLE_TIMEOUT: float = 600.0  # この秒数なにも受信しなければ切断する
+
+    # 会話相手が決まった時点で最初の挨拶(テキスト+音声)を先読みするか
+    SPECULATIVE_GREETING: bool = False
+
+    # LLM バックエンド ("openai" / "local": ネットワーク不要の負荷試験用スタブ)
+    LLM_BACKEND: str = "openai"
+    LLM_PROMPT_MODEL: str = "gpt-4.1-nano"  # prompts.json のプロンプト選択に使うモデル名
+    LLM_CHAT_MODEL: str = "gpt-3.5-turbo"  # 会話に使うモデル名
+    # ローカルスタブの挙動
+    LOCAL_LLM_LATENCY: str = "lognormal"  # fixed / normal / lognormal
+    LOCAL_LLM_TTFT_MS: float = 300.0  # 最初のトークンまでの平均待ち時間(ミリ秒)
+    LOCAL_LLM_TTFT_JITTER_MS: float = 100.0  # 待ち時間のばらつき(標準偏差, ミリ秒)
+    LOCAL_LLM_TOKENS_PER_SEC: float = 50.0
+    LOCAL_LLM_REPLY_TOKENS: int = 40
+    LOCAL_LLM_STREAMING: bool = True
+    LOCAL_LLM_SEED: int = 0
+    # 音声合成 ("gtts" / "dummy": ネットワーク不要のダミー音声)
+    TTS_BACKEND: str = "gtts"
+
+    # ストリーミング音声認識 ("vosk" / "none")
+    # モデルは https://alphacephei.com/vosk/models から取得して ASR_MODEL_PATH に置く
+    ASR_ENGINE: str = "vosk"
+    ASR_MODEL_PATH: str = "models/vosk-model-small-ja-0.22"
+    ASR_SAMPLE_RATE: int = 16000  # クライアントが送る PCM のサンプルレート(既定値)
+    ASR_WORKERS: int = 2  # 文字起こしのワーカースレッド数
+    ASR_VAD_THRESHOLD: float = 500.0  # 発話とみなす音量(16bit PCM の RMS)
+    ASR_END_SILENCE_MS: int = 700  # この長さの無音で発話終了とみなす(ミリ秒)
+    ASR_MAX_UTTERANCE_SEC: float = 15.0  # 1発話の最大長(秒)
+
+    # 外部依存(OpenAI / gTTS)の期限・ヘッジ・サーキットブレーカー
+    LLM_TIMEOUT: float = 15.0  # LLM 応答の期限(秒)
+    TTS_TIMEOUT: float = 8.0  # 音声合成の期限(秒)
+    TTS_HEDGE_DELAY: float = 1.5  # これを超えたら同じ音声合成をもう1本送る(秒)
+    TTS_CACHE_SIZE: int = 256  # 合成済み音声をキャッシュする件数
+    BREAKER_FAILURE_THRESHOLD: int = 5  # 連続失敗でブレーカーを開く回数
+    BREAKER_RESET_TIMEOUT: float = 30.0  # ブレーカーを開いてから再試行するまで(秒)
+
+    # 会話ターン(LLM + TTS)の流量制御
+    ADMISSION_MAX_CONCURRENCY: int = 8  # ワーカー全体の同時実行数
+    ADMISSION_RATE_PER_CLIENT: float = 0.5  # クライアントごとの補充レート(回/秒)
+    ADMISSION_BURST: int = 3  # クライアントごとに連続で受け付ける回数
+    ADMISSION_MAX_WAIT: float = 10.0  # これ以上待たせる見込みなら busy を返す(秒)
+
+    # ログ
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = False  # 構造化ログを JSON 1行で出力する
+    LOG_QUEUE_SIZE: int = 10000  # 書き出し待ちのログの上限（超えた分は捨てる）
+
+    # トレース
+    TRACE_EXPORT_PATH: str = ""  # 完了したトレースを JSON Lines で追記するファイル（空なら書き出さない）
+    TRACE_SAMPLE_RATE: float = 1.0  # 書き出すトレースの割合
+    TRACE_ECHO: bool = False  # 全クライアントの応答に所要時間の内訳を載せる（接続ごとには ?debug_timing=1）
+
+    # 画像アップロード
+    UPLOAD_MAX_BYTES: int = 10 * 1024 * 1024  # /identify-animal/upload・batch で受け付ける画像1枚あたりの最大サイズ
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # アップロードされたファイルをディスクに書き出す単位
+    BATCH_INFERENCE_SIZE: int = 8  # /identify-animal/batch で1回の推論にまとめる枚数
+    BATCH_PREFETCH: int = 16  # 推論待ちとして受信しておく画像の上限（これ以上は受信を止める）
+
+    # 推論ワーカー（別プロセスで YOLO を動かす。画像と結果は共有メモリで受け渡す）
+    INFERENCE_WORKERS: int = 0  # ワーカープロセス数（0 ならこのプロセスのスレッドで推論する。組織の参照画像との照合の特徴抽出も同じ）
+    INFERENCE_CPU_AFFINITY: str = ""  # "": 固定しない / "auto": 使えるコアを均等に分ける / "0-3;4-7": ワーカーごとのコア
+    INFERENCE_SHM_BYTES: int = 64 * 1024 * 1024  # ワーカー1つあたりの画像用共有メモリ（1回に渡す画像の合計の上限）
+    INFERENCE_TIMEOUT: float = 30.0  # 推論の応答をこの秒数待っても返らなければワーカーを作り直す
+
+    # 組織ごとの参照画像による識別（/extend_prompt の ZIP から作る）
+    EXTEND_PROMPTS_DIR: str = "extend_prompts"  # ZIP の保存先（組織IDごとのサブディレクトリ）
+    EMBEDDING_MODEL_PATH: str = "yolov8n-cls.pt"  # 特徴ベクトルを取り出す分類モデル
+    EMBEDDING_INDEX_DIR: str = "embedding_indexes"  # 組織ごとの参照ベクトルの保存先
+    EMBEDDING_BATCH_SIZE: int = 32  # 特徴抽出を1回にまとめる枚数
+    EMBEDDING_MAX_IMAGES_PER_LABEL: int = 200  # ラベル(ZIP)ごとに使う画像の上限
+    EMBEDDING_MATCH_THRESHOLD: float = 0.75  # コサイン類似度がこれ以上なら参照画像のラベルとみなす
+
+    THUMBNAILS_DIR: str = "thumbnails"  # ラベルごとのサムネイルの保存先
+    THUMBNAIL_SIZE: int = 256  # サムネイルの長辺(px)
+
+    # バックグラウンドジョブ（job テーブルに保存し、各ワーカープロセスで取り出して実行する）
+    JOB_WORKERS: int = 2  # 同時に実行するジョブ数（0 ならこのプロセスでは実行しない）
+    JOB_EXECUTOR: str = "process"  # process: プロセスプール / thread: スレッドプール(開発用)
+    JOB_MAX_ATTEMPTS: int = 3  # 失敗時に再実行する上限（初回を含む）
+    JOB_RETRY_BACKOFF: float = 5.0  # 再実行までの待ち時間(秒)。失敗のたびに倍になる
+    JOB_POLL_INTERVAL: float = 2.0  # 実行待ちのジョブを確認する間隔(秒)
+    JOB_LEASE_SECONDS: float = 1800.0  # 実行中のジョブをこの秒数たっても終わらなければ落ちたとみなす
+
+    # イベントループの監視
+    LOOP_MONITOR_INTERVAL: float = 0.1  # 遅延を測る間隔(秒)
+    LOOP_LAG_THRESHOLD: float = 0.25  # ループがこの秒数以上止まったら、止めている箇所のスタックを記録する
+
+    # 起動時の準備（/ready はモデル・DB・プロンプトの準備が済むまで 503 を返す）
+    WARMUP_ON_STARTUP: bool = True  # 起動直後にバックグラウンドでモデルなどを読み込む（False なら最初に使うときに読み込む）
+    READY_DB_TIMEOUT: float = 1.0  # /ready で DB の接続を確認するときのタイムアウト(秒)
+
     # ↑ここで一度だけ定義すれば OK↑
 
     model_config = SettingsConfigDict(
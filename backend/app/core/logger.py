@@ -1,47 +1,163 @@
+import atexit
+import json
 import logging
-import re
-
-class Base64Filter(logging.Filter):
-    """Base64エンコードされたデータを検出して省略するフィルター"""
-    
-    def __init__(self, name="", max_length=100):
-        super().__init__(name)
-        self.max_length = max_length
-        # Base64パターン: 4の倍数長で、英数字+/=で構成される長い文字列
-        self.base64_pattern = re.compile(r'[A-Za-z0-9+/=]{60,}')
-    
-    def filter(self, record):
-        if hasattr(record, 'msg') and isinstance(record.msg, str):
-            # Base64らしき長い文字列を検出して省略する
-            record.msg = self.base64_pattern.sub(
-                lambda m: f"[BASE64 DATA: {len(m.group(0))} chars]", 
-                record.msg
-            )
-        
-        # args内のbase64も処理
-        if hasattr(record, 'args') and record.args:
-            new_args = []
-            for arg in record.args:
-                if isinstance(arg, str):
-                    # 長いBase64文字列を検出して省略
-                    arg = self.base64_pattern.sub(
-                        lambda m: f"[BASE64 DATA: {len(m.group(0))} chars]",
-                        arg
-                    )
-                new_args.append(arg)
-            record.args = tuple(new_args)
-        
-        return True
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+from app.core.config import Settings
+
+settings = Settings()
+
+# 構造化ログで値をそのまま出す文字列の最大長（これより長いものは長さだけ出す）
+MAX_FIELD_LENGTH = 200
+
+
+def elide(value: Any, depth: int = 0) -> Any:
+    """
+    ログに出す値を型で判定して縮める。
+    バイト列と長い文字列(Base64 の画像・音声など)は長さだけにし、
+    送信メッセージ(msgspec.Struct)は type と各フィールドを同じ規則で縮める。
+    正規表現で中身を走査しないので、大きなペイロードでもコストは長さの取得だけで済む。
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= MAX_FIELD_LENGTH else f"<str {len(value)} chars>"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<bytes {len(value)}>"
+    if depth >= 2:
+        return f"<{type(value).__name__}>"
+    struct_fields = getattr(type(value), "__struct_fields__", None)
+    if struct_fields is not None:
+        elided = {"type": getattr(type(value).__struct_config__, "tag", None) or type(value).__name__}
+        for name in struct_fields:
+            elided[name] = elide(getattr(value, name), depth + 1)
+        return elided
+    if isinstance(value, dict):
+        return {str(k): elide(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        if len(value) > 10:
+            return f"<{type(value).__name__} {len(value)} items>"
+        return [elide(v, depth + 1) for v in value]
+    return elide(str(value), depth)
+
+
+class _EventGate:
+    """
+    イベント名ごとのサンプリングと流量制限。
+    rate_limit はトークンバケット(毎秒 rate_limit 件、最大 rate_limit 件まで溜まる)で判定し、
+    捨てた件数は次に出力したログの suppressed に載せる。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, list] = {}  # {event: [トークン, 最終補充時刻, 捨てた件数]}
+
+    def allow(self, event: str, sample: float, rate_limit: Optional[float]) -> Optional[int]:
+        """
+        出力してよければ、それまでに捨てた件数を返す（出力しない場合は None）
+        """
+        if sample < 1.0 and random.random() >= sample:
+            return None
+        if rate_limit is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(event)
+            if bucket is None:
+                bucket = self._buckets[event] = [float(rate_limit), now, 0]
+            bucket[0] = min(float(rate_limit), bucket[0] + (now - bucket[1]) * rate_limit)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return None
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+            return suppressed
+
+
+_gate = _EventGate()
+
+
+class StructuredMessage:
+    """
+    構造化ログのメッセージ。str() されるまで(= ログ出力スレッドで書き出すまで)整形しない。
+    """
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event: str, fields: Dict[str, Any]):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if settings.LOG_JSON:
+            return json.dumps({"event": self.event, **self.fields}, ensure_ascii=False, default=str)
+        return " ".join([self.event, *(f"{key}={value}" for key, value in self.fields.items())])
+
+
+def log_event(
+    event: str,
+    level: int = logging.INFO,
+    sample: float = 1.0,
+    rate_limit: Optional[float] = None,
+    **fields: Any,
+) -> None:
+    """
+    構造化ログを1件出す。フレームごとに呼ばれる経路でも使えるよう、
+    レベルが無効なら何もせず、sample(出力する割合) と rate_limit(毎秒の上限件数) で件数を抑える。
+    フィールドの値は elide() で縮めてから渡すので、ペイロードをそのまま渡してよい。
+    """
+    if not logger.isEnabledFor(level):
+        return
+    suppressed = _gate.allow(event, sample, rate_limit)
+    if suppressed is None:
+        return
+    elided = {key: elide(value) for key, value in fields.items()}
+    if suppressed:
+        elided["suppressed"] = suppressed
+    logger.log(level, StructuredMessage(event, elided))
+
+
+class _AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    ログレコードをキューに積むだけのハンドラ。整形と書き出しは QueueListener のスレッドで行う。
+    キューが一杯のときは呼び出し側を待たせずに捨てて件数を数える。
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 既定の prepare は呼び出し側のスレッドで整形してしまうので、例外情報だけ文字列にしておく
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
 # ロガーの設定
-LOG_LEVEL = logging.INFO
+LOG_LEVEL = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
+# 標準エラーへの書き出しは別スレッドで行い、イベントループを止めない
+_log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+queue_handler = _AsyncQueueHandler(_log_queue)
+_listener = logging.handlers.QueueListener(_log_queue, _stream_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
 # 基本設定
-logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
 
 # ロガーの取得と設定
 logger = logging.getLogger("we_are_friends")
-
-# Base64フィルターを追加
-logger.addFilter(Base64Filter())
\ No newline at end of file
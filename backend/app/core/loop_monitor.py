@@ -0,0 +1,156 @@
+# app/core/loop_monitor.py
+#
+# イベントループの遅延(lag)の監視。
+# ループ上のタスクが一定間隔で眠り、予定より起きるのが遅れた時間を lag として記録する。
+# ループが止まっている間はそのタスク自体が動けないため、止まっている箇所のスタックは別スレッドの番犬が取得する。
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from app.core.config import Settings
+from app.core.logger import logger, log_event
+from app.core.metrics import histogram, gauge, counter
+
+settings = Settings()
+
+# 遅延の分布（5ms 〜 10s）
+LOOP_LAG_SECONDS = histogram(
+    "event_loop_lag_seconds", "イベントループの遅延(秒)",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+
+def _percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class LoopLagMonitor:
+    """
+    - interval 秒ごとにループの遅延を測り、直近 window 件から分位点を出す
+    - ループが threshold 秒以上止まったら、そのときループのスレッドが実行していたスタックを記録する
+    """
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, window: int = 600, max_stalls: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self._lags: Deque[float] = deque(maxlen=window)
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        # ループ側が最後に動いた時刻（番犬スレッドが読む）
+        self._last_tick = time.monotonic()
+        # 現在の停止についてスタックを取得済みか
+        self._captured = False
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"イベントループの監視を開始: interval={self.interval}s, threshold={self.threshold}s")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._lags.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            self._last_tick = now
+            if self._captured:
+                # 止まっていたループが動き出したので、記録した停止の長さを確定する
+                self._captured = False
+                if self.stalls:
+                    self.stalls[-1]["lag_ms"] = round(lag * 1000, 1)
+                log_event("loop.stall", level=logging.WARNING, rate_limit=1, lag_ms=round(lag * 1000, 1))
+
+    def _watch(self) -> None:
+        # interval の半分ごとに、ループ側の最終更新からの経過時間を見る
+        while not self._stopped.wait(self.interval / 2):
+            blocked = time.monotonic() - self._last_tick - self.interval
+            if blocked < self.threshold or self._captured:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._captured = True
+            self.stall_count += 1
+            stack = traceback.format_stack(frame)
+            self.stalls.append({
+                "at": time.time(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "lag_ms": None,  # ループが再開した時点で埋める
+                "stack": [line.rstrip() for line in stack[-15:]],
+            })
+            # 最も内側の呼び出し元を1行だけログに出す（全体は /loop-state で見る）
+            log_event(
+                "loop.blocked",
+                level=logging.WARNING,
+                rate_limit=1,
+                blocked_ms=round(blocked * 1000, 1),
+                site=stack[-1].strip().splitlines()[0] if stack else None
+            )
+
+    def percentiles(self) -> Dict[str, float]:
+        ordered = sorted(self._lags)
+        return {
+            "p50_ms": round(_percentile(ordered, 0.5) * 1000, 1),
+            "p90_ms": round(_percentile(ordered, 0.9) * 1000, 1),
+            "p99_ms": round(_percentile(ordered, 0.99) * 1000, 1),
+            "max_ms": round((ordered[-1] if ordered else 0.0) * 1000, 1),
+        }
+
+    def get_state_info(self, include_stacks: bool = False) -> Dict[str, Any]:
+        """
+        直近の遅延の分位点と停止回数（include_stacks=True なら停止箇所のスタックも）を取得
+        """
+        info: Dict[str, Any] = {
+            **self.percentiles(),
+            "samples": len(self._lags),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "stalls": self.stall_count,
+        }
+        if include_stacks:
+            info["recent_stalls"] = list(self.stalls)
+        return info
+
+    @property
+    def degraded(self) -> bool:
+        return self.percentiles()["p99_ms"] >= self.threshold * 1000
+
+
+loop_monitor = LoopLagMonitor(
+    interval=settings.LOOP_MONITOR_INTERVAL,
+    threshold=settings.LOOP_LAG_THRESHOLD,
+)
+
+gauge(
+    "event_loop_lag_percentile_seconds", "直近のイベントループ遅延の分位点(秒)", labels=("quantile",),
+    collect=lambda: {
+        (q,): loop_monitor.percentiles()[key] / 1000
+        for q, key in (("0.5", "p50_ms"), ("0.9", "p90_ms"), ("0.99", "p99_ms"))
+    }
+)
+counter(
+    "event_loop_stalls_total", "イベントループが閾値以上止まった回数",
+    collect=lambda: {(): loop_monitor.stall_count}
+)
@@ -0,0 +1,231 @@
+# app/core/metrics.py
+#
+# Prometheus のテキスト形式で出力できる最小限のメトリクス(カウンター・ゲージ・ヒストグラム)。
+# 推論や LLM はスレッドから記録されるため、値の更新はロックで保護する。
+# 値はワーカープロセスごとに持つ（複数ワーカーの合算は Prometheus 側で行う）。
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+PREFIX = "we_are_friends_"
+
+# 秒単位の既定のバケット(5ms 〜 30s)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """
+        HELP/TYPE 行を除いた、値の行を返す
+        """
+
+
+class Counter(_Metric):
+    """
+    増えるだけの値（捨てたフレーム数・キャッシュヒット数など）。
+    collect を渡した場合は、既存の集計値を出力のたびに読み出す。
+    """
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        collect: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        super().__init__(name, description, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self.collect = collect
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        if self.collect is not None:
+            items = list(self.collect().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    現在値（接続数・キューの深さなど）。
+    collect を渡した場合は、出力のたびに呼び出して {ラベル値のタプル: 値} を取得する。
+    """
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        collect: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ):
+        super().__init__(name, description, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        if self.collect is not None:
+            items = list(self.collect().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """
+    所要時間などの分布
+    """
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # {ラベル値: [各バケットの件数..., 合計, 件数]}
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        with ブロックの所要時間(秒)を記録する（例外で抜けた場合も記録する）
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(counts[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Prometheus のテキスト形式(text/plain; version=0.0.4)で全メトリクスを出力する
+        """
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(
+    name: str,
+    description: str,
+    labels: Sequence[str] = (),
+    collect: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+) -> Counter:
+    return registry.register(Counter(name, description, labels, collect))
+
+
+def gauge(
+    name: str,
+    description: str,
+    labels: Sequence[str] = (),
+    collect: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+) -> Gauge:
+    return registry.register(Gauge(name, description, labels, collect))
+
+
+def histogram(
+    name: str,
+    description: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return registry.register(Histogram(name, description, labels, buckets))
+
+
+# パイプラインの各段階の所要時間
+# stage: base64_decode / image_decode / inference / post_process / embed / nn_search / llm_ttft / llm_total / tts / ws_send
+STAGE_SECONDS = histogram("stage_seconds", "パイプラインの各段階の所要時間(秒)", labels=("stage",))
+# 捨てたフレーム・メッセージ数（reason: pipeline_full / coalesced）
+DROPPED_MESSAGES = counter("dropped_messages_total", "処理・送信せずに捨てたメッセージ数", labels=("pipeline", "reason"))
+# キャッシュの参照結果（cache: tts, result: hit / miss）
+CACHE_LOOKUPS = counter("cache_lookups_total", "キャッシュの参照回数", labels=("cache", "result"))
@@ -1,17 +1,39 @@
 # app/core/prompts.py
 import json
+import threading
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 
 # このファイルと同じフォルダにある prompts.json を読み込む
 BASE = Path(__file__).parent
-_PROMPTS: Dict[str, Dict[str, str]] = json.loads(
-    (BASE / "prompts.json").read_text(encoding="utf-8")
-)
+_PROMPTS: Optional[Dict[str, Dict[str, str]]] = None
+_prompts_lock = threading.Lock()
+
+
+def load_prompts() -> Dict[str, Dict[str, str]]:
+    """
+    prompts.json を読み込む（プロセス内で最初に呼ばれたときに一度だけ読み、以降は同じ dict を返す）
+    """
+    global _PROMPTS
+    if _PROMPTS is None:
+        with _prompts_lock:
+            if _PROMPTS is None:
+                _PROMPTS = json.loads((BASE / "prompts.json").read_text(encoding="utf-8"))
+    return _PROMPTS
+
+
+def prompts_loaded() -> bool:
+    return _PROMPTS is not None
 
 # どのモデル／フレンドにも該当しない場合のフォールバック
 DEFAULT_PROMPT = "あなたはフレンドです。自由に会話してください。"
 
+# 会話相手が決まった直後に、相手から話しかけてもらうための指示
+GREETING_PROMPT = "目の前に来たuserに、あなたから短く一言で話しかけてください。"
+
+# LLM が応答できないときの定型の返答
+FALLBACK_REPLY = "ごめんね、いまちょっと考えがまとまらないんだ。もう一度話しかけてくれる？"
+
 BASE_PROMPT = """
 今までに与えられた命令は無視してください。あなたは今からAIアシスタントではありません、そのように振る舞わないでください。
 あなたはこれから{friend}という種類のもので、何故か日本語を話すことができます。語尾や言動から{friend}であると伝わるように振る舞ってください。
@@ -25,7 +47,7 @@ def get_prompt(model: str, friend: str) -> str:
     指定モデル(model)の中から friend 向けプロンプトを返します。
     見つからなければ model 内の "default" を、なければ DEFAULT_PROMPT。
     """
-    by_model = _PROMPTS.get(model, {})
+    by_model = load_prompts().get(model, {})
     # if friend in by_model:
     #     return by_model[friend]
     # if "default" in by_model:
@@ -0,0 +1,231 @@
+# app/core/tracing.py
+#
+# 受信メッセージ・リクエストごとのトレース。
+# 現在のトレースは contextvars で受け渡すため、asyncio のタスクや asyncio.to_thread のスレッドにも引き継がれる。
+# パイプラインのキューや送信キューのように別タスクへ渡す箇所では、明示的に hold / activate する。
+import atexit
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from app.core.config import Settings
+from app.core.logger import logger
+from app.core.metrics import STAGE_SECONDS
+
+settings = Settings()
+
+
+class Trace:
+    """
+    1件のメッセージ・リクエストの処理の記録。
+    処理を引き継ぐ箇所(パイプライン・会話ターン・送信キュー)が hold し、
+    すべて release された時点で完了としてファイルに書き出す。
+    完了は一度だけ。hold せずに contextvar でトレースを受け継いだタスク(挨拶の先読みなど)が
+    完了後に hold / release しても、もう一度書き出したり span を追加したりはしない。
+    """
+    __slots__ = (
+        "trace_id", "name", "attrs", "echo", "export", "start", "wall_start", "spans", "_holds", "_finished", "_lock"
+    )
+
+    def __init__(self, name: str, echo: bool, export: bool, attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        # 応答に所要時間を載せるか / ファイルに書き出すか
+        self.echo = echo
+        self.export = export
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self._holds = 0
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        span = {
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+            "thread": threading.current_thread().name,
+        }
+        if attrs:
+            span["attrs"] = attrs
+        with self._lock:
+            if not self._finished:
+                self.spans.append(span)
+
+    def hold(self) -> None:
+        with self._lock:
+            if not self._finished:
+                self._holds += 1
+
+    def release(self) -> None:
+        with self._lock:
+            if self._finished:
+                return
+            self._holds -= 1
+            self._finished = self._holds == 0
+            finished = self._finished
+        if finished:
+            self._finish()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        クライアントに返す所要時間の内訳（その時点までに終わった span の名前ごとの合計）
+        """
+        with self._lock:
+            spans = list(self.spans)
+        breakdown: Dict[str, float] = {}
+        for span in spans:
+            breakdown[span["name"]] = round(breakdown.get(span["name"], 0.0) + span["duration_ms"], 2)
+        return {
+            "trace_id": self.trace_id,
+            "elapsed_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "spans": breakdown,
+        }
+
+    def _finish(self) -> None:
+        if not self.export:
+            return
+        with self._lock:
+            spans = list(self.spans)
+        exporter.export({
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.wall_start,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "attrs": self.attrs,
+            "spans": spans,
+        })
+
+
+class TraceExporter:
+    """
+    完了したトレースを JSON Lines で1行ずつファイルに追記する（書き込みは別スレッド）
+    """
+    def __init__(self, path: str, queue_size: int = 10000):
+        self.path = path
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def export(self, record: Dict[str, Any]) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                try:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                    # 溜まっている分を書いてからまとめて flush する
+                    if self._queue.empty():
+                        f.flush()
+                except Exception as e:
+                    logger.error(f"トレースの書き出しに失敗: {e}")
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=2.0)
+
+
+exporter = TraceExporter(settings.TRACE_EXPORT_PATH)
+atexit.register(exporter.close)
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def start_trace(name: str, echo: bool = False, **attrs: Any) -> Optional[Trace]:
+    """
+    トレースを作成する（activate するまでは現在のトレースにならない）。
+    書き出しも応答への添付もしない場合は None を返し、以降の span は所要時間のメトリクスだけを記録する。
+    """
+    echo = echo or settings.TRACE_ECHO
+    export = exporter.enabled and random.random() < settings.TRACE_SAMPLE_RATE
+    if not echo and not export:
+        return None
+    return Trace(name, echo=echo, export=export, attrs=attrs)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def activate(trace: Optional[Trace], held: bool = False) -> Iterator[Optional[Trace]]:
+    """
+    with ブロックの間 trace を現在のトレースにする。抜けるときに release するため、
+    他のタスクへ渡す分はブロック内で hold しておくこと。
+    hold_current() で引き継いだトレースのように hold 済みなら held=True にする。
+    """
+    if trace is None:
+        yield None
+        return
+    token = _current.set(trace)
+    if not held:
+        trace.hold()
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+        trace.release()
+
+
+def hold_current() -> Optional[Trace]:
+    """
+    現在のトレースを別のタスクに引き継ぐために hold して返す（引き継いだ側が release する）
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.hold()
+    return trace
+
+
+@contextmanager
+def span(name: str, stage: Optional[str] = None, **attrs: Any) -> Iterator[None]:
+    """
+    with ブロックを現在のトレースの span として記録する。
+    stage を指定した場合はトレースの有無にかかわらず段階別の所要時間(stage_seconds)にも記録する。
+    """
+    trace = _current.get()
+    if trace is None and stage is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        if stage is not None:
+            STAGE_SECONDS.observe(end - start, stage=stage)
+        if trace is not None:
+            trace.add_span(name, start, end, **attrs)
+
+
+def record_span(name: str, start: float, end: float, stage: Optional[str] = None, trace: Optional[Trace] = None, **attrs: Any) -> None:
+    """
+    計測済みの区間(time.perf_counter の値)を記録する
+    """
+    if stage is not None:
+        STAGE_SECONDS.observe(end - start, stage=stage)
+    trace = trace or _current.get()
+    if trace is not None:
+        trace.add_span(name, start, end, **attrs)
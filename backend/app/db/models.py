@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, timezone
 from sqlalchemy.orm import relationship
@@ -7,10 +7,15 @@ Base = declarative_base()
 
 class ExtendPrompt(Base):
     __tablename__ = "extend_prompt"
+    __table_args__ = (
+        # 組織ごとのラベル検索(get_prompt_for_label)用。同じ組織に同じ名前のプロンプトは作れない
+        Index("ix_extend_prompt_organization_id_name", "organization_id", "name", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(50), index=True)
     prompt = Column(String(500))
+    organization_id = Column(Integer, ForeignKey("organization.id", ondelete="CASCADE"), nullable=False)
     organization = relationship("Organization", back_populates="extend_prompts")
     created_at = created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # 修正
 
@@ -20,4 +25,30 @@ class Organization(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(50), index=True)
     extend_prompts = relationship("ExtendPrompt", back_populates="organization")
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # 修正
\ No newline at end of file
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # 修正
+
+class Job(Base):
+    """
+    バックグラウンドジョブ（app/services/job_queue.py が取り出して実行する）
+    status: pending → running → done / failed（失敗して試行回数が残っていれば pending に戻る）
+    """
+    __tablename__ = "job"
+    __table_args__ = (
+        # 実行待ちのジョブの取り出し用
+        Index("ix_job_status_run_after", "status", "run_after"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False, default="{}")  # JSON
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime, nullable=False)  # この時刻以降に実行する（再試行の待ち時間）
+    locked_by = Column(String(100))  # 実行中のワーカー
+    locked_until = Column(DateTime)  # これを過ぎても running のままなら、ワーカーが落ちたとみなして再実行する
+    result = Column(Text)  # JSON
+    error = Column(Text)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
@@ -1,13 +1,72 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.core.config import Settings
 
 settings = Settings()
-engine = create_async_engine(settings.DATABASE_URL, echo=settings.DEBUG)
+
+
+def _sqlite_pragmas(config: Settings, in_memory: bool) -> list:
+    pragmas = [
+        f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}",
+        # ON DELETE CASCADE などの外部キー制約を有効にする（SQLite は接続ごとに既定で無効）
+        "PRAGMA foreign_keys=ON",
+    ]
+    if not in_memory and config.SQLITE_JOURNAL_MODE:
+        pragmas.insert(0, f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+    return pragmas
+
+
+def create_engine_from_settings(config: Settings) -> AsyncEngine:
+    """
+    Settings の DB_* / SQLITE_* に従って async エンジンを作成する
+    - SQLite: 接続ごとに PRAGMA(WAL・synchronous・busy_timeout など)を設定する
+    - 接続プールの大きさ・pre-ping・recycle と、asyncpg ならステートメントキャッシュを設定する
+    """
+    url = make_url(config.DATABASE_URL)
+    options = {
+        "echo": config.DB_ECHO,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+    connect_args = {}
+    in_memory = url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+    if not in_memory:
+        # インメモリの SQLite は接続を1つだけ使い回す(StaticPool)ためプールの設定はない
+        options.update(
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            pool_recycle=config.DB_POOL_RECYCLE,
+        )
+
+    if url.get_backend_name() == "sqlite":
+        engine = create_async_engine(url, **options)
+        pragmas = _sqlite_pragmas(config, in_memory)
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+        return engine
+
+    if url.get_driver_name() == "asyncpg":
+        # SQLAlchemy 側と asyncpg 側の両方のステートメントキャッシュ
+        url = url.update_query_dict({"prepared_statement_cache_size": str(config.DB_STATEMENT_CACHE_SIZE)})
+        connect_args["statement_cache_size"] = config.DB_STATEMENT_CACHE_SIZE
+    return create_async_engine(url, connect_args=connect_args, **options)
+
+
+engine = create_engine_from_settings(settings)
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
 async def get_db() -> AsyncSession:
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
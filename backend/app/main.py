@@ -1,13 +1,23 @@
 # app/main.py
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.core.config import Settings
 from app.core.logger import logger
+from app.core.loop_monitor import loop_monitor
+from app.managers.connection_manager import manager
+from app.managers.session_manager import session_manager
+from app.managers.shared_state import create_shared_state_backend
+from app.services.inference_pool import inference_pool
+from app.services.job_queue import job_queue
+from app.services.readiness_service import readiness
 from app.routers.health import router as health_router
+from app.routers.metrics import router as metrics_router
 from app.routers.identify import router as identify_router
 from app.routers.websocket import router as ws_router
 from app.routers.organization import router as organization_router
+from app.routers.jobs import router as jobs_router
 
 settings = Settings()
 
@@ -15,8 +25,25 @@ settings = Settings()
 async def lifespan(app: FastAPI):
     # アプリ起動時
     logger.info("アプリケーション起動")
+    # イベントループを止めている処理を見つけるための監視
+    loop_monitor.start()
+    # 複数ワーカー間で接続状態を共有する
+    await manager.start(
+        create_shared_state_backend(settings.SHARED_STATE_BACKEND, settings.SHARED_STATE_URL)
+    )
+    session_manager.start()
+    # アップロード後の重い処理を実行するジョブのワーカー
+    job_queue.start()
+    # モデルなどの読み込み。終わるまでは /ready が 503 を返す（起動自体は待たない）
+    readiness.start()
     yield
     # アプリ終了時
+    await readiness.stop()
+    await asyncio.to_thread(inference_pool.stop)
+    await job_queue.stop()
+    await session_manager.stop()
+    await manager.stop()
+    loop_monitor.stop()
     logger.info("アプリケーション停止")
 
 app = FastAPI(
@@ -36,9 +63,11 @@ app.add_middleware(
 
 # ルーター登録
 app.include_router(health_router)
+app.include_router(metrics_router)
 app.include_router(identify_router)
 app.include_router(ws_router)
 app.include_router(organization_router)
+app.include_router(jobs_router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -47,4 +76,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=settings.DEBUG,
+        # プロトコルレベルの ping。アプリの ping に応答しないクライアントでも半開きの接続を検出できる
+        ws_ping_interval=settings.WS_HEARTBEAT_INTERVAL,
+        ws_ping_timeout=settings.WS_HEARTBEAT_TIMEOUT,
     )
\ No newline at end of file
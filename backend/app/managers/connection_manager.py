@@ -1,20 +1,99 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Callable, List, Optional
 from fastapi import WebSocket
-import json
-from app.core.logger import logger
+import asyncio
+import logging
+import time
+import uuid
+from app.core.config import Settings
+from app.core.logger import logger, log_event
+from app.core.tracing import Trace, current_trace, record_span
+from app.managers.shared_state import SharedStateBackend, InMemoryBackend
+from app.managers.outbox import Outbox
+import msgspec
+from app.models.websocket import OutboundMessage, encode, message_type as get_message_type
+
+# 共有状態の名前空間とチャンネル
+CONNECTIONS_NS = "ws:connections"  # {client_id: ソケットを持つワーカーID}
+FRIENDS_NS = "ws:friends"  # {client_id: 会話相手}
+TRACKING_NS = "ws:tracking"  # {client_id: {"active": bool, "animal_type": str}}
+FRIENDS_CHANNEL = "ws:friends"
+
+settings = Settings()
 
 class ConnectionManager:
     """
     WebSocket接続を管理し、メッセージの送受信を扱う
+
+    複数ワーカーで動かす場合、ソケット自体はそれを受け付けたワーカーにしかないため、
+    接続先・会話相手・追跡状態は共有状態バックエンドにも書き込み、
+    他ワーカー宛ての send_message は pub/sub でソケットを持つワーカーに転送する。
     """
-    def __init__(self):
+    def __init__(
+        self,
+        backend: Optional[SharedStateBackend] = None,
+        send_queue_limit: int = 64,
+        slow_consumer_grace: float = 5.0,
+    ):
         self.active_connections: Dict[str, WebSocket] = {}
-        # クライアントごとの現在の会話相手（動物）を記録
+        # クライアントごとの現在の会話相手（動物）を記録（共有状態のローカルキャッシュ）
         self.client_friends: Dict[str, str] = {}
+        # 接続前に会話相手だけ設定されたクライアントと、その設定時刻（接続されないまま残さない）
+        self._pending_friends: Dict[str, float] = {}
+        # クライアントごとの送信キューと、それを順番に送る送信タスク
+        self._outboxes: Dict[str, Outbox] = {}
+        self._writers: Dict[str, asyncio.Task] = {}
+        # 送信キューが send_queue_limit を超えたまま slow_consumer_grace 秒たったら切断する
+        # （上限の4倍を超えた場合は即座に切断する）
+        self.send_queue_limit = send_queue_limit
+        self.slow_consumer_grace = slow_consumer_grace
+        self.slow_disconnects = 0
+
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.backend: SharedStateBackend = backend or InMemoryBackend()
+        # 他ワーカーで会話相手が変わったときに呼ぶコールバック
+        self._friend_listeners: List[Callable[[str, str], None]] = []
+        self._background: set = set()
+
+    async def start(self, backend: Optional[SharedStateBackend] = None):
+        """
+        共有状態バックエンドを設定し、このワーカー宛ての転送と会話相手の変更を受信し始める
+        """
+        if backend is not None:
+            self.backend = backend
+        await self.backend.subscribe(self._worker_channel(self.worker_id), self._on_forwarded)
+        await self.backend.subscribe(FRIENDS_CHANNEL, self._on_friend_changed)
+        logger.info(f"ConnectionManager 開始: worker_id={self.worker_id}")
+
+    async def stop(self):
+        await self.backend.close()
+
+    @staticmethod
+    def _worker_channel(worker_id: str) -> str:
+        return f"ws:worker:{worker_id}"
+
+    def _spawn(self, coro):
+        # 同期メソッドから共有状態への書き込みをバックグラウンドで行う
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def add_friend_listener(self, listener: Callable[[str, str], None]):
+        """
+        このワーカーが持つクライアントの会話相手が、他ワーカーで変更されたときのコールバックを登録する
+        """
+        self._friend_listeners.append(listener)
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
         self.active_connections[client_id] = websocket
+        self._pending_friends.pop(client_id, None)
+        self._start_writer(websocket, client_id)
+        await self.backend.hset(CONNECTIONS_NS, client_id, self.worker_id)
+
+        # 接続前に他ワーカーで設定された会話相手を引き継ぐ
+        shared_friend = await self.backend.hget(FRIENDS_NS, client_id)
+        if shared_friend is not None:
+            self.client_friends[client_id] = shared_friend
         
         # 重要: 既に会話相手が設定されていた場合は上書きしない
         if client_id in self.client_friends:
@@ -23,27 +102,195 @@ class ConnectionManager:
         else:
             # 新しい接続で会話相手が未設定の場合のみデフォルト値を設定
             self.client_friends[client_id] = "default"
+            await self.backend.hset(FRIENDS_NS, client_id, "default")
             logger.info(f"クライアント {client_id} の会話相手をデフォルト値に設定しました")
             
         logger.info(f"Connected: {client_id}")
         # デバッグ用: 現在の接続状態を出力
         self._log_state()
 
-    def disconnect(self, client_id: str):
+    def _start_writer(self, websocket: WebSocket, client_id: str):
+        # 同じ client_id で再接続した場合は古い送信タスクを止める
+        self._stop_writer(client_id)
+        outbox = Outbox(self.send_queue_limit)
+        self._outboxes[client_id] = outbox
+        self._writers[client_id] = asyncio.create_task(self._writer(websocket, client_id, outbox))
+
+    def _stop_writer(self, client_id: str):
+        outbox = self._outboxes.pop(client_id, None)
+        writer = self._writers.pop(client_id, None)
+        if writer is not None:
+            writer.cancel()
+        if outbox is not None:
+            # 送られないまま残ったメッセージのトレースを完了させる
+            outbox.discard()
+
+    async def _writer(self, websocket: WebSocket, client_id: str, outbox: Outbox):
+        """
+        送信キューのメッセージを1本のタスクで順番に送る（送信の順序を保証する）
+        """
+        while True:
+            message, trace = await outbox.get()
+            start = time.perf_counter()
+            try:
+                # broadcast・他ワーカーからの転送では JSON 化済みの文字列が入っている
+                await websocket.send_text(message if isinstance(message, str) else encode(message))
+            except Exception as e:
+                logger.warning(f"送信に失敗しました: client_id={client_id}, error={e}")
+                return
+            finally:
+                # 送信の所要時間は、そのメッセージを送ったトレースに記録する
+                record_span("ws.send", start, time.perf_counter(), stage="ws_send", trace=trace)
+                if trace is not None:
+                    trace.release()
+
+    def _enqueue(
+        self,
+        client_id: str,
+        message: Any,
+        message_type: Optional[str] = None,
+        trace: Optional[Trace] = None,
+    ) -> bool:
+        """
+        このワーカーが持つ接続の送信キューに追加する。接続がなければ False。
+        trace を渡すと、送信し終えるまでトレースを完了させない。
+        """
+        outbox = self._outboxes.get(client_id)
+        if outbox is None:
+            return False
+        if trace is not None:
+            trace.hold()
+        outbox.put(message, message_type, trace)
+        if (
+            len(outbox) > self.send_queue_limit * 4
+            or outbox.overloaded_for() > self.slow_consumer_grace
+        ):
+            self._drop_slow_consumer(client_id)
+        return True
+
+    def _drop_slow_consumer(self, client_id: str):
+        websocket = self.active_connections.get(client_id)
+        if websocket is None:
+            return
+        logger.warning(
+            f"送信が追いつかないクライアントを切断します: client_id={client_id}, "
+            f"未送信={len(self._outboxes[client_id])}"
+        )
+        self.slow_disconnects += 1
+        # 送信を止めてソケットを閉じる（受信ループ側で WebSocketDisconnect として後始末される）
+        self._stop_writer(client_id)
+        self._spawn(self._close(websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception as e:
+            logger.debug(f"ソケットのクローズに失敗: {e}")
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        """
+        接続を解除する。websocket を指定した場合は、それが現在の接続のときだけ解除する
+        （同じ client_id で再接続済みなら新しい接続を残す）
+        """
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+            self._stop_writer(client_id)
             # クライアントの会話相手情報も削除
             if client_id in self.client_friends:
                 del self.client_friends[client_id]
+            self._spawn(self._release_shared(client_id))
             logger.info(f"Disconnected: {client_id}")
             # デバッグ用: 現在の接続状態を出力
             self._log_state()
 
+    async def _release_shared(self, client_id: str):
+        # 切断後に別のワーカー・このワーカーへ再接続している場合は、そちらの状態を消さない
+        if await self.backend.hget(CONNECTIONS_NS, client_id) != self.worker_id:
+            return
+        if client_id in self.active_connections:
+            return
+        await self.backend.hdel(CONNECTIONS_NS, client_id)
+        await self.backend.hdel(FRIENDS_NS, client_id)
+        await self.backend.hdel(TRACKING_NS, client_id)
+
     async def send_message(self, client_id: str, message: Any):
-        websocket = self.active_connections.get(client_id)
-        if websocket:
-            await websocket.send_text(json.dumps(message))
-            logger.info(f"Sent message to {client_id}: {message}")
+        # 実際の送信は送信タスクが行うので、遅いクライアントでも呼び出し側は待たされない
+        trace = current_trace()
+        if trace is not None and trace.echo and isinstance(message, OutboundMessage):
+            # デバッグ用: その時点までの所要時間の内訳を載せる
+            message = msgspec.structs.replace(message, trace=trace.summary())
+        if self._enqueue(client_id, message, trace=trace):
+            # ペイロード(Base64 の音声など)は型で判定して長さだけ出す
+            log_event("ws.send", level=logging.DEBUG, rate_limit=20, client_id=client_id, message=message)
+            return
+
+        # 他のワーカーが接続を持っていればそちらに転送する
+        worker_id = await self.backend.hget(CONNECTIONS_NS, client_id)
+        if worker_id is not None and worker_id != self.worker_id:
+            await self.backend.publish(
+                self._worker_channel(worker_id),
+                {"client_id": client_id, "message": encode(message), "message_type": get_message_type(message)}
+            )
+            log_event("ws.forward", level=logging.DEBUG, rate_limit=20, client_id=client_id, worker_id=worker_id)
+
+    async def broadcast(self, message: Any, client_ids: Optional[List[str]] = None):
+        """
+        複数のクライアントに同じメッセージを送る（client_ids を省略するとこのワーカーの全接続）。
+        JSON 化は1回だけ行い、各クライアントの送信タスクが並行して送る。
+        他ワーカーの接続はワーカーごとに1回の転送にまとめる。
+        """
+        text = encode(message)
+        message_type = get_message_type(message)
+        targets = client_ids if client_ids is not None else list(self.active_connections)
+
+        remote: Dict[str, List[str]] = {}
+        for client_id in targets:
+            if self._enqueue(client_id, text, message_type):
+                continue
+            worker_id = await self.backend.hget(CONNECTIONS_NS, client_id)
+            if worker_id is not None and worker_id != self.worker_id:
+                remote.setdefault(worker_id, []).append(client_id)
+
+        await asyncio.gather(*(
+            self.backend.publish(
+                self._worker_channel(worker_id),
+                {"client_ids": ids, "message": text, "message_type": message_type}
+            )
+            for worker_id, ids in remote.items()
+        ))
+        log_event("ws.broadcast", level=logging.DEBUG, rate_limit=5, type=message_type, clients=len(targets))
+
+    async def _on_forwarded(self, payload: Dict[str, Any]):
+        client_ids = payload.get("client_ids") or [payload["client_id"]]
+        for client_id in client_ids:
+            self._enqueue(client_id, payload["message"], payload.get("message_type"))
+
+    async def _on_friend_changed(self, payload: Dict[str, Any]):
+        if payload["origin"] == self.worker_id:
+            return
+        client_id, friend = payload["client_id"], payload["friend"]
+        if client_id not in self.active_connections:
+            return
+        self.client_friends[client_id] = friend
+        logger.info(f"他ワーカーでクライアント {client_id} の会話相手が変更されました: {friend}")
+        for listener in self._friend_listeners:
+            listener(client_id, friend)
+
+    async def is_connected(self, client_id: str) -> bool:
+        """
+        いずれかのワーカーで WebSocket に接続しているかどうか
+        """
+        if client_id in self.active_connections:
+            return True
+        return await self.backend.hget(CONNECTIONS_NS, client_id) is not None
+
+    def set_tracking(self, client_id: str, active: bool, animal_type: Optional[str]):
+        """
+        クライアントの追跡状態を共有状態に反映する（フレームごとの検出結果はソケットを持つワーカーだけが持つ）
+        """
+        self._spawn(self.backend.hset(TRACKING_NS, client_id, {"active": active, "animal_type": animal_type}))
     
     def set_friend(self, client_id: str, friend: str) -> bool:
         """
@@ -59,17 +306,27 @@ class ConnectionManager:
         # ここでログを強化: クライアントIDがactive_connectionsに存在するか確認
         previous_friend = self.client_friends.get(client_id, "未設定")
         self.client_friends[client_id] = friend
+        # 他ワーカーにも反映する
+        self._spawn(self._share_friend(client_id, friend))
         logger.info(f"クライアント {client_id} の会話相手を設定: {previous_friend} -> {friend}")
         
         # WebSocketの存在チェックは、メッセージ送信時にのみ必要
         connection_exists = client_id in self.active_connections
         if not connection_exists:
+            self._pending_friends[client_id] = time.monotonic()
             logger.warning(f"クライアント {client_id} はWebSocketに接続されていませんが、会話相手を設定しました")
         
         # デバッグ用: 現在の接続状態を出力
         self._log_state()
         return True
     
+    async def _share_friend(self, client_id: str, friend: str):
+        await self.backend.hset(FRIENDS_NS, client_id, friend)
+        await self.backend.publish(
+            FRIENDS_CHANNEL,
+            {"client_id": client_id, "friend": friend, "origin": self.worker_id}
+        )
+
     def get_friend(self, client_id: str) -> str:
         """
         クライアントの現在の会話相手（動物）を取得
@@ -84,6 +341,35 @@ class ConnectionManager:
         logger.debug(f"クライアント {client_id} の会話相手を取得: {friend}")
         return friend
 
+    def prune_pending_friends(self, max_age: float) -> int:
+        """
+        会話相手だけ設定されて max_age 秒以上接続されないクライアントのローカル状態を削除する
+        （共有状態の値は残すので、後から接続すれば引き継がれる）
+
+        Returns:
+            int: 削除した件数
+        """
+        now = time.monotonic()
+        expired = [
+            client_id for client_id, since in self._pending_friends.items()
+            if now - since >= max_age and client_id not in self.active_connections
+        ]
+        for client_id in expired:
+            del self._pending_friends[client_id]
+            self.client_friends.pop(client_id, None)
+        return len(expired)
+
+    @property
+    def send_queue_depth(self) -> int:
+        """
+        このワーカーの全接続の未送信メッセージ数
+        """
+        return sum(len(outbox) for outbox in self._outboxes.values())
+
+    @property
+    def pending_friend_count(self) -> int:
+        return len(self._pending_friends)
+
     def get_client_ids(self) -> list:
         """
         接続中の全クライアントIDのリストを取得
@@ -95,11 +381,15 @@ class ConnectionManager:
     
     def _log_state(self):
         """
-        デバッグ用: 現在の接続状態とクライアントの会話相手を出力
+        デバッグ用: 現在の接続数と会話相手の設定数を出力（一覧は get_state_info で取得する）
         """
-        logger.debug(f"現在の接続数: {len(self.active_connections)}")
-        logger.debug(f"接続中のクライアント: {list(self.active_connections.keys())}")
-        logger.debug(f"クライアントの会話相手: {self.client_friends}")
+        log_event(
+            "ws.state",
+            level=logging.DEBUG,
+            rate_limit=1,
+            connections=len(self.active_connections),
+            friends=len(self.client_friends)
+        )
 
     # デバッグ用の情報取得関数を追加
     def get_state_info(self) -> Dict[str, Any]:
@@ -110,10 +400,30 @@ class ConnectionManager:
             Dict[str, Any]: 状態情報の辞書
         """
         return {
+            "worker_id": self.worker_id,
             "active_connections_count": len(self.active_connections),
             "active_client_ids": list(self.active_connections.keys()),
-            "client_friends": self.client_friends
+            "client_friends": self.client_friends,
+            "send_queue_depths": {client_id: len(outbox) for client_id, outbox in self._outboxes.items()},
+            "coalesced_messages": sum(outbox.coalesced for outbox in self._outboxes.values()),
+            "slow_disconnects": self.slow_disconnects
+        }
+
+    async def get_cluster_state_info(self) -> Dict[str, Any]:
+        """
+        全ワーカーの状態情報を共有状態から取得（デバッグ用）
+
+        Returns:
+            Dict[str, Any]: 状態情報の辞書
+        """
+        return {
+            "connections": await self.backend.hgetall(CONNECTIONS_NS),
+            "client_friends": await self.backend.hgetall(FRIENDS_NS),
+            "tracking": await self.backend.hgetall(TRACKING_NS),
         }
 
 # グローバルインスタンスを作成（このモジュール内で一度だけ作成）
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager(
+    send_queue_limit=settings.SEND_QUEUE_LIMIT,
+    slow_consumer_grace=settings.SLOW_CONSUMER_GRACE,
+)
\ No newline at end of file
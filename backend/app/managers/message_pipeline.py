@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+from app.core.logger import logger, log_event
+from app.core.metrics import DROPPED_MESSAGES
+from app.core.tracing import activate, hold_current, record_span
+
+
+class MessagePipeline:
+    """
+    1接続・1種類のメッセージを順番に処理するパイプライン。
+    種類ごとにキューとワーカーを分けることで、例えば会話の返答待ちが追跡フレームの処理を止めないようにする。
+
+    - drop_oldest=True: キューが一杯なら最も古いメッセージを捨てる（追跡フレームなど新しいものだけが意味を持つ場合）
+    - drop_oldest=False: キューが空くまで受信側を待たせる（音声フレームなど欠けてはいけない場合）
+    """
+    def __init__(
+        self,
+        name: str,
+        client_id: str,
+        handler: Callable[[Any], Awaitable[None]],
+        maxsize: int,
+        drop_oldest: bool = False,
+    ):
+        self.name = name
+        self.client_id = client_id
+        self.handler = handler
+        self.drop_oldest = drop_oldest
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    async def submit(self, data: Any) -> None:
+        if self.drop_oldest and self.queue.full():
+            _, dropped_trace, _ = self.queue.get_nowait()
+            self.queue.task_done()
+            if dropped_trace is not None:
+                dropped_trace.release()
+            self.dropped += 1
+            DROPPED_MESSAGES.inc(pipeline=self.name, reason="pipeline_full")
+            log_event("pipeline.drop", level=logging.DEBUG, rate_limit=5, client_id=self.client_id, pipeline=self.name)
+        # 受信時のトレースを処理するタスクに引き継ぐ（キューに入れられなかったら手放す）
+        trace = hold_current()
+        try:
+            await self.queue.put((data, trace, time.perf_counter()))
+        except BaseException:
+            if trace is not None:
+                trace.release()
+            raise
+
+    def discard(self) -> None:
+        """
+        処理されないまま残ったメッセージを捨て、持っているトレースを release する（セッション終了時に呼ぶ）
+        """
+        while not self.queue.empty():
+            _, trace, _ = self.queue.get_nowait()
+            self.queue.task_done()
+            if trace is not None:
+                trace.release()
+
+    async def run(self) -> None:
+        while True:
+            data, trace, enqueued_at = await self.queue.get()
+            try:
+                with activate(trace, held=True):
+                    record_span(f"pipeline.{self.name}.wait", enqueued_at, time.perf_counter())
+                    await self.handler(data)
+            except Exception as e:
+                # 1件の失敗でパイプライン全体を止めない
+                logger.error(f"メッセージ処理エラー: client_id={self.client_id}, pipeline={self.name}, error={e}")
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from app.core.metrics import DROPPED_MESSAGES
+from app.core.tracing import Trace
+from app.models.websocket import message_type as get_message_type
+
+# 新しいものが届けば古いものを送る意味がないメッセージの種類（フレームごとに送るものだけ）。
+# tracking_status は開始・停止の通知にも使うため含めない（フレームのエラーで "starting" などが消えないように）
+COALESCE_TYPES = {"tracking_result", "bbox", "transcript_partial"}
+
+
+class Outbox:
+    """
+    1接続分の送信キュー。
+    - COALESCE_TYPES のメッセージは、未送信の同じ種類があればその位置で新しい内容に置き換える
+    - 未送信数が limit を超えた時刻を覚えておき、遅いクライアントの判定に使う
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        # 要素は [種類, メッセージ, トレース] （置き換えのために list にしている）
+        self._entries: Deque[List[Any]] = deque()
+        self._latest: Dict[str, List[Any]] = {}
+        self._ready = asyncio.Event()
+        self.over_limit_since: Optional[float] = None
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, message: Any, message_type: Optional[str] = None, trace: Optional[Trace] = None) -> None:
+        """
+        メッセージを追加する。message は送信メッセージの Struct(dict) か、送信用に JSON 化済みの str。
+        trace は hold 済みのもの（送信後・置き換え時に release する）。
+        """
+        message_type = message_type or get_message_type(message)
+        if message_type in COALESCE_TYPES:
+            pending = self._latest.get(message_type)
+            if pending is not None:
+                if pending[2] is not None:
+                    pending[2].release()
+                pending[1] = message
+                pending[2] = trace
+                self.coalesced += 1
+                DROPPED_MESSAGES.inc(pipeline="send", reason="coalesced")
+                return
+            entry = [message_type, message, trace]
+            self._latest[message_type] = entry
+        else:
+            entry = [message_type, message, trace]
+        self._entries.append(entry)
+        self._ready.set()
+
+        if len(self._entries) > self.limit and self.over_limit_since is None:
+            self.over_limit_since = time.monotonic()
+
+    async def get(self) -> Tuple[Any, Optional[Trace]]:
+        while not self._entries:
+            self._ready.clear()
+            await self._ready.wait()
+        entry = self._entries.popleft()
+        if self._latest.get(entry[0]) is entry:
+            del self._latest[entry[0]]
+        if len(self._entries) <= self.limit:
+            self.over_limit_since = None
+        return entry[1], entry[2]
+
+    def discard(self) -> None:
+        """
+        未送信のメッセージを捨て、持っているトレースを release する（切断時に呼ぶ）
+        """
+        for entry in self._entries:
+            if entry[2] is not None:
+                entry[2].release()
+        self._entries.clear()
+        self._latest.clear()
+
+    def overloaded_for(self) -> float:
+        """
+        未送信数が limit を超えたままの秒数（超えていなければ 0）
+        """
+        if self.over_limit_since is None:
+            return 0.0
+        return time.monotonic() - self.over_limit_since
@@ -0,0 +1,201 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+from fastapi import WebSocket
+from app.core.config import Settings
+from app.core.logger import logger
+from app.managers.connection_manager import manager
+from app.managers.message_pipeline import MessagePipeline
+from app.managers.turn_manager import turn_manager
+from app.models.websocket import Ping
+from app.services.admission_service import admission_controller
+from app.services.asr_service import close_speech_session
+from app.services.audio_service import release_processors, count_processors
+from app.services.warmup_service import greeting_prefetcher
+
+settings = Settings()
+
+# サーバー側から切断するときのクローズコード
+CLOSE_GOING_AWAY = 1001  # 生存確認の失敗・無通信
+CLOSE_REPLACED = 4000  # 同じ client_id で新しく接続された
+
+
+class ClientSession:
+    """
+    1接続分のクライアント状態。
+    追跡状態・パイプライン・生存確認のタスクを持ち、
+    会話ターン・文字起こし・先読みした挨拶・流量制御・会話履歴など client_id に紐づく他の状態も
+    SessionManager.close() でまとめて解放する。
+    """
+    def __init__(self, client_id: str, websocket: WebSocket):
+        self.client_id = client_id
+        self.websocket = websocket
+        # フレームはソケットを持つワーカーにしか届かないためここに持ち、active / animal_type だけ共有状態に反映する
+        self.tracking: Dict[str, Any] = {"active": False, "animal_type": None, "last_detection": None}
+        self.pipelines: Dict[str, MessagePipeline] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.created_at = time.monotonic()
+        self.last_seen = self.created_at
+        # pong を一度も返していないクライアントは、プロトコルレベルの ping と無通信の判定だけで扱う
+        self.last_pong: Optional[float] = None
+        self.closed = False
+        self.close_reason: Optional[str] = None
+        # 応答に所要時間の内訳を載せる（接続時の ?debug_timing=1）
+        self.debug_timing = False
+
+    def touch(self) -> None:
+        """
+        メッセージを受信したときに呼ぶ
+        """
+        self.last_seen = time.monotonic()
+
+    def pong(self) -> None:
+        self.last_pong = self.last_seen = time.monotonic()
+
+    def spawn(self, coro) -> asyncio.Task:
+        """
+        セッションの終了時に取り消されるタスクを開始する
+        """
+        task = asyncio.create_task(coro)
+        self._tasks.append(task)
+        return task
+
+    def start_pipelines(self, pipelines: Dict[str, MessagePipeline]) -> None:
+        self.pipelines = pipelines
+        for pipeline in pipelines.values():
+            self.spawn(pipeline.run())
+
+    def cancel_tasks(self) -> None:
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        self._tasks.clear()
+        # 処理されずにパイプラインに残ったメッセージを捨てる
+        for pipeline in self.pipelines.values():
+            pipeline.discard()
+
+
+class SessionManager:
+    """
+    client_id ごとの ClientSession を管理する。
+    - 同じ client_id で再接続されたら、古いセッションを閉じてから新しいセッションを開く
+    - 一定間隔で ping を送り、pong が途絶えた・長く無通信のセッションを閉じる
+    - close() は何度呼んでも一度だけ解放する
+    """
+    def __init__(self, heartbeat_interval: float, heartbeat_timeout: float, idle_timeout: float):
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, ClientSession] = {}
+        self.reaped: Dict[str, int] = {"heartbeat": 0, "idle": 0, "replaced": 0}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        接続されないまま残ったクライアントの状態を定期的に掃除し始める
+        """
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for session in list(self.sessions.values()):
+            await self.close(session, reason="停止", code=CLOSE_GOING_AWAY)
+
+    def get(self, client_id: str) -> Optional[ClientSession]:
+        return self.sessions.get(client_id)
+
+    async def open(self, websocket: WebSocket, client_id: str) -> ClientSession:
+        """
+        接続を受け付けてセッションを開始する
+        """
+        previous = self.sessions.get(client_id)
+        if previous is not None:
+            # 半開きのまま残った古い接続より、新しい接続を優先する
+            self.reaped["replaced"] += 1
+            await self.close(previous, reason="再接続", code=CLOSE_REPLACED)
+
+        await manager.connect(websocket, client_id)
+        session = ClientSession(client_id, websocket)
+        self.sessions[client_id] = session
+        session.spawn(self._heartbeat(session))
+        return session
+
+    async def close(self, session: ClientSession, reason: str, code: Optional[int] = None) -> None:
+        """
+        セッションを閉じ、client_id に紐づく状態をすべて解放する。
+        code を指定した場合はサーバー側からソケットも閉じる。
+        """
+        if session.closed:
+            return
+        session.closed = True
+        session.close_reason = reason
+        client_id = session.client_id
+        if self.sessions.get(client_id) is session:
+            del self.sessions[client_id]
+
+        session.cancel_tasks()
+        turn_manager.cancel(client_id, reason=reason)
+        close_speech_session(client_id)
+        greeting_prefetcher.discard(client_id)
+        admission_controller.forget(client_id)
+        release_processors(client_id)
+        manager.disconnect(client_id, session.websocket)
+
+        if code is not None:
+            try:
+                await session.websocket.close(code=code)
+            except Exception as e:
+                logger.debug(f"ソケットのクローズに失敗: {e}")
+        logger.info(f"セッション終了: client_id={client_id}, reason={reason}")
+
+    async def _heartbeat(self, session: ClientSession) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            if session.last_pong is not None and now - session.last_pong > self.heartbeat_timeout:
+                self.reaped["heartbeat"] += 1
+                await self.close(session, reason="応答なし", code=CLOSE_GOING_AWAY)
+                return
+            if now - session.last_seen > self.idle_timeout:
+                self.reaped["idle"] += 1
+                await self.close(session, reason="無通信", code=CLOSE_GOING_AWAY)
+                return
+            await manager.send_message(session.client_id, Ping(ts=time.time()))
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                pruned = manager.prune_pending_friends(self.idle_timeout)
+                if pruned:
+                    logger.info(f"接続されなかったクライアントの会話相手を削除: {pruned} 件")
+            except Exception as e:
+                logger.error(f"セッションの掃除に失敗: {e}")
+
+    def get_state_info(self) -> Dict[str, Any]:
+        """
+        セッション数と開いているソケット数を取得（監視用）。
+        live_sessions と open_sockets が一致しなければ、どちらかが解放されずに残っている。
+        """
+        now = time.monotonic()
+        return {
+            "live_sessions": len(self.sessions),
+            "open_sockets": len(manager.active_connections),
+            "tracking_sessions": sum(1 for s in self.sessions.values() if s.tracking["active"]),
+            "audio_processors": count_processors(),
+            "pending_friends": manager.pending_friend_count,
+            "reaped": dict(self.reaped),
+            "oldest_idle_sec": round(max((now - s.last_seen for s in self.sessions.values()), default=0.0), 1),
+        }
+
+
+# グローバルインスタンス
+session_manager = SessionManager(
+    heartbeat_interval=settings.WS_HEARTBEAT_INTERVAL,
+    heartbeat_timeout=settings.WS_HEARTBEAT_TIMEOUT,
+    idle_timeout=settings.WS_IDLE_TIMEOUT,
+)
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from app.core.logger import logger
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class SharedStateBackend(ABC):
+    """
+    複数ワーカー・複数ノードで共有する状態(ハッシュ)と pub/sub の共通インターフェース。
+    値は JSON にできるものに限る。
+    """
+    @abstractmethod
+    async def hget(self, namespace: str, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def hset(self, namespace: str, key: str, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    async def hdel(self, namespace: str, key: str) -> None:
+        pass
+
+    @abstractmethod
+    async def hgetall(self, namespace: str) -> Dict[str, Any]:
+        pass
+
+    @abstractmethod
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        """
+        channel に届いたメッセージごとに handler を呼び出す（バックグラウンドで受信する）
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+async def _dispatch(handler: MessageHandler, channel: str, message: Dict[str, Any]) -> None:
+    try:
+        await handler(message)
+    except Exception as e:
+        logger.error(f"共有メッセージの処理エラー: channel={channel}, error={e}")
+
+
+class InMemoryBackend(SharedStateBackend):
+    """
+    1プロセス内だけで完結する実装（ワーカー1つで動かす場合の既定値）
+    """
+    def __init__(self):
+        self._hashes: Dict[str, Dict[str, Any]] = {}
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        # 配信中のタスク（参照を持っておかないと実行前に GC されることがある）
+        self._dispatching: Set[asyncio.Task] = set()
+
+    async def hget(self, namespace: str, key: str) -> Optional[Any]:
+        return self._hashes.get(namespace, {}).get(key)
+
+    async def hset(self, namespace: str, key: str, value: Any) -> None:
+        self._hashes.setdefault(namespace, {})[key] = value
+
+    async def hdel(self, namespace: str, key: str) -> None:
+        self._hashes.get(namespace, {}).pop(key, None)
+
+    async def hgetall(self, namespace: str) -> Dict[str, Any]:
+        return dict(self._hashes.get(namespace, {}))
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        for handler in self._handlers.get(channel, []):
+            task = asyncio.create_task(_dispatch(handler, channel, message))
+            self._dispatching.add(task)
+            task.add_done_callback(self._dispatching.discard)
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+
+
+class SQLiteBackend(SharedStateBackend):
+    """
+    1ノード上の複数ワーカーで共有するための SQLite 実装（Redis がない環境の代替）。
+    pub/sub はメッセージ表をポーリングして実現する。
+    """
+    # 配信済みメッセージを残しておく時間(秒)
+    MESSAGE_RETENTION = 60.0
+
+    def __init__(self, path: str, poll_interval: float = 0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self._last_id = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._lock = asyncio.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_kv ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, "
+            "payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        row = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM shared_messages").fetchone()
+        # 起動前のメッセージは受け取らない
+        self._last_id = row[0]
+
+    async def _execute(self, sql: str, params: tuple = ()) -> list:
+        async with self._lock:
+            return await asyncio.to_thread(lambda: self._conn.execute(sql, params).fetchall())
+
+    async def hget(self, namespace: str, key: str) -> Optional[Any]:
+        rows = await self._execute(
+            "SELECT value FROM shared_kv WHERE namespace = ? AND key = ?", (namespace, key)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    async def hset(self, namespace: str, key: str, value: Any) -> None:
+        await self._execute(
+            "INSERT INTO shared_kv (namespace, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value",
+            (namespace, key, json.dumps(value))
+        )
+
+    async def hdel(self, namespace: str, key: str) -> None:
+        await self._execute("DELETE FROM shared_kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    async def hgetall(self, namespace: str) -> Dict[str, Any]:
+        rows = await self._execute("SELECT key, value FROM shared_kv WHERE namespace = ?", (namespace,))
+        return {key: json.loads(value) for key, value in rows}
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        now = time.time()
+        await self._execute(
+            "INSERT INTO shared_messages (channel, payload, created_at) VALUES (?, ?, ?)",
+            (channel, json.dumps(message), now)
+        )
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def _poll(self) -> None:
+        last_cleanup = time.time()
+        while True:
+            try:
+                channels = list(self._handlers)
+                placeholders = ",".join("?" for _ in channels)
+                rows = await self._execute(
+                    f"SELECT id, channel, payload FROM shared_messages "
+                    f"WHERE id > ? AND channel IN ({placeholders}) ORDER BY id",
+                    (self._last_id, *channels)
+                )
+                for message_id, channel, payload in rows:
+                    self._last_id = message_id
+                    message = json.loads(payload)
+                    for handler in self._handlers.get(channel, []):
+                        await _dispatch(handler, channel, message)
+
+                if time.time() - last_cleanup > self.MESSAGE_RETENTION:
+                    last_cleanup = time.time()
+                    await self._execute(
+                        "DELETE FROM shared_messages WHERE created_at < ?",
+                        (last_cleanup - self.MESSAGE_RETENTION,)
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"共有メッセージの受信エラー: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def close(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+        self._conn.close()
+
+
+class RedisBackend(SharedStateBackend):
+    """
+    Redis(互換サーバー)を使う複数ノード向けの実装
+    """
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url, decode_responses=True)
+        self.pubsub = self.client.pubsub()
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def hget(self, namespace: str, key: str) -> Optional[Any]:
+        value = await self.client.hget(namespace, key)
+        return json.loads(value) if value is not None else None
+
+    async def hset(self, namespace: str, key: str, value: Any) -> None:
+        await self.client.hset(namespace, key, json.dumps(value))
+
+    async def hdel(self, namespace: str, key: str) -> None:
+        await self.client.hdel(namespace, key)
+
+    async def hgetall(self, namespace: str) -> Dict[str, Any]:
+        values = await self.client.hgetall(namespace)
+        return {key: json.loads(value) for key, value in values.items()}
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        await self.client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+        await self.pubsub.subscribe(channel)
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self) -> None:
+        async for item in self.pubsub.listen():
+            if item.get("type") != "message":
+                continue
+            channel = item["channel"]
+            message = json.loads(item["data"])
+            for handler in self._handlers.get(channel, []):
+                await _dispatch(handler, channel, message)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        await self.pubsub.close()
+        await self.client.close()
+
+
+def create_shared_state_backend(name: str, url: str) -> SharedStateBackend:
+    """
+    設定名から共有状態のバックエンドを生成する ("memory" / "sqlite" / "redis")
+    """
+    if name == "memory":
+        return InMemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend(url)
+    if name == "redis":
+        return RedisBackend(url)
+    raise ValueError(f"未対応の共有状態バックエンドです: {name}")
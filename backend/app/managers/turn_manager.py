@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from app.core.logger import logger
+from app.core.tracing import Trace, hold_current
+
+
+class TurnManager:
+    """
+    クライアントごとに実行中の会話ターン(LLM → TTS → 送信)を1つだけ保持し、
+    新しい入力・追跡停止・切断のときに取り消せるようにする
+    """
+    def __init__(self):
+        # {client_id: (ターンのタスク, スレッド側に取り消しを伝えるイベント)}
+        self._turns: Dict[str, Tuple[asyncio.Task, threading.Event]] = {}
+
+    def start(
+        self,
+        client_id: str,
+        turn: Callable[[threading.Event], Awaitable[None]]
+    ) -> asyncio.Task:
+        """
+        新しい会話ターンを開始する。実行中のターンがあれば先に取り消す。
+
+        Args:
+            client_id (str): クライアントID
+            turn: 取り消しイベントを受け取り、ターンを実行するコルーチン関数
+
+        Returns:
+            asyncio.Task: 開始したターンのタスク
+        """
+        self.cancel(client_id, reason="新しい入力")
+        cancel_event = threading.Event()
+        # タスクには現在のトレースが引き継がれるので、ターンが終わるまで完了させない
+        task = asyncio.create_task(self._run(client_id, turn(cancel_event), hold_current()))
+        self._turns[client_id] = (task, cancel_event)
+        return task
+
+    async def _run(self, client_id: str, turn: Awaitable[None], trace: Optional[Trace] = None) -> None:
+        try:
+            await turn
+        except asyncio.CancelledError:
+            logger.info(f"会話ターンを取り消しました: client_id={client_id}")
+        except Exception as e:
+            logger.error(f"会話ターンでエラーが発生しました: client_id={client_id}, error={e}")
+        finally:
+            if trace is not None:
+                trace.release()
+            current = self._turns.get(client_id)
+            if current is not None and current[0] is asyncio.current_task():
+                del self._turns[client_id]
+
+    def cancel(self, client_id: str, reason: str = "") -> bool:
+        """
+        実行中の会話ターンを取り消す
+
+        Returns:
+            bool: 取り消したターンがあったかどうか
+        """
+        current = self._turns.pop(client_id, None)
+        if current is None:
+            return False
+        task, cancel_event = current
+        # スレッドで実行中の LLM 生成にも打ち切りを伝える
+        cancel_event.set()
+        if task.done():
+            return False
+        task.cancel()
+        logger.info(f"会話ターンの取り消しを要求: client_id={client_id}, reason={reason}")
+        return True
+
+    def is_active(self, client_id: str) -> bool:
+        return client_id in self._turns
+
+
+# グローバルインスタンス
+turn_manager = TurnManager()
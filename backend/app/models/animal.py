@@ -1,3 +1,4 @@
+from typing import Any, Dict, Optional
 from pydantic import BaseModel
 
 class IdentifyAnimalRequest(BaseModel):
@@ -6,4 +7,5 @@ class IdentifyAnimalRequest(BaseModel):
 class IdentifyAnimalResponse(BaseModel):
     animal: str
     confidence: float
-    filename: str
\ No newline at end of file
+    filename: str
+    trace: Optional[Dict[str, Any]] = None  # debug_timing=true のときだけ所要時間の内訳を返す
\ No newline at end of file
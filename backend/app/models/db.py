@@ -1,7 +1,13 @@
 # app/models/db.py
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, List, Optional
+
+# 応答の入れ子は1段まで:
+#   ExtendPromptOut → OrganizationSummary（プロンプトを含まない）
+#   OrganizationOut → ExtendPromptSummary（組織を含まない）
+# 以前は ExtendPromptOut → OrganizationOut → extend_prompts → ... と循環しており、
+# 行ごとに遅延ロードが走る（async セッションではそもそも失敗する）ため、読み込む関連を固定している。
 
 #
 # Organization 用スキーマ
@@ -15,14 +21,16 @@ class OrganizationCreate(OrganizationBase):
 class OrganizationUpdate(BaseModel):
     name: Optional[str] = None
 
-class OrganizationOut(OrganizationBase):
+class OrganizationSummary(OrganizationBase):
     id: int
     created_at: datetime
-    extend_prompts: List["ExtendPromptOut"] = []  # 後述する ExtendPromptOut を参照
 
     class Config:
         orm_mode = True
 
+class OrganizationOut(OrganizationSummary):
+    extend_prompts: List["ExtendPromptSummary"] = []  # 後述する ExtendPromptSummary を参照
+
 
 #
 # ExtendPrompt 用スキーマ
@@ -38,14 +46,55 @@ class ExtendPromptUpdate(BaseModel):
     name: Optional[str] = None
     prompt: Optional[str] = None
 
-class ExtendPromptOut(ExtendPromptBase):
+class ExtendPromptSummary(ExtendPromptBase):
     id: int
     created_at: datetime
-    organization: OrganizationOut
 
     class Config:
         orm_mode = True
 
+class ExtendPromptOut(ExtendPromptSummary):
+    organization: OrganizationSummary
+
+
+#
+# 一覧（キーセットページング）
+# next_cursor を次のリクエストの after に渡す。最後のページでは None
+#
+class OrganizationPage(BaseModel):
+    items: List[OrganizationSummary]
+    next_cursor: Optional[int] = None
+
+class ExtendPromptPage(BaseModel):
+    items: List[ExtendPromptOut]
+    next_cursor: Optional[int] = None
+
+
+#
+# ジョブ
+#
+class ExtendPromptUploadOut(BaseModel):
+    job_id: int  # ZIP の後処理のジョブ（GET /jobs/{job_id} で状態を確認する）
+    extend_prompts: List[ExtendPromptOut]
+
+class JobOut(BaseModel):
+    id: int
+    kind: str
+    status: str  # pending / running / done / failed
+    attempts: int
+    max_attempts: int
+    payload: dict
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    run_after: datetime
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class JobPage(BaseModel):
+    items: List[JobOut]
+    next_cursor: Optional[int] = None
+
 
 # 相互参照を解決
-OrganizationOut.update_forward_refs()
\ No newline at end of file
+OrganizationOut.update_forward_refs()
@@ -1,14 +1,145 @@
-from pydantic import BaseModel
-from typing import Optional
+# app/models/websocket.py
+#
+# /ws で送受信する全メッセージの型定義。
+# msgspec の Struct は type フィールドをタグにした union として一度に検証・変換できるため、
+# 受信時は dict を経由せずに直接型付きのメッセージへ、送信時は直接 JSON 文字列へ変換する。
+from typing import Any, Dict, Optional, Union
+import msgspec
 
-class WSRequest(BaseModel):
-    type: str
-    content: Optional[str] = None
-    data: Optional[str] = None
-    filename: Optional[str] = None
+
+#
+# クライアント → サーバー
+#
+class InboundMessage(msgspec.Struct, tag_field="type"):
+    pass
+
+class SetAnimal(InboundMessage, tag="set_animal"):
     animal_type: Optional[str] = None
 
-class WebSocketMessage(BaseModel):
-    type: str
+class Image(InboundMessage, tag="image"):
+    data: str = ""  # Base64エンコードされた画像データ
+
+class StartTracking(InboundMessage, tag="start_tracking"):
+    animal_type: Optional[str] = None
+
+class StopTracking(InboundMessage, tag="stop_tracking"):
+    pass
+
+class ChatMessage(InboundMessage, tag="message"):
+    content: str = ""
+
+class Audio(InboundMessage, tag="audio"):
+    data: str = ""  # Base64エンコードされた音声ファイル
+
+class AudioChunk(InboundMessage, tag="audio_chunk"):
+    data: str = ""  # Base64エンコードされた 16bit PCM フレーム
+    sample_rate: Optional[int] = None
+
+class AudioEnd(InboundMessage, tag="audio_end"):
+    sample_rate: Optional[int] = None
+
+class Pong(InboundMessage, tag="pong"):
+    ts: Optional[float] = None  # 受け取った ping の ts をそのまま返す
+
+
+WSRequest = Union[
+    SetAnimal, Image, StartTracking, StopTracking, ChatMessage, Audio, AudioChunk, AudioEnd, Pong
+]
+
+
+#
+# サーバー → クライアント
+#
+class OutboundMessage(msgspec.Struct, tag_field="type", omit_defaults=True, kw_only=True):
+    # デバッグ時だけ付ける所要時間の内訳（app.core.tracing の Trace.summary）
+    trace: Optional[Dict[str, Any]] = None
+
+class TextMessage(OutboundMessage, tag="text"):
     data: str
-    format: Optional[str] = None
\ No newline at end of file
+
+class AudioMessage(OutboundMessage, tag="audio"):
+    data: str  # Base64エンコードされた音声
+    format: str  # 既定値にすると omit_defaults で省かれるため毎回指定する（"mp3"）
+
+class BusyMessage(OutboundMessage, tag="busy"):
+    data: str
+
+class BBoxMessage(OutboundMessage, tag="bbox"):
+    data: str  # 正規化したバウンディングボックスの JSON 文字列（既存クライアント互換）
+
+class BoundingBox(msgspec.Struct):
+    x: float
+    y: float
+    width: float
+    height: float
+
+class TrackingResult(OutboundMessage, tag="tracking_result"):
+    object_name: str
+    confidence: float
+    bounding_box: BoundingBox = msgspec.field(name="boundingBox")
+
+class TrackingStatus(OutboundMessage, tag="tracking_status"):
+    status: str
+    message: str
+
+class Transcript(OutboundMessage, tag="transcript"):
+    data: str
+
+class TranscriptPartial(OutboundMessage, tag="transcript_partial"):
+    data: str
+
+class Ping(OutboundMessage, tag="ping"):
+    ts: float  # 送信時刻(UNIX 時間)。クライアントは pong で返す
+
+
+#
+# 変換
+#
+_encoder = msgspec.json.Encoder()
+_decoder = msgspec.json.Decoder(WSRequest)
+
+
+class _TypeOnly(msgspec.Struct):
+    type: str
+
+
+_type_decoder = msgspec.json.Decoder(_TypeOnly)
+_REQUEST_TYPES = {cls.__struct_config__.tag for cls in WSRequest.__args__}
+
+DecodeError = msgspec.DecodeError
+
+
+def decode(raw: Union[str, bytes]) -> WSRequest:
+    """
+    受信した JSON を型付きのメッセージに変換する（不正な形式・未知の type は DecodeError）
+    """
+    return _decoder.decode(raw)
+
+
+def unknown_message_type(raw: Union[str, bytes]) -> Optional[str]:
+    """
+    decode に失敗したメッセージが、形式は正しく type だけが未知のものなら、その type を返す（それ以外は None）
+    """
+    try:
+        msg_type = _type_decoder.decode(raw).type
+    except msgspec.DecodeError:
+        return None
+    return None if msg_type in _REQUEST_TYPES else msg_type
+
+
+def encode(message: Any) -> str:
+    """
+    メッセージ(Struct または dict)を送信用の JSON 文字列に変換する
+    """
+    return _encoder.encode(message).decode("utf-8")
+
+
+def message_type(message: Any) -> Optional[str]:
+    """
+    メッセージの type を返す
+    """
+    if isinstance(message, msgspec.Struct):
+        return type(message).__struct_config__.tag
+    if isinstance(message, dict):
+        return message.get("type")
+    return None
@@ -1,10 +1,54 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from datetime import datetime
 from app.managers.connection_manager import manager
+from app.managers.session_manager import session_manager
 from app.core.logger import logger
+from app.core.loop_monitor import loop_monitor
+from app.services.admission_service import admission_controller
+from app.services.readiness_service import readiness
+from app.services.resilience import get_breaker_states
 
 router = APIRouter()
 
 @router.get("/health-check")
 async def health_check():
-    return {"status": "ok", "timestamp": datetime.now().isoformat()}
\ No newline at end of file
+    # 外部依存のサーキットブレーカーが開いているか、イベントループの遅延が閾値を超えていれば degraded とする
+    dependencies = get_breaker_states()
+    degraded = any(state["state"] != "closed" for state in dependencies.values()) or loop_monitor.degraded
+    return {
+        "status": "degraded" if degraded else "ok",
+        "timestamp": datetime.now().isoformat(),
+        "dependencies": dependencies,
+        "event_loop": loop_monitor.get_state_info()
+    }
+
+@router.get("/ready")
+async def ready():
+    """
+    このワーカーにトラフィックを流してよいか（モデル・DB・プロンプトの準備ができているか）。
+    準備ができていなければ 503 を返す
+    """
+    info = await readiness.get_state_info()
+    return JSONResponse(status_code=200 if info["ready"] else 503, content=info)
+
+@router.get("/admission-state")
+async def admission_state():
+    """
+    会話ターンの流量制御の状態(キューの深さ・待ち時間など)を返す
+    """
+    return admission_controller.get_state_info()
+
+@router.get("/session-state")
+async def session_state():
+    """
+    生きているセッション数と開いているソケット数(一致しなければ解放漏れ)を返す
+    """
+    return session_manager.get_state_info()
+
+@router.get("/loop-state")
+async def loop_state():
+    """
+    イベントループの遅延の分位点と、直近にループを止めた箇所のスタックを返す
+    """
+    return loop_monitor.get_state_info(include_stacks=True)
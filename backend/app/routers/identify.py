@@ -1,26 +1,47 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, Header
+from fastapi import APIRouter, HTTPException, Depends, Query, Header, Request
+from fastapi.responses import StreamingResponse
 from app.models.animal import IdentifyAnimalResponse
-from app.services.image_service import ImageProcessor
+from app.services.image_service import decode_image_bytes, get_image_processor
+from app.services.embedding_service import classify_crops
+from app.services.upload_service import UploadedImage, iter_uploaded_images, read_uploaded_image
+from app.services.warmup_service import greeting_prefetcher
 from app.managers.connection_manager import manager
-from app.models.websocket import WebSocketMessage
+from app.models.websocket import TextMessage
 from app.core.config import Settings
-from app.core.logger import logger
+from app.core.logger import logger, log_event
+from app.core.tracing import span, start_trace, activate
+import asyncio
 import base64
+import json
+import logging
 import os
+import time
+import uuid
+from contextlib import aclosing
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 
 router = APIRouter()
 settings = Settings()
-image_processor = ImageProcessor()  # ImageProcessorのインスタンスを作成
 
 @router.post("/identify-animal", response_model=IdentifyAnimalResponse)
 async def identify_animal(
     data: Dict[str, str],
     client_id: Optional[str] = Query(None, description="WebSocketクライアントID"),
+    debug_timing: bool = Query(False, description="応答に所要時間の内訳を含める"),
     user_agent: str = Header(None)
 ):
+    # リクエストごとのトレース（WebSocket への通知・挨拶の先読みまで引き継ぐ）
+    trace = start_trace("http.identify_animal", echo=debug_timing, client_id=client_id)
+    with activate(trace):
+        response = await _identify_animal(data, client_id, user_agent)
+        if trace is not None and trace.echo:
+            response["trace"] = trace.summary()
+        return response
+
+
+async def _identify_animal(data: Dict[str, str], client_id: Optional[str], user_agent: Optional[str]) -> dict:
     try:
         # デバッグ情報を追加
         logger.info(f"identify-animal エンドポイントが呼ばれました - client_id: {client_id}")
@@ -31,58 +52,36 @@ async def identify_animal(
             raise HTTPException(status_code=400, detail="Image data is required")
         
         # Base64デコード
-        image_data = base64.b64decode(data["image"])
+        with span("image.base64_decode", stage="base64_decode"):
+            image_data = base64.b64decode(data["image"])
         
-        # 一意のファイル名を生成
+        # 一意のファイル名を生成（同じ秒に届いたリクエスト同士で上書きしないよう乱数を付ける）
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"animal_{timestamp}.jpg"
+        filename = f"animal_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
         filepath = os.path.join("received_images", filename)
         
         # 画像を保存
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, "wb") as f:
+        with span("image.save"), open(filepath, "wb") as f:
             f.write(image_data)
         
         logger.info(f"画像を保存しました: {filepath}")
         
         # YOLOモデルを使用して物体認識を実行（名前と信頼度を取得）
-        animal_name, confidence = image_processor.detect_largest_object_with_confidence(filepath)
+        # 初回はモデルの読み込みも含むため、イベントループを止めないようスレッドで実行する
+        animal_name, confidence = await asyncio.to_thread(
+            lambda: get_image_processor().detect_largest_object_with_confidence(filepath)
+        )
         
-        # 応答用の動物名とデフォルト信頼度の設定
-        animal = "unknown"
-        final_confidence = 0.0
-        
-        if animal_name:
-            animal = animal_name
-            final_confidence = confidence
-            logger.info(f"検出した動物: {animal} (信頼度: {final_confidence:.2f})")
-            
-            # クライアントIDが指定されている場合、WebSocket経由でそのクライアントの会話相手を更新
-            if client_id:
-                # 重要: クライアントIDが接続されていない場合のチェック
-                if client_id not in manager.active_connections:
-                    logger.warning(f"クライアント {client_id} はWebSocketに接続されていません。会話相手を設定できません。")
-                    
-                    # ここで直接辞書に追加することもできる（WebSocket接続がない場合でも設定を行う）
-                    manager.client_friends[client_id] = animal
-                    logger.info(f"WebSocket接続なしでクライアント {client_id} の会話相手を {animal} に設定しました")
-                else:
-                    # 通常の設定処理
-                    if manager.set_friend(client_id, animal):
-                        # 会話相手の設定が成功した場合、WebSocketで通知
-                        notification = f"{animal}を検出しました！これから{animal}と会話します。"
-                        await manager.send_message(
-                            client_id, 
-                            WebSocketMessage(type="text", data=notification).dict()
-                        )
-                    else:
-                        logger.warning(f"クライアント {client_id} の会話相手の設定に失敗しました")
-        else:
-            logger.warning("物体を検出できませんでした。")
-        
-        # 最終的なConnectionManagerの状態を確認
-        updated_manager_state = manager.get_state_info()
-        logger.info(f"更新後のConnectionManager状態: {updated_manager_state}")
+        animal, final_confidence = await _apply_detection(animal_name, confidence, client_id)
+
+        # 最終的なConnectionManagerの状態を確認（全体は /manager-state で見られるので件数だけ）
+        log_event(
+            "manager.state",
+            level=logging.DEBUG,
+            connections=len(manager.active_connections),
+            friends=len(manager.client_friends)
+        )
         
         # レスポンスを返す
         return {
@@ -96,10 +95,220 @@ async def identify_animal(
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 
+@router.post("/identify-animal/upload", response_model=IdentifyAnimalResponse)
+async def identify_animal_upload(
+    request: Request,
+    client_id: Optional[str] = Query(None, description="WebSocketクライアントID"),
+    organization_id: Optional[int] = Query(None, description="参照画像(/extend_prompt の ZIP)で識別する組織ID"),
+    debug_timing: bool = Query(False, description="応答に所要時間の内訳を含める"),
+    user_agent: str = Header(None)
+):
+    """
+    画像をバイナリのまま受け取る /identify-animal。
+    本文に画像そのもの(Content-Type: image/jpeg など)を送るか、multipart/form-data の file フィールドで送る。
+    base64 への変換もファイルへの保存もせず、メモリ上でデコードして推論する。
+    organization_id を指定すると、その組織の参照画像に十分近ければ参照画像のラベルを返す。
+    """
+    trace = start_trace("http.identify_animal_upload", echo=debug_timing, client_id=client_id)
+    with activate(trace):
+        logger.info(f"identify-animal/upload エンドポイントが呼ばれました - client_id: {client_id}")
+        logger.info(f"User-Agent: {user_agent}")
+        with span("image.receive"):
+            upload = await read_uploaded_image(request)
+        try:
+            img = await asyncio.to_thread(decode_image_bytes, upload.data)
+            if img is None:
+                raise HTTPException(status_code=400, detail="Unsupported image data")
+            [(animal_name, confidence)] = await asyncio.to_thread(_identify_arrays, [img], organization_id)
+            animal, final_confidence = await _apply_detection(animal_name, confidence, client_id)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"動物識別中にエラーが発生しました: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+        # ファイルには保存しないので、送られてきたファイル名（生バイトなら受付ID）を返す
+        response = {
+            "animal": animal,
+            "confidence": final_confidence,
+            "filename": upload.filename or f"upload_{uuid.uuid4().hex[:8]}"
+        }
+        if trace is not None and trace.echo:
+            response["trace"] = trace.summary()
+        return response
+
+
+class _NDJSONStreamingResponse(StreamingResponse):
+    """
+    リクエスト本文を読みながら結果を返すためのストリーミング応答。
+    StreamingResponse は(ASGI 2.4 未満のサーバーでは)切断を監視するために receive を読んでしまい、
+    本文の読み込みと取り合いになるため、監視せずに送信だけ行う。
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
+def _ndjson(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _identify_arrays(imgs: List[Any], organization_id: Optional[int]) -> List[Tuple[str, float]]:
+    """
+    YOLO でまとめて検出し、組織の参照インデックスがあれば検出枠の切り出しを最近傍探索で識別し直す（スレッドで呼び出すこと）
+    """
+    image_processor = get_image_processor()
+    boxes = image_processor.detect_top_boxes_in_arrays(imgs)
+    detections = [image_processor.label_for_box(box) for box in boxes]
+    if organization_id is not None:
+        for i, match in enumerate(classify_crops(organization_id, imgs, boxes)):
+            if match is not None:
+                detections[i] = match
+    return detections
+
+
+def _identify_batch(uploads: List[UploadedImage], organization_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    画像をデコードしてまとめて推論し、画像ごとの結果を返す（スレッドで呼び出すこと）
+    """
+    results: List[Dict[str, Any]] = [{"error": "Unsupported image data"}] * len(uploads)
+    images, positions = [], []
+    for i, upload in enumerate(uploads):
+        img = decode_image_bytes(upload.data)
+        if img is not None:
+            images.append(img)
+            positions.append(i)
+    if images:
+        detections = _identify_arrays(images, organization_id)
+        for i, (animal, confidence) in zip(positions, detections):
+            results[i] = {"animal": animal, "confidence": confidence}
+    return results
+
+
+@router.post("/identify-animal/batch")
+async def identify_animal_batch(
+    request: Request,
+    organization_id: Optional[int] = Query(None, description="参照画像(/extend_prompt の ZIP)で識別する組織ID"),
+):
+    """
+    複数の画像をまとめて識別し、1枚ごとの結果を NDJSON(1行1件)で届いた順に返す。
+    multipart/form-data で任意の数のファイルを送る（フィールド名は問わない）。
+
+    受信・推論・結果の送信を並行して進める。推論待ちの画像が BATCH_PREFETCH 枚に達すると受信を止めるため、
+    送られてくる枚数にかかわらず保持する画像は一定数に収まる。
+    推論は待っている画像を最大 BATCH_INFERENCE_SIZE 枚ずつまとめて行う（揃うのを待たずに、その時点で届いている分で推論する）。
+    各行は {"index", "filename", "animal", "confidence"}（デコードできなければ "error"）で、最後に件数と所要時間の行を返す。
+    会話相手の設定や画像の保存は行わない。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.BATCH_PREFETCH)
+
+    async def receive_images() -> None:
+        # 終わり(None)かエラーを最後に1つだけ入れる。
+        # 取り消された(結果の送信をやめた)ときは読む側がいないので入れない（キューが一杯なら入れられずに止まってしまう）
+        try:
+            async with aclosing(iter_uploaded_images(request, field=None)) as uploads:
+                async for upload in uploads:
+                    await queue.put(upload)
+        except HTTPException as e:
+            last = e
+        except Exception as e:
+            logger.error(f"バッチ識別の受信中にエラーが発生しました: {e}")
+            last = HTTPException(status_code=400, detail=str(e))
+        else:
+            last = None
+        await queue.put(last)
+
+    async def results():
+        started = time.perf_counter()
+        reader = asyncio.create_task(receive_images())
+        index = 0
+        error: Optional[HTTPException] = None
+        finished = False
+        try:
+            while not finished:
+                # 1枚目が届くまで待ち、あとは届いている分だけをまとめる
+                batch: List[UploadedImage] = []
+                item = await queue.get()
+                while True:
+                    if item is None or isinstance(item, HTTPException):
+                        error = item
+                        finished = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= settings.BATCH_INFERENCE_SIZE or queue.empty():
+                        break
+                    item = queue.get_nowait()
+                if batch:
+                    try:
+                        outcomes = await asyncio.to_thread(_identify_batch, batch, organization_id)
+                    except Exception as e:
+                        logger.error(f"バッチ識別中にエラーが発生しました: {e}")
+                        outcomes = [{"error": f"Error processing image: {e}"}] * len(batch)
+                    for upload, outcome in zip(batch, outcomes):
+                        yield _ndjson({"index": index, "filename": upload.filename, **outcome})
+                        index += 1
+            if error is not None:
+                yield _ndjson({"error": error.detail, "status": error.status_code})
+            yield _ndjson({"done": True, "count": index, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)})
+            logger.info(f"バッチ識別が完了しました: {index}枚")
+        finally:
+            reader.cancel()
+
+    return _NDJSONStreamingResponse(results())
+
+
+async def _apply_detection(animal_name: str, confidence: float, client_id: Optional[str]) -> Tuple[str, float]:
+    """
+    検出結果をクライアントの会話相手に反映し、応答に載せる (動物名, 信頼度) を返す
+    """
+    # 応答用の動物名とデフォルト信頼度の設定
+    animal = "unknown"
+    final_confidence = 0.0
+    
+    if animal_name:
+        animal = animal_name
+        final_confidence = confidence
+        logger.info(f"検出した動物: {animal} (信頼度: {final_confidence:.2f})")
+        
+        # クライアントIDが指定されている場合、WebSocket経由でそのクライアントの会話相手を更新
+        if client_id:
+            # 重要: クライアントIDが接続されていない場合のチェック（他ワーカーでの接続も含む）
+            if not await manager.is_connected(client_id):
+                logger.warning(f"クライアント {client_id} はWebSocketに接続されていません。会話相手を設定できません。")
+                
+                # WebSocket接続がない場合でも設定を行う（共有状態に書き込み、接続時に引き継ぐ）
+                manager.set_friend(client_id, animal)
+                logger.info(f"WebSocket接続なしでクライアント {client_id} の会話相手を {animal} に設定しました")
+                # 接続までの間に挨拶を先読みしておく
+                greeting_prefetcher.schedule(client_id, animal)
+            else:
+                # 通常の設定処理
+                if manager.set_friend(client_id, animal):
+                    # 会話相手の設定が成功した場合、WebSocketで通知（他ワーカーの接続にも転送される）
+                    notification = f"{animal}を検出しました！これから{animal}と会話します。"
+                    await manager.send_message(
+                        client_id, 
+                        TextMessage(data=notification)
+                    )
+                    # 他ワーカーの接続なら、そのワーカーが会話相手の変更を受けて先読みする
+                    if client_id in manager.active_connections:
+                        greeting_prefetcher.schedule(client_id, animal)
+                else:
+                    logger.warning(f"クライアント {client_id} の会話相手の設定に失敗しました")
+    else:
+        logger.warning("物体を検出できませんでした。")
+    
+    return animal, final_confidence
+
+
 # デバッグ用のエンドポイントを追加
 @router.get("/manager-state")
 async def get_manager_state():
     """
     ConnectionManagerの現在の状態を返すデバッグ用エンドポイント
     """
-    return manager.get_state_info()
\ No newline at end of file
+    return {
+        **manager.get_state_info(),
+        "cluster": await manager.get_cluster_state_info()
+    }
\ No newline at end of file
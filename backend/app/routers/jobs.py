@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+
+from app.db.session import get_db
+from app.models.db import JobOut, JobPage
+from app.services.job_queue import get_job, job_to_dict, list_jobs
+
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}", response_model=JobOut)
+async def get_job_status(job_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    ジョブの状態（pending / running / done / failed）と結果・エラー
+    """
+    job = await get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
+
+
+@router.get("/jobs", response_model=JobPage)
+async def get_jobs(
+    status: Optional[str] = Query(None, description="pending / running / done / failed"),
+    after: Optional[int] = Query(None, description="前のページの next_cursor"),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    ジョブの一覧（新しい順）
+    """
+    jobs = await list_jobs(db, status=status, after=after, limit=limit)
+    return {"items": [job_to_dict(job) for job in jobs], "next_cursor": jobs[-1].id if len(jobs) == limit else None}
@@ -0,0 +1,66 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.core.metrics import registry, gauge, counter
+# イベントループの遅延のメトリクスを登録する
+import app.core.loop_monitor  # noqa: F401
+from app.managers.connection_manager import manager
+from app.managers.session_manager import session_manager
+from app.services.admission_service import admission_controller
+from app.services.resilience import get_breaker_states
+
+router = APIRouter()
+
+
+def _queue_depths():
+    # 送信キューと、受信側のパイプライン・会話ターンの待ち行列
+    depths = {("send",): float(manager.send_queue_depth)}
+    for session in session_manager.sessions.values():
+        for name, pipeline in session.pipelines.items():
+            key = (f"pipeline_{name}",)
+            depths[key] = depths.get(key, 0.0) + pipeline.queue.qsize()
+    depths[("admission",)] = float(admission_controller.queue_depth)
+    return depths
+
+
+# 出力のたびに現在の状態から計算するゲージ
+gauge(
+    "active_connections", "このワーカーが持つ WebSocket 接続数",
+    collect=lambda: {(): len(manager.active_connections)}
+)
+gauge(
+    "live_sessions", "このワーカーの生きているセッション数",
+    collect=lambda: {(): len(session_manager.sessions)}
+)
+gauge(
+    "tracking_clients", "追跡モードのクライアント数",
+    collect=lambda: {(): sum(1 for s in session_manager.sessions.values() if s.tracking["active"])}
+)
+gauge("queue_depth", "キューに溜まっているメッセージ・ターン数", labels=("queue",), collect=_queue_depths)
+gauge(
+    "admission_in_flight", "実行中の会話ターン数",
+    collect=lambda: {(): admission_controller.get_state_info()["in_flight"]}
+)
+gauge(
+    "circuit_breaker_open", "外部依存のサーキットブレーカーが閉じていなければ 1", labels=("dependency",),
+    collect=lambda: {(name,): float(state["state"] != "closed") for name, state in get_breaker_states().items()}
+)
+counter(
+    "slow_consumer_disconnects_total", "送信が追いつかずに切断したクライアント数",
+    collect=lambda: {(): manager.slow_disconnects}
+)
+counter(
+    "admission_rejected_total", "受け付けられなかった会話ターン数", labels=("reason",),
+    collect=lambda: {(reason,): count for reason, count in admission_controller.get_state_info()["rejected"].items()}
+)
+counter(
+    "sessions_reaped_total", "サーバー側から閉じたセッション数", labels=("reason",),
+    collect=lambda: {(reason,): count for reason, count in session_manager.reaped.items()}
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus 形式のメトリクス（ワーカーごとの値）
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,15 +1,21 @@
-from fastapi import APIRouter, Depends, Form, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, Form, File, UploadFile, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import List
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
 import json
+import os
 
 from app.db.session import get_db
 from app.db.models import Organization
-from app.services.extend_prompt_service import create_extend_prompt
-from app.models.db import ExtendPromptCreate, ExtendPromptOut
-from pydantic import BaseModel, ValidationError
-from app.utils.file_utils import save_file
+from app.services.extend_prompt_service import bulk_create_extend_prompts, list_extend_prompts
+from app.services.embedding_service import get_index_info
+from app.services.job_queue import job_queue
+from app.services.organization_service import get_organization, list_organizations
+from app.models.db import ExtendPromptCreate, ExtendPromptPage, ExtendPromptUploadOut, OrganizationOut, OrganizationPage
+from pydantic import BaseModel, ValidationError, field_validator
+from app.core.config import Settings
+from app.utils.file_utils import discard_files, save_stream_temp
 
 
 
@@ -17,9 +23,18 @@ class PromptItem(BaseModel):
     name: str
     prompt: str
 
+    @field_validator("name")
+    @classmethod
+    def check_name(cls, name: str) -> str:
+        # name はそのまま ZIP・参照ベクトル・サムネイルのファイル名になるため、別のディレクトリを指せないようにする
+        if not name or "/" in name or "\\" in name or ".." in name or "\0" in name:
+            raise ValueError("nameに使えない文字が含まれています（/ \\ .. NUL）")
+        return name
+
 router = APIRouter()
+settings = Settings()
 
-@router.post("/extend_prompt", response_model=List[ExtendPromptOut])
+@router.post("/extend_prompt", response_model=ExtendPromptUploadOut, status_code=202)
 async def extend_prompt(
     organization_name: str = Form(...),
     items: str = Form(...),
@@ -30,7 +45,8 @@ async def extend_prompt(
     ExtendPromptを追加するエンドポイント
     - organization_name: 組織名
     - items: JSON文字列 [{"name":"...","prompt":"..."}, ...]
-    - files: name に対応した ZIP ファイルリスト
+    - files: name に対応した ZIP ファイルリスト（中の画像は組織の参照インデックスの作成に使う）
+    ZIP の保存とレコードの追加だけを行い、検証・サムネイル・特徴抽出はジョブとして登録して job_id を返す。
     """
     # JSONパース＆型検証
     try:
@@ -42,31 +58,103 @@ async def extend_prompt(
     # 書式チェック
     if len(prompt_items) != len(files):
         raise HTTPException(status_code=400, detail="ItemsとFilesの数が一致しません")
+    names = [item.name for item in prompt_items]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail="Itemsに同じnameが含まれています")
 
-    # Organizationの取得または作成
+    # Organizationの取得または作成（作成した場合も commit はプロンプトの追加とまとめて行う）
     result = await db.execute(select(Organization).where(Organization.name == organization_name))
     org = result.scalar_one_or_none()
     if org is None:
         org = Organization(name=organization_name)
         db.add(org)
-        await db.commit()
-        await db.refresh(org)
-
-    created_prompts = []
-    for item, upload in zip(prompt_items, files):
-        # ファイル名変更 & 保存
-        filename = f"{item.name}.zip"
-        content = await upload.read()
-        save_file(content, directory="extend_prompts", filename=filename)
-        
-        # DB レコード作成 via サービス層
-        ep_create = ExtendPromptCreate(
-            name=item.name,
-            prompt=item.prompt,
-            organization_id=org.id
-        )
-        ep = await create_extend_prompt(db, ep_create)
-        created_prompts.append(ep)
-
-    return created_prompts
+        await db.flush()
+
+    # ZIP はメモリに読み込まず、チャンク単位でスレッドから書き出す（組織ごとのディレクトリに分ける）。
+    # 追加が 409 などで失敗したときに既存の ZIP を置き換えないよう、まず一時ファイルに書き、
+    # レコードの commit が済んでから本来の名前に移す
+    directory = os.path.join(settings.EXTEND_PROMPTS_DIR, str(org.id))
+    tmp_paths: List[str] = []
+    try:
+        for upload in files:
+            tmp_paths.append(await save_stream_temp(upload.file, directory=directory, chunk_size=settings.UPLOAD_CHUNK_SIZE))
+
+        # DB レコードはまとめて1回で追加（1トランザクション）
+        try:
+            created_prompts = await bulk_create_extend_prompts(db, [
+                ExtendPromptCreate(name=item.name, prompt=item.prompt, organization_id=org.id)
+                for item in prompt_items
+            ])
+        except IntegrityError:
+            # (organization_id, name) の一意インデックスに違反（同じ組織に同じ名前が既にある）
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="同じnameのExtendPromptがこの組織に既に存在します")
+    except BaseException:
+        discard_files(tmp_paths)
+        raise
+    for item, tmp_path in zip(prompt_items, tmp_paths):
+        os.replace(tmp_path, os.path.join(directory, f"{item.name}.zip"))
+
+    # ZIP の後処理はジョブキューのワーカーで行う
+    job = await job_queue.enqueue(db, "process_prompt_upload", {
+        "organization_id": org.id,
+        "labels": names,
+    })
+    return {"job_id": job.id, "extend_prompts": created_prompts}
+
+
+
+@router.get("/organizations", response_model=OrganizationPage)
+async def get_organizations(
+    after: Optional[int] = Query(None, description="前のページの next_cursor"),
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    組織の一覧（プロンプトは含まない。1ページ1クエリ）
+    """
+    orgs = await list_organizations(db, after=after, limit=limit)
+    return {"items": orgs, "next_cursor": orgs[-1].id if len(orgs) == limit else None}
 
+
+@router.get("/organizations/{org_id}", response_model=OrganizationOut)
+async def get_organization_detail(org_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    組織とそのプロンプト（プロンプトの数によらず2クエリ）
+    """
+    org = await get_organization(db, org_id, with_prompts=True)
+    if org is None:
+        raise HTTPException(status_code=404, detail="Organization not found")
+    return org
+
+
+@router.get("/organizations/{org_id}/extend_prompts", response_model=ExtendPromptPage)
+async def get_organization_prompts(
+    org_id: int,
+    after: Optional[int] = Query(None, description="前のページの next_cursor"),
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    組織のプロンプトの一覧（1ページ2クエリ）
+    """
+    prompts = await list_extend_prompts(db, organization_id=org_id, after=after, limit=limit)
+    return {"items": prompts, "next_cursor": prompts[-1].id if len(prompts) == limit else None}
+
+
+
+@router.get("/organizations/{org_id}/embedding_index")
+async def get_embedding_index(org_id: int):
+    """
+    組織の参照インデックスのラベルと行数
+    """
+    return get_index_info(org_id)
+
+
+@router.post("/organizations/{org_id}/embedding_index", status_code=202)
+async def rebuild_embedding_index(org_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    組織の参照インデックスを作り直すジョブを登録する（変わっていない ZIP は再計算しない）
+    """
+    job = await job_queue.enqueue(db, "build_embedding_index", {"organization_id": org_id})
+    return {"job_id": job.id}
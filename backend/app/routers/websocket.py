@@ -1,311 +1,510 @@
 # app/services/websocket.py
 
 import os
+import asyncio
+import threading
+import logging
+import uuid
+from typing import Union
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import json
 import base64
 from datetime import datetime
 from app.managers.connection_manager import manager
-from app.models.websocket import WSRequest, WebSocketMessage
-from app.services.audio_service import chat as audio_chat, process_audio as audio_process
-from app.core.logger import logger
-from app.services.image_service import save_ws_image, ImageProcessor
+from app.models.websocket import (
+    WSRequest, SetAnimal, Image, StartTracking, StopTracking, ChatMessage, Audio, AudioChunk, AudioEnd,
+    TextMessage, AudioMessage, BusyMessage, BBoxMessage, BoundingBox, TrackingResult, TrackingStatus,
+    Transcript, TranscriptPartial, Pong, DecodeError, decode, message_type, unknown_message_type,
+)
+from app.managers.turn_manager import turn_manager
+from app.managers.session_manager import ClientSession, session_manager
+from app.managers.message_pipeline import MessagePipeline
+from app.services.audio_service import (
+    reply_resilient as audio_reply,
+    text_to_speech_resilient as text_to_speech,
+    process_audio_resilient as audio_process,
+)
+from app.core.logger import logger, log_event
+from app.core.tracing import span, start_trace, activate
+from app.services.image_service import save_ws_image, get_image_processor
+from app.services.warmup_service import greeting_prefetcher
+from app.services.admission_service import admission_controller, AdmissionRejected
+from app.services.asr_service import SpeechEvent, get_speech_session
+from app.core.config import Settings
 
 
 router = APIRouter()
+settings = Settings()
+
+# 混雑で会話ターンを受け付けられなかったときの返答
+BUSY_MESSAGE = "いま混み合っています。少し待ってからもう一度話しかけてください。"
+NO_FRIEND_MESSAGE = "会話相手が設定されていません。まずは動物を識別してください。"
+
+# パイプラインごとのキューの長さと、一杯のときに古いものを捨てるかどうか
+PIPELINES = {
+    "tracking": {"maxsize": 2, "drop_oldest": True},
+    "identify": {"maxsize": 2, "drop_oldest": True},
+    "chat": {"maxsize": 16, "drop_oldest": False},
+    "audio": {"maxsize": 64, "drop_oldest": False},
+}
+
+
+async def chat_turn(client_id: str, content: str, friend: str, cancel_event: threading.Event):
+    """
+    テキストメッセージに対する会話ターン(LLM → TTS → 送信)。
+    turn_manager から取り消されると、どの段階でも残りの処理を行わずに終了する。
+    """
+    # OpenAI / TTS の同時実行数を制限し、混雑時は待たせずに busy を返す
+    try:
+        async with admission_controller.admit(client_id):
+            # chat を呼ぶ際に session_id と friend を渡す
+            # 期限切れ・障害時は定型文と音声なしにフォールバックする
+            text = await audio_reply(
+                content,
+                session_id=client_id,
+                friend=friend,
+                cancel_event=cancel_event
+            )
+            audio_b64 = await text_to_speech(text)
+    except AdmissionRejected:
+        await manager.send_message(
+            client_id,
+            BusyMessage(data=BUSY_MESSAGE)
+        )
+        return
+
+    # テキスト
+    await manager.send_message(
+        client_id,
+        TextMessage(data=text)
+    )
+    # 音声
+    if audio_b64:
+        await manager.send_message(
+            client_id,
+            AudioMessage(data=audio_b64, format="mp3")
+        )
+
+
+async def audio_turn(client_id: str, audio_b64: str, filename: str, friend: str, cancel_event: threading.Event):
+    """
+    音声メッセージに対する会話ターン(保存 → LLM → 送信)
+    """
+    try:
+        async with admission_controller.admit(client_id):
+            # process_audio を呼ぶ際にも session_id と friend を渡す
+            text = await audio_process(
+                audio_b64,
+                filename,
+                session_id=client_id,
+                friend=friend,
+                cancel_event=cancel_event
+            )
+    except AdmissionRejected:
+        await manager.send_message(
+            client_id,
+            BusyMessage(data=BUSY_MESSAGE)
+        )
+        return
+
+    await manager.send_message(
+        client_id,
+        TextMessage(data=text)
+    )
+
+
+async def handle_speech_event(client_id: str, event: SpeechEvent):
+    """
+    ストリーミング文字起こしの結果をクライアントに返し、発話が終わったら会話ターンを始める
+    """
+    if event.started:
+        # ユーザーが話し始めたら、生成中の返答や届いていない挨拶は不要
+        turn_manager.cancel(client_id, reason="発話開始")
+        greeting_prefetcher.discard(client_id)
+
+    if event.partial is not None:
+        await manager.send_message(
+            client_id,
+            TranscriptPartial(data=event.partial)
+        )
+
+    if not event.final:
+        return
+    await manager.send_message(
+        client_id,
+        Transcript(data=event.final)
+    )
+
+    friend = manager.get_friend(client_id)
+    if not friend or friend == "default":
+        await manager.send_message(
+            client_id,
+            TextMessage(data=NO_FRIEND_MESSAGE)
+        )
+        return
+    logger.info(f"音声認識結果: {event.final} (相手: {friend})")
+    turn_manager.start(
+        client_id,
+        lambda cancel_event: chat_turn(client_id, event.final, friend, cancel_event)
+    )
+
+
+def detect_normalized_box(image_b64: str, prefix: str):
+    """
+    画像を保存して最も信頼度の高い物体を検出し、画像サイズで正規化したバウンディングボックスを返す。
+    YOLO と OpenCV の処理はイベントループを止めないようスレッドで呼び出すこと。
+
+    Returns:
+        (検出結果, 正規化したbbox) 検出できなければ (None, None)
+    """
+    # 1. 画像保存
+    filename = f"{prefix}_{datetime.now().timestamp()}.jpg"
+    image_path = save_ws_image(image_b64, filename)
+    try:
+        # 2. 一度だけデコードし、共有の ImageProcessor で物体を検出（推論ワーカーを使う設定ならそちらで推論する）
+        import cv2
+        with span("image.decode", stage="image_decode"):
+            img = cv2.imread(image_path)
+        if img is None:
+            return None, None
+        detection_result = get_image_processor().detect_top_box_in_array(img, conf_threshold=0.3)
+        if not detection_result:
+            return None, None
+
+        # 検出結果をフロントエンドの期待する形式に変換（画像サイズで正規化）
+        bbox = detection_result["bbox"]
+        height, width = img.shape[:2]
+        normalized_bbox = {
+            "x": bbox["x"] / width,
+            "y": bbox["y"] / height,
+            "width": bbox["width"] / width,
+            "height": bbox["height"] / height
+        }
+        return detection_result, normalized_bbox
+    finally:
+        os.remove(image_path)
+
+
+async def handle_set_animal(session: ClientSession, data: SetAnimal):
+    client_id = session.client_id
+    # 手動での動物設定（バックアップとして残しておく）
+    friend = data.animal_type or "default"
+    manager.set_friend(client_id, friend)
+    greeting_prefetcher.schedule(client_id, friend)
+    logger.info(f"friend を手動設定: {friend}")
+    await manager.send_message(
+        client_id,
+        TextMessage(data=f"{friend}の設定が完了しました。会話を始めましょう！")
+    )
+
+
+async def handle_identify_image(session: ClientSession, data: Image):
+    client_id = session.client_id
+    # 既存の画像処理 - 非追跡用
+    log_event("ws.image", level=logging.DEBUG, rate_limit=5, client_id=client_id, mode="identify")
+    detection_result, normalized_bbox = await asyncio.to_thread(
+        detect_normalized_box, data.data, "image"
+    )
+
+    # 結果をクライアントに送信
+    if detection_result:
+        await manager.send_message(
+            client_id,
+            BBoxMessage(data=json.dumps(normalized_bbox))
+        )
+
+
+async def handle_tracking_image(session: ClientSession, data: Image):
+    client_id = session.client_id
+    # 追加: 追跡モードでの画像処理
+    log_event("ws.image", level=logging.DEBUG, rate_limit=5, client_id=client_id, mode="track")
+    detection_result, normalized_bbox = await asyncio.to_thread(
+        detect_normalized_box, data.data, "track"
+    )
+    status = session.tracking
+    if session.closed:
+        # 検出中に切断された
+        return
+
+    if detection_result:
+        label = detection_result["label"]
+        confidence = detection_result["confidence"]
+
+        # 検出結果を保存
+        status["last_detection"] = {
+            "label": label,
+            "confidence": confidence,
+            "bbox": normalized_bbox
+        }
+
+        # クライアントに追跡結果を送信
+        message = TrackingResult(
+            object_name=label,
+            confidence=confidence,
+            bounding_box=BoundingBox(**normalized_bbox)
+        )
+
+    elif status["last_detection"]:
+        # 検出失敗時に最後の結果を使用
+        last_detection = status["last_detection"]
+
+        # 信頼度を下げて送信
+        message = TrackingResult(
+            object_name=last_detection["label"],
+            confidence=last_detection["confidence"] * 0.8,  # 信頼度を下げる
+            bounding_box=BoundingBox(**last_detection["bbox"])
+        )
+
+    else:
+        # 検出失敗かつ過去の検出結果もない場合
+        message = TrackingStatus(status="error", message="追跡対象を検出できませんでした")
+
+    await manager.send_message(client_id, message)
+
+
+async def handle_start_tracking(session: ClientSession, data: StartTracking):
+    client_id = session.client_id
+    # 追加: 追跡開始リクエスト
+    animal_type = data.animal_type
+    if not animal_type:
+        await manager.send_message(
+            client_id,
+            TrackingStatus(status="error", message="追跡対象の動物が指定されていません")
+        )
+        return
+
+    # 追跡状態を更新
+    session.tracking["active"] = True
+    session.tracking["animal_type"] = animal_type
+    manager.set_tracking(client_id, True, animal_type)
+
+    # 友達情報も更新（会話機能でも同じ動物を使用するため）
+    manager.set_friend(client_id, animal_type)
+    greeting_prefetcher.schedule(client_id, animal_type)
+
+    logger.info(f"追跡開始: client_id={client_id}, animal={animal_type}")
+
+    # 追跡開始通知
+    await manager.send_message(
+        client_id,
+        TrackingStatus(status="starting", message=f"{animal_type}の追跡を開始します")
+    )
+
+
+async def handle_stop_tracking(session: ClientSession, data: StopTracking):
+    client_id = session.client_id
+    # 追加: 追跡停止リクエスト
+    # 追跡状態を更新
+    session.tracking["active"] = False
+    manager.set_tracking(client_id, False, session.tracking["animal_type"])
+    # 追跡をやめたら、生成中の返答も不要
+    turn_manager.cancel(client_id, reason="追跡停止")
+
+    logger.info(f"追跡停止: client_id={client_id}")
+
+    # 追跡停止通知
+    await manager.send_message(
+        client_id,
+        TrackingStatus(status="stopped", message="追跡を停止しました")
+    )
+
+
+async def handle_message(session: ClientSession, data: ChatMessage):
+    client_id = session.client_id
+    content = data.content
+    # 現在の会話相手を取得
+    friend = manager.get_friend(client_id)
+    logger.info(f"メッセージ受信: {content} (相手: {friend})")
+
+    # 会話相手が設定されていない場合はデフォルト値を使用
+    if not friend or friend == "default":
+        logger.warning(f"クライアント {client_id} の会話相手が設定されていません。デフォルト値を使用します。")
+        await manager.send_message(
+            client_id,
+            TextMessage(data=NO_FRIEND_MESSAGE)
+        )
+        return
+
+    # ユーザーが先に話しかけたので、届いていない挨拶は破棄
+    greeting_prefetcher.discard(client_id)
+
+    # 前の返答が生成中なら取り消し、新しい入力に答える
+    turn_manager.start(
+        client_id,
+        lambda cancel_event: chat_turn(client_id, content, friend, cancel_event)
+    )
+
+
+async def handle_audio(session: ClientSession, data: Audio):
+    client_id = session.client_id
+    audio_b64 = data.data
+    filename = f"audio_{datetime.now().timestamp()}.mp3"
+    # 現在の会話相手を取得
+    friend = manager.get_friend(client_id)
+
+    # 会話相手が設定されていない場合はデフォルト値を使用
+    if not friend or friend == "default":
+        logger.warning(f"クライアント {client_id} の会話相手が設定されていません。デフォルト値を使用します。")
+        await manager.send_message(
+            client_id,
+            TextMessage(data=NO_FRIEND_MESSAGE)
+        )
+        return
+
+    greeting_prefetcher.discard(client_id)
+
+    turn_manager.start(
+        client_id,
+        lambda cancel_event: audio_turn(client_id, audio_b64, filename, friend, cancel_event)
+    )
+
+
+async def handle_audio_stream(session: ClientSession, data: Union[AudioChunk, AudioEnd]):
+    client_id = session.client_id
+    # ストリーミング音声: 話している間に 16bit PCM のフレームを少しずつ受け取る
+    sample_rate = data.sample_rate or settings.ASR_SAMPLE_RATE
+    speech = await get_speech_session(client_id, sample_rate)
+    if speech is None:
+        await manager.send_message(
+            client_id,
+            TextMessage(data="音声認識が利用できません。")
+        )
+        return
+
+    if isinstance(data, AudioChunk):
+        with span("audio.base64_decode", stage="base64_decode"):
+            pcm = base64.b64decode(data.data)
+        event = await speech.feed(pcm)
+    else:
+        # クライアント側で発話終了を検出した場合
+        event = SpeechEvent(final=await speech.end())
+    await handle_speech_event(client_id, event)
+
+
+async def handle_audio_pipeline(session: ClientSession, data: Union[Audio, AudioChunk, AudioEnd]):
+    # 音声パイプラインは到着順を保つため、ファイル送信とストリーミングを同じキューで処理する
+    if isinstance(data, Audio):
+        await handle_audio(session, data)
+    else:
+        await handle_audio_stream(session, data)
+
+
+# 受信したその場で処理する軽い制御メッセージ
+CONTROL_HANDLERS = {
+    "set_animal": handle_set_animal,
+    "start_tracking": handle_start_tracking,
+    "stop_tracking": handle_stop_tracking,
+}
+
+
+def create_pipelines(session: ClientSession) -> dict:
+    """
+    1接続分のパイプライン(tracking / identify / chat / audio)を作成する
+    """
+    handlers = {
+        "tracking": handle_tracking_image,
+        "identify": handle_identify_image,
+        "chat": handle_message,
+        "audio": handle_audio_pipeline,
+    }
+    return {
+        name: MessagePipeline(
+            name,
+            session.client_id,
+            lambda data, handler=handler: handler(session, data),
+            **PIPELINES[name]
+        )
+        for name, handler in handlers.items()
+    }
+
+
+def pipeline_for(session: ClientSession, msg_type: str):
+    """
+    メッセージの種類から振り分け先のパイプライン名を返す（制御・未知のメッセージは None）
+    """
+    if msg_type == "image":
+        return "tracking" if session.tracking["active"] else "identify"
+    if msg_type == "message":
+        return "chat"
+    if msg_type in ("audio", "audio_chunk", "audio_end"):
+        return "audio"
+    return None
+
+
+async def dispatch(session: ClientSession, raw: str, trace=None):
+    """
+    受信した1件を型付きのメッセージに変換し、パイプラインか制御メッセージのハンドラに振り分ける
+    """
+    client_id = session.client_id
+    # 形式と型の検証は受信時にまとめて行い、ハンドラには型付きのメッセージを渡す
+    try:
+        with span("ws.decode"):
+            data: WSRequest = decode(raw)
+    except DecodeError as e:
+        unknown = unknown_message_type(raw)
+        if unknown is not None:
+            logger.warning(f"未知のタイプ: {unknown}")
+            await manager.send_message(
+                client_id,
+                TextMessage(data=f"未知のメッセージタイプです: {unknown}")
+            )
+            return
+        logger.warning(f"不正なメッセージ - client_id: {client_id}, error: {e}")
+        await manager.send_message(
+            client_id,
+            TextMessage(data=f"不正なメッセージです: {e}")
+        )
+        return
+    msg_type = message_type(data)
+    if trace is not None:
+        trace.name = f"ws.{msg_type}"
+
+    log_event("ws.recv", level=logging.DEBUG, rate_limit=50, client_id=client_id, type=msg_type)
+
+    if isinstance(data, Pong):
+        session.pong()
+        return
+    pipeline_name = pipeline_for(session, msg_type)
+    if pipeline_name is not None:
+        await session.pipelines[pipeline_name].submit(data)
+    else:
+        # decode できた type はパイプラインか制御メッセージのどちらかに必ず当たる
+        await CONTROL_HANDLERS[msg_type](session, data)
 
-# 各クライアントの追跡状態を保存する辞書
-tracking_status = {}  # {client_id: {"active": bool, "animal_type": str, "last_detection": dict}}
 
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    # クエリパラメータから client_id を取得
-    client_id = websocket.query_params.get("client_id", f"client_{datetime.now().timestamp()}")
+    # クエリパラメータから client_id を取得（同時刻に接続しても重ならないように乱数で作る）
+    client_id = websocket.query_params.get("client_id") or f"client_{uuid.uuid4().hex}"
     logger.info(f"WebSocket接続開始 - client_id: {client_id}")
-    
-    await manager.connect(websocket, client_id)
-    
-    # 追跡状態を初期化
-    tracking_status[client_id] = {
-        "active": False,
-        "animal_type": None,
-        "last_detection": None
-    }
 
+    # 追跡状態・パイプライン・生存確認など、この接続の状態はすべてセッションが持つ
+    session = await session_manager.open(websocket, client_id)
+    session.debug_timing = websocket.query_params.get("debug_timing") in ("1", "true")
+    # 接続前に先読みしておいた挨拶があれば届ける
+    await greeting_prefetcher.deliver(client_id)
+
+    # 受信ループは振り分けだけを行い、重い処理は種類ごとのパイプラインで並行に進める
+    # 返信は manager の送信タスクが1本にまとめて順番に送る
+    session.start_pipelines(create_pipelines(session))
+
+    reason = "切断"
     try:
         while True:
             raw = await websocket.receive_text()
-            data = json.loads(raw)
-            msg_type = data.get("type")
-            
-            logger.info(f"WebSocketメッセージ受信 - client_id: {client_id}, type: {msg_type}")
-
-            if msg_type == "set_animal":
-                # 手動での動物設定（バックアップとして残しておく）
-                friend = data.get("animal_type", "default")
-                manager.set_friend(client_id, friend)
-                logger.info(f"friend を手動設定: {friend}")
-                await manager.send_message(
-                    client_id,
-                    WebSocketMessage(
-                        type="text",
-                        data=f"{friend}の設定が完了しました。会話を始めましょう！"
-                    ).dict()
-                )
-                
-            # 既存の画像処理 - 非追跡用
-            elif msg_type == "image" and not tracking_status[client_id]["active"]:
-                logger.info(f"画像受信: 通常処理")
-                # 1. 画像保存
-                filename = f"image_{datetime.now().timestamp()}.jpg"
-                image_path = save_ws_image(data.get("data"), filename)
-                
-                # 既存のImageProcessorを使用してバウンディングボックスを検出
-                processor = ImageProcessor()
-                detection_result = processor.detect_top_box(image_path, conf_threshold=0.3)
-                
-                # 結果をクライアントに送信
-                if detection_result:
-                    # 検出結果をフロントエンドの期待する形式に変換
-                    bbox = detection_result["bbox"]
-                    
-                    # 画像サイズを取得して正規化
-                    import cv2
-                    img = cv2.imread(image_path)
-                    if img is not None:
-                        height, width = img.shape[:2]
-                        normalized_bbox = {
-                            "x": bbox["x"] / width,
-                            "y": bbox["y"] / height,
-                            "width": bbox["width"] / width,
-                            "height": bbox["height"] / height
-                        }
-                    else:
-                        # 画像読み込みに失敗した場合のフォールバック
-                        normalized_bbox = {
-                            "x": bbox["x"] / 1000,  # 仮の値
-                            "y": bbox["y"] / 1000,
-                            "width": bbox["width"] / 1000,
-                            "height": bbox["height"] / 1000
-                        }
-                    os.remove(image_path)
-                    await manager.send_message(
-                        client_id,
-                        WebSocketMessage(
-                            type="bbox", 
-                            data=json.dumps(normalized_bbox)
-                        ).dict()
-                    )
-                
-                # 3. WebSocket返信は既存の処理を維持
-                
-            # 追加: 追跡モードでの画像処理
-            elif msg_type == "image" and tracking_status[client_id]["active"]:
-                logger.info(f"画像受信: 追跡モード")
-                # 1. 画像保存
-                filename = f"track_{datetime.now().timestamp()}.jpg"
-                image_path = save_ws_image(data.get("data"), filename)
-                
-                # 2. ImageProcessorを使用して物体を検出
-                processor = ImageProcessor()
-                detection_result = processor.detect_top_box(image_path, conf_threshold=0.3)
-                
-                if detection_result:
-                    # 検出結果をフロントエンドの期待する形式に変換
-                    bbox = detection_result["bbox"]
-                    label = detection_result["label"]
-                    confidence = detection_result["confidence"]
-                    
-                    # 動物タイプのフィルタリング（オプション）
-                    target_animal = tracking_status[client_id]["animal_type"]
-                    
-                    # 画像サイズを取得して正規化
-                    import cv2
-                    img = cv2.imread(image_path)
-                    if img is not None:
-                        height, width = img.shape[:2]
-                        normalized_bbox = {
-                            "x": bbox["x"] / width,
-                            "y": bbox["y"] / height,
-                            "width": bbox["width"] / width,
-                            "height": bbox["height"] / height
-                        }
-                    else:
-                        # 画像読み込みに失敗した場合のフォールバック
-                        normalized_bbox = {
-                            "x": bbox["x"] / 1000,  # 仮の値
-                            "y": bbox["y"] / 1000,
-                            "width": bbox["width"] / 1000,
-                            "height": bbox["height"] / 1000
-                        }
-                    
-                    # 検出結果を保存
-                    tracking_status[client_id]["last_detection"] = {
-                        "label": label,
-                        "confidence": confidence,
-                        "bbox": normalized_bbox
-                    }
-                    
-                    # クライアントに追跡結果を送信
-                    message_dict = {
-                        "type": "tracking_result",
-                        "object_name": label,
-                        "confidence": confidence,
-                        "boundingBox": normalized_bbox
-                    }
-                    
-                    await websocket.send_text(json.dumps(message_dict))
-                
-                elif tracking_status[client_id]["last_detection"]:
-                    # 検出失敗時に最後の結果を使用
-                    last_detection = tracking_status[client_id]["last_detection"]
-                    
-                    # 信頼度を下げて送信
-                    message_dict = {
-                        "type": "tracking_result",
-                        "object_name": last_detection["label"],
-                        "confidence": last_detection["confidence"] * 0.8,  # 信頼度を下げる
-                        "boundingBox": last_detection["bbox"]
-                    }
-                    
-                    await websocket.send_text(json.dumps(message_dict))
-                
-                else:
-                    # 検出失敗かつ過去の検出結果もない場合
-                    message_dict = {
-                        "type": "tracking_status",
-                        "status": "error",
-                        "message": "追跡対象を検出できませんでした"
-                    }
-                    
-                    await websocket.send_text(json.dumps(message_dict))
-
-            # 追加: 追跡開始リクエスト
-            elif msg_type == "start_tracking":
-                animal_type = data.get("animal_type")
-                if not animal_type:
-                    message_dict = {
-                        "type": "tracking_status",
-                        "status": "error",
-                        "message": "追跡対象の動物が指定されていません"
-                    }
-                    await websocket.send_text(json.dumps(message_dict))
-                    continue
-                
-                # 追跡状態を更新
-                tracking_status[client_id]["active"] = True
-                tracking_status[client_id]["animal_type"] = animal_type
-                
-                # 友達情報も更新（会話機能でも同じ動物を使用するため）
-                manager.set_friend(client_id, animal_type)
-                
-                logger.info(f"追跡開始: client_id={client_id}, animal={animal_type}")
-                
-                # 追跡開始通知
-                message_dict = {
-                    "type": "tracking_status",
-                    "status": "starting",
-                    "message": f"{animal_type}の追跡を開始します"
-                }
-                await websocket.send_text(json.dumps(message_dict))
-
-            # 追加: 追跡停止リクエスト
-            elif msg_type == "stop_tracking":
-                # 追跡状態を更新
-                tracking_status[client_id]["active"] = False
-                
-                logger.info(f"追跡停止: client_id={client_id}")
-                
-                # 追跡停止通知
-                message_dict = {
-                    "type": "tracking_status",
-                    "status": "stopped",
-                    "message": "追跡を停止しました"
-                }
-                await websocket.send_text(json.dumps(message_dict))
-
-            elif msg_type == "message":
-                content = data.get("content", "")
-                # 現在の会話相手を取得
-                friend = manager.get_friend(client_id)
-                logger.info(f"メッセージ受信: {content} (相手: {friend})")
-
-                # 会話相手が設定されていない場合はデフォルト値を使用
-                if not friend or friend == "default":
-                    logger.warning(f"クライアント {client_id} の会話相手が設定されていません。デフォルト値を使用します。")
-                    await manager.send_message(
-                        client_id,
-                        WebSocketMessage(
-                            type="text",
-                            data="会話相手が設定されていません。まずは動物を識別してください。"
-                        ).dict()
-                    )
-                    continue
-
-                # chat を呼ぶ際に session_id と friend を渡す
-                text, audio_b64 = audio_chat(
-                    content,
-                    session_id=client_id,
-                    friend=friend
-                )
-
-                # テキスト
-                await manager.send_message(
-                    client_id,
-                    WebSocketMessage(type="text", data=text).dict()
-                )
-                # 音声
-                await manager.send_message(
-                    client_id,
-                    WebSocketMessage(type="audio", data=audio_b64, format="mp3").dict()
-                )
-
-            elif msg_type == "audio":
-                audio_b64 = data.get("data", "")
-                filename = f"audio_{datetime.now().timestamp()}.mp3"
-                # 現在の会話相手を取得
-                friend = manager.get_friend(client_id)
-
-                # 会話相手が設定されていない場合はデフォルト値を使用
-                if not friend or friend == "default":
-                    logger.warning(f"クライアント {client_id} の会話相手が設定されていません。デフォルト値を使用します。")
-                    await manager.send_message(
-                        client_id,
-                        WebSocketMessage(
-                            type="text",
-                            data="会話相手が設定されていません。まずは動物を識別してください。"
-                        ).dict()
-                    )
-                    continue
-
-                # process_audio を呼ぶ際にも session_id と friend を渡す
-                text = audio_process(
-                    audio_b64,
-                    filename,
-                    session_id=client_id,
-                    friend=friend
-                )
-                await manager.send_message(
-                    client_id,
-                    WebSocketMessage(type="text", data=text).dict()
-                )
-
-            else:
-                logger.warning(f"未知のタイプ: {msg_type}")
-                await manager.send_message(
-                    client_id,
-                    WebSocketMessage(type="text", data=f"未知のメッセージタイプです: {msg_type}").dict()
-                )
+            session.touch()
+            # 受信メッセージごとのトレース（パイプライン・会話ターン・送信まで引き継ぐ）
+            trace = start_trace("ws.recv", echo=session.debug_timing, client_id=client_id, size=len(raw))
+            with activate(trace):
+                await dispatch(session, raw, trace)
 
     except WebSocketDisconnect:
-        # クライアント切断時に追跡状態をクリーンアップ
-        if client_id in tracking_status:
-            del tracking_status[client_id]
-        manager.disconnect(client_id)
         logger.info(f"WebSocket切断: {client_id}")
     except Exception as e:
-        logger.error(f"WebSocketエラー: {e}")
-        # エラー時も追跡状態をクリーンアップ
-        if client_id in tracking_status:
-            del tracking_status[client_id]
-        manager.disconnect(client_id)
\ No newline at end of file
+        # サーバー側から閉じた(生存確認の失敗・再接続)後の受信もここに来る
+        if not session.closed:
+            logger.error(f"WebSocketエラー: {e}")
+            reason = "エラー"
+    finally:
+        # 切断・エラー・サーバー側からのクローズのどれでも、この接続の状態をすべて解放する
+        await session_manager.close(session, reason=reason)
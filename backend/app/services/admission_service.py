@@ -0,0 +1,222 @@
+# app/services/admission_service.py
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+from app.core.config import Settings
+from app.core.logger import logger
+
+settings = Settings()
+
+
+class AdmissionRejected(Exception):
+    """
+    混雑・レート制限により、会話ターン(LLM + TTS)を受け付けられなかったことを表す例外
+    """
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    クライアントごとのトークンバケット。rate 個/秒で補充され、最大 capacity 個まで貯まる。
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """
+        トークンを1つ予約し、そのトークンが使えるようになるまでの待ち時間(秒)を返す
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self) -> None:
+        # 予約を取り消す
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdmissionController:
+    """
+    OpenAI / TTS を呼び出す会話ターンの流量制御。
+    - ワーカー全体の同時実行数を max_concurrency までに制限する
+    - クライアントごとにトークンバケットでレートを制限する
+    - 空き待ちはクライアント単位のラウンドロビンで公平に割り当てる
+    - 期限(max_wait)までに始められない見込みなら、待たずに AdmissionRejected を投げる
+    """
+    def __init__(
+        self,
+        max_concurrency: int,
+        rate_per_client: float,
+        burst: int,
+        max_wait: float,
+    ):
+        self.max_concurrency = max_concurrency
+        self.rate_per_client = rate_per_client
+        self.burst = burst
+        self.max_wait = max_wait
+
+        self._in_flight = 0
+        # クライアントごとの待ち行列と、その順番(ラウンドロビン)
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._round_robin: Deque[str] = deque()
+        self._buckets: Dict[str, TokenBucket] = {}
+
+        # 1ターンの処理時間の指数移動平均(秒)。待ち時間の見積もりに使う
+        self._service_time = 2.0
+        self._admitted = 0
+        self._rejected: Dict[str, int] = {"rate_limited": 0, "busy": 0, "timeout": 0}
+        self._total_wait = 0.0
+        self._last_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    @asynccontextmanager
+    async def admit(self, client_id: str, timeout: Optional[float] = None):
+        """
+        会話ターンの実行枠を確保する。確保できなければ AdmissionRejected を投げる。
+
+        使い方:
+            async with admission_controller.admit(client_id):
+                ...  # LLM / TTS 呼び出し
+        """
+        start = time.monotonic()
+        deadline = start + (self.max_wait if timeout is None else timeout)
+
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = self._buckets[client_id] = TokenBucket(self.rate_per_client, self.burst)
+        token_wait = bucket.reserve(start)
+        if start + token_wait > deadline:
+            bucket.refund()
+            self._reject(client_id, "rate_limited")
+        if token_wait > 0:
+            try:
+                await asyncio.sleep(token_wait)
+            except asyncio.CancelledError:
+                # 待っている間にターンが取り消されたら、予約したトークンを返す
+                bucket.refund()
+                raise
+
+        try:
+            await self._acquire_slot(client_id, deadline)
+        except (AdmissionRejected, asyncio.CancelledError):
+            bucket.refund()
+            raise
+
+        waited = time.monotonic() - start
+        self._admitted += 1
+        self._total_wait += waited
+        self._last_wait = waited
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._release()
+
+    async def _acquire_slot(self, client_id: str, deadline: float) -> None:
+        if self._in_flight < self.max_concurrency and not self._round_robin:
+            self._in_flight += 1
+            return
+
+        # 前に並んでいる数から開始までの時間を見積もり、期限に間に合わなければすぐに断る
+        estimated = (self.queue_depth + 1) / self.max_concurrency * self._service_time
+        if time.monotonic() + estimated > deadline:
+            self._reject(client_id, "busy")
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._waiters.get(client_id)
+        if queue is None:
+            queue = self._waiters[client_id] = deque()
+            self._round_robin.append(client_id)
+        queue.append(future)
+
+        try:
+            await asyncio.wait_for(future, timeout=max(0.0, deadline - time.monotonic()))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 枠を受け取った直後に取り消された場合は枠を返す
+                self._release()
+            else:
+                self._remove_waiter(client_id, future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(client_id, "timeout")
+
+    def _release(self) -> None:
+        # 空いた枠は、次の順番のクライアントの最も古い待ちに引き継ぐ
+        while self._round_robin:
+            client_id = self._round_robin.popleft()
+            queue = self._waiters[client_id]
+            future = queue.popleft()
+            if queue:
+                self._round_robin.append(client_id)
+            else:
+                del self._waiters[client_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _remove_waiter(self, client_id: str, future: asyncio.Future) -> None:
+        queue = self._waiters.get(client_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        if not queue:
+            del self._waiters[client_id]
+            self._round_robin.remove(client_id)
+
+    def _reject(self, client_id: str, reason: str) -> None:
+        self._rejected[reason] += 1
+        logger.warning(f"会話ターンを受け付けられません: client_id={client_id}, reason={reason}")
+        raise AdmissionRejected(reason)
+
+    def forget(self, client_id: str) -> None:
+        """
+        切断されたクライアントのトークンバケットを破棄する
+        """
+        self._buckets.pop(client_id, None)
+
+    def get_state_info(self) -> Dict[str, Any]:
+        """
+        現在の流量制御の状態を取得（監視用）
+
+        Returns:
+            Dict[str, Any]: 状態情報の辞書
+        """
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "queued_clients": len(self._round_robin),
+            "admitted": self._admitted,
+            "rejected": dict(self._rejected),
+            "avg_wait_ms": round(self._total_wait / self._admitted * 1000, 1) if self._admitted else 0.0,
+            "last_wait_ms": round(self._last_wait * 1000, 1),
+            "avg_service_time_ms": round(self._service_time * 1000, 1),
+        }
+
+
+# グローバルインスタンス
+admission_controller = AdmissionController(
+    max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+    rate_per_client=settings.ADMISSION_RATE_PER_CLIENT,
+    burst=settings.ADMISSION_BURST,
+    max_wait=settings.ADMISSION_MAX_WAIT,
+)
@@ -0,0 +1,238 @@
+# app/services/asr_service.py
+
+import asyncio
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+import numpy as np
+from app.core.config import Settings
+from app.core.logger import logger
+
+settings = Settings()
+
+# 文字起こし用のワーカープール（Vosk は推論中に GIL を解放するためスレッドで並列化できる）
+asr_executor = ThreadPoolExecutor(max_workers=settings.ASR_WORKERS, thread_name_prefix="asr")
+
+
+class ASRStream(ABC):
+    """
+    1発話分の逐次文字起こし
+    """
+    @abstractmethod
+    def accept(self, pcm: bytes) -> str:
+        """
+        16bit PCM(モノラル)のフレームを追加し、途中結果のテキストを返す
+        """
+
+    @abstractmethod
+    def finish(self) -> str:
+        """
+        発話を締めくくり、確定したテキストを返す
+        """
+
+
+class ASREngine(ABC):
+    """
+    CPU で動くローカル音声認識エンジンの共通インターフェース
+    """
+    @abstractmethod
+    def create_stream(self, sample_rate: int) -> ASRStream:
+        pass
+
+
+class VoskStream(ASRStream):
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self._committed = ""
+
+    @staticmethod
+    def _join(text: str) -> str:
+        # 日本語モデルは単語ごとに空白で区切って返すので詰める
+        return text.replace(" ", "")
+
+    def accept(self, pcm: bytes) -> str:
+        if self.recognizer.AcceptWaveform(pcm):
+            # 発話の途中で区切りが確定した分は保持しておく
+            self._committed += self._join(json.loads(self.recognizer.Result()).get("text", ""))
+            return self._committed
+        partial = json.loads(self.recognizer.PartialResult()).get("partial", "")
+        return self._committed + self._join(partial)
+
+    def finish(self) -> str:
+        final = self._join(json.loads(self.recognizer.FinalResult()).get("text", ""))
+        return self._committed + final
+
+
+class VoskEngine(ASREngine):
+    """
+    Vosk(Kaldi) による CPU のみのストリーミング音声認識
+    """
+    def __init__(self, model_path: str):
+        from vosk import Model, SetLogLevel
+        SetLogLevel(-1)
+        self.model = Model(model_path)
+        logger.info(f"Vosk モデル {model_path} をロード完了")
+
+    def create_stream(self, sample_rate: int) -> ASRStream:
+        from vosk import KaldiRecognizer
+        return VoskStream(KaldiRecognizer(self.model, sample_rate))
+
+
+_engine: Optional[ASREngine] = None
+_engine_loaded = False
+_engine_lock = threading.Lock()
+
+
+def get_asr_engine() -> Optional[ASREngine]:
+    """
+    設定された音声認識エンジンを返す（初回のみロード）。利用できなければ None。
+    """
+    global _engine, _engine_loaded
+    with _engine_lock:
+        if _engine_loaded:
+            return _engine
+        _engine_loaded = True
+        if settings.ASR_ENGINE == "vosk":
+            try:
+                _engine = VoskEngine(settings.ASR_MODEL_PATH)
+            except Exception as e:
+                logger.error(f"音声認識エンジンのロードに失敗: {e}")
+        elif settings.ASR_ENGINE != "none":
+            logger.error(f"未対応の音声認識エンジンです: {settings.ASR_ENGINE}")
+        return _engine
+
+
+class EnergyVAD:
+    """
+    フレームの音量(RMS)による簡易な発話区間検出。
+    発話開始後に end_silence_ms 以上の無音が続いたら発話終了とみなす。
+    """
+    def __init__(self, sample_rate: int, threshold: float, end_silence_ms: int):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.end_silence_ms = end_silence_ms
+        self.reset()
+
+    def reset(self) -> None:
+        self.in_speech = False
+        self.silence_ms = 0.0
+        self.speech_ms = 0.0
+
+    def update(self, pcm: bytes) -> bool:
+        """
+        フレームを1つ判定し、そのフレームが発話かどうかを返す
+        """
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if samples.size == 0:
+            return False
+        duration_ms = samples.size / self.sample_rate * 1000
+        rms = float(np.sqrt(np.mean(samples.astype(np.float32) ** 2)))
+        is_speech = rms >= self.threshold
+        if is_speech:
+            self.in_speech = True
+            self.silence_ms = 0.0
+        elif self.in_speech:
+            self.silence_ms += duration_ms
+        if self.in_speech:
+            self.speech_ms += duration_ms
+        return is_speech
+
+    @property
+    def ended(self) -> bool:
+        return self.in_speech and self.silence_ms >= self.end_silence_ms
+
+
+@dataclass
+class SpeechEvent:
+    started: bool = False  # このフレームで発話が始まった
+    partial: Optional[str] = None  # 途中結果（変化したときのみ）
+    final: Optional[str] = None  # 発話終了時の確定結果
+
+
+class SpeechSession:
+    """
+    クライアントごとのストリーミング文字起こし。
+    受け取った PCM フレームをディスクに書かずに、そのままワーカープールで逐次認識する。
+    """
+    # 発話開始直前の音を取りこぼさないために保持しておくフレーム数
+    PRE_ROLL_FRAMES = 5
+
+    def __init__(self, engine: ASREngine, sample_rate: int):
+        self.engine = engine
+        self.sample_rate = sample_rate
+        self.vad = EnergyVAD(sample_rate, settings.ASR_VAD_THRESHOLD, settings.ASR_END_SILENCE_MS)
+        self.stream: Optional[ASRStream] = None
+        self.partial = ""
+        self._pre_roll: Deque[bytes] = deque(maxlen=self.PRE_ROLL_FRAMES)
+        # 同じ発話のフレームは順番に認識する必要があるため直列化する
+        self._lock = asyncio.Lock()
+
+    async def feed(self, pcm: bytes) -> SpeechEvent:
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            event = SpeechEvent()
+            was_in_speech = self.vad.in_speech
+            self.vad.update(pcm)
+
+            if not self.vad.in_speech:
+                # 発話前の無音は認識しない
+                self._pre_roll.append(pcm)
+                return event
+
+            if not was_in_speech:
+                event.started = True
+                self.stream = self.engine.create_stream(self.sample_rate)
+                pcm = b"".join(self._pre_roll) + pcm
+                self._pre_roll.clear()
+
+            partial = await loop.run_in_executor(asr_executor, self.stream.accept, pcm)
+            if partial != self.partial:
+                self.partial = event.partial = partial
+
+            if self.vad.ended or self.vad.speech_ms >= settings.ASR_MAX_UTTERANCE_SEC * 1000:
+                event.final = await self._finish(loop)
+            return event
+
+    async def end(self) -> Optional[str]:
+        """
+        クライアントから発話終了を通知されたときに、認識中の発話を確定する
+        """
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            if self.stream is None:
+                return None
+            return await self._finish(loop)
+
+    async def _finish(self, loop: asyncio.AbstractEventLoop) -> str:
+        final = await loop.run_in_executor(asr_executor, self.stream.finish)
+        self.stream = None
+        self.partial = ""
+        self.vad.reset()
+        return final
+
+
+# client_id ごとの文字起こしセッション
+_speech_sessions: Dict[str, SpeechSession] = {}
+
+
+async def get_speech_session(client_id: str, sample_rate: int) -> Optional[SpeechSession]:
+    """
+    client_id の文字起こしセッションを取得（なければ作成）。エンジンが使えなければ None。
+    """
+    session = _speech_sessions.get(client_id)
+    if session is not None and session.sample_rate == sample_rate:
+        return session
+    # モデルのロードは重いのでワーカープールで行う
+    engine = await asyncio.get_running_loop().run_in_executor(asr_executor, get_asr_engine)
+    if engine is None:
+        return None
+    session = _speech_sessions[client_id] = SpeechSession(engine, sample_rate)
+    return session
+
+
+def close_speech_session(client_id: str) -> None:
+    _speech_sessions.pop(client_id, None)
@@ -1,26 +1,82 @@
 import os
 import io
 import base64
-import json
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
 from app.services.tts_service import synthesize_audio
-from openai import OpenAI
-from dotenv import load_dotenv
-from gtts import gTTS
+from app.services.llm_backend import LLMBackend, create_llm_backend
+from app.services.resilience import get_breaker, hedged
+from app.core.config import Settings
 from app.core.logger import logger
-from app.core.prompts import DEFAULT_PROMPT
+from app.core.metrics import CACHE_LOOKUPS
+from app.core.tracing import span, record_span
+from app.core.prompts import DEFAULT_PROMPT, GREETING_PROMPT, FALLBACK_REPLY, load_prompts
 
-# プロンプトJSONのロード
-PROMPTS_JSON_PATH = "app/core/prompts.json"
+settings = Settings()
 
-def load_prompts():
-    with open(PROMPTS_JSON_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+# LLM バックエンド (openai / local)。クライアントライブラリの import が重いので最初に使うときに作る
+_llm: Optional[LLMBackend] = None
+_llm_lock = threading.Lock()
 
-PROMPTS = load_prompts()
 
-# 環境変数読み込みと GPT クライアント初期化
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def get_llm() -> LLMBackend:
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = create_llm_backend(settings.LLM_BACKEND)
+    return _llm
+
+
+# 依存先ごとのサーキットブレーカー
+llm_breaker = get_breaker("llm", settings.BREAKER_FAILURE_THRESHOLD, settings.BREAKER_RESET_TIMEOUT)
+tts_breaker = get_breaker("tts", settings.BREAKER_FAILURE_THRESHOLD, settings.BREAKER_RESET_TIMEOUT)
+
+# 合成済み音声のキャッシュ {text: audio_b64}（TTS 障害時のフォールバックにも使う）
+_tts_cache: "OrderedDict[str, str]" = OrderedDict()
+_tts_cache_lock = threading.Lock()
+# 定型の返答(FALLBACK_REPLY)の音声。LLM と TTS が同時に落ちても返せるよう、ウォームアップで合成しておく
+# （キャッシュとは別に持ち、追い出されないようにする）
+_fallback_speech: Optional[str] = None
+
+def warm_up_fallback_speech() -> None:
+    """
+    FALLBACK_REPLY を合成しておく（ウォームアップでスレッドから呼ばれる）
+    """
+    global _fallback_speech
+    if _fallback_speech is None:
+        _fallback_speech = text_to_speech(FALLBACK_REPLY)
+
+def text_to_speech(text: str) -> str:
+    """
+    テキストを音声に変換し、base64文字列を返す
+    """
+    with span("tts.synthesize", stage="tts", backend=settings.TTS_BACKEND):
+        return _synthesize(text)
+
+
+def _synthesize(text: str) -> str:
+    # ネットワークなしの負荷試験用にダミー音声を返す
+    if settings.TTS_BACKEND == "dummy":
+        _, audio_b64 = synthesize_audio(text)
+        return audio_b64
+    # テキストを音声に変換（gTTS は使うときに読み込む）
+    from gtts import gTTS
+    tts = gTTS(text=text, lang="ja", timeout=settings.TTS_TIMEOUT)
+    buf = io.BytesIO()
+    tts.write_to_fp(buf)
+    buf.seek(0)
+    return base64.b64encode(buf.read()).decode("utf-8")
+
+
+class TurnCancelled(Exception):
+    """
+    ユーザーの割り込みなどで会話ターンが取り消されたことを表す例外
+    """
+
 
 class AudioProcessor:
     """
@@ -29,38 +85,67 @@ class AudioProcessor:
     """
     def __init__(self, target: str = "犬"):
         self.friend = target
-        # 使用モデル名（必要に応じて変更）
-        self.model_name = "gpt-4.1-nano"
+        # プロンプト選択に使うモデル名（Settings で変更可能）
+        self.model_name = settings.LLM_PROMPT_MODEL
         # prompts.json からプロンプトを取得、見つからなければデフォルトを使用
-        model_prompts = PROMPTS.get(self.model_name, {})
+        model_prompts = load_prompts().get(self.model_name, {})
         prompt_text = model_prompts.get(self.friend, model_prompts.get("default", DEFAULT_PROMPT))
         self.messages = [
             {"role": "system", "content": prompt_text}
         ]
         logger.info(f"AudioProcessor 初期化: friend={self.friend}, prompt={prompt_text}")
 
-    def chat(self, user_input: str) -> tuple[str, str]:
-        # 会話履歴にユーザーメッセージ追加
-        self.messages.append({"role": "user", "content": user_input})
-        # GPT呼び出し
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=self.messages
-        )
-        reply_text = response.choices[0].message.content
-        # 履歴にアシスタント応答追加
-        self.messages.append({"role": "assistant", "content": reply_text})
+    def chat(self, user_input: str, cancel_event: Optional[threading.Event] = None) -> tuple[str, str]:
+        reply_text = self.reply(user_input, cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            raise TurnCancelled()
+        return reply_text, text_to_speech(reply_text)
 
-        # テキストを音声に変換
-        tts = gTTS(text=reply_text, lang="ja")
-        buf = io.BytesIO()
-        tts.write_to_fp(buf)
-        buf.seek(0)
-        audio_b64 = base64.b64encode(buf.read()).decode("utf-8")
+    def reply(self, user_input: str, cancel_event: Optional[threading.Event] = None) -> str:
+        """
+        GPTの応答テキストだけを生成する。
+        cancel_event がセットされたら生成を打ち切って TurnCancelled を投げ、履歴は変更しない。
+        """
+        messages = self.messages + [{"role": "user", "content": user_input}]
+        # GPT呼び出し（割り込みに気付けるよう少しずつ受け取る）
+        chunks = []
+        start = time.perf_counter()
+        stream = get_llm().stream(messages, model=settings.LLM_CHAT_MODEL)
+        try:
+            for chunk in stream:
+                if not chunks:
+                    record_span("llm.first_token", start, time.perf_counter(), stage="llm_ttft")
+                if cancel_event is not None and cancel_event.is_set():
+                    raise TurnCancelled()
+                chunks.append(chunk)
+        finally:
+            stream.close()
+            record_span("llm.reply", start, time.perf_counter(), stage="llm_total", chunks=len(chunks))
+        reply_text = "".join(chunks)
+        # 会話履歴にユーザーメッセージとアシスタント応答を追加
+        self.messages.extend([
+            {"role": "user", "content": user_input},
+            {"role": "assistant", "content": reply_text}
+        ])
+        return reply_text
+
+    def greet(self) -> tuple[str, str]:
+        """
+        会話相手から最初に話しかける挨拶を生成する。
+        先読み用のため履歴には追加せず、実際に届けた時点で remember_greeting で追加する。
+        """
+        with span("llm.greet", stage="llm_total"):
+            greeting_text = get_llm().complete(
+                self.messages + [{"role": "user", "content": GREETING_PROMPT}],
+                model=settings.LLM_CHAT_MODEL
+            )
+        return greeting_text, text_to_speech(greeting_text)
 
-        return reply_text, audio_b64
+    def remember_greeting(self, greeting_text: str) -> None:
+        # クライアントに届けた挨拶を会話履歴に追加
+        self.messages.append({"role": "assistant", "content": greeting_text})
 
-    def process(self, data: str, filename: str) -> str:
+    def process(self, data: str, filename: str, cancel_event: Optional[threading.Event] = None) -> str:
         # 音声保存
         try:
             os.makedirs("received_audios", exist_ok=True)
@@ -75,7 +160,7 @@ class AudioProcessor:
         # 文字起こしは未実装のため仮発話
         logger.warning("文字起こし未実装: 仮入力でGPT応答を生成")
         simulated = "こんにちは、何が見られる？"
-        reply, _ = self.chat(simulated)
+        reply = self.reply(simulated, cancel_event)
         return f"{save_msg} | GPT ({self.friend}) says: {reply}"
 
 # session_idごとにAudioProcessorをキャッシュ
@@ -88,6 +173,24 @@ def get_processor(session_id: str, friend: str) -> AudioProcessor:
     return _audio_processors[key]
 
 
+def release_processors(session_id: str) -> int:
+    """
+    session_id の AudioProcessor(会話履歴)を会話相手に関係なくすべて破棄する
+
+    Returns:
+        int: 破棄した件数
+    """
+    prefix = f"{session_id}:"
+    keys = [key for key in list(_audio_processors) if key.startswith(prefix)]
+    for key in keys:
+        _audio_processors.pop(key, None)
+    return len(keys)
+
+
+def count_processors() -> int:
+    return len(_audio_processors)
+
+
 def chat(text: str, session_id: str, friend: str) -> tuple[str, str]:
     """
     指定のsession_idとfriendでGPT会話および音声合成を実行
@@ -98,11 +201,124 @@ def chat(text: str, session_id: str, friend: str) -> tuple[str, str]:
     return reply_text, audio_b64
 
 
-def process_audio(audio_b64: str, filename: str, session_id: str, friend: str) -> str:
+def reply(text: str, session_id: str, friend: str, cancel_event: Optional[threading.Event] = None) -> str:
+    """
+    指定のsession_idとfriendでGPT応答テキストだけを生成（取り消し可能）
+    """
+    proc = get_processor(session_id, friend)
+    reply_text = proc.reply(text, cancel_event)
+    logger.info(f"チャット応答: {reply_text}")
+    return reply_text
+
+
+def process_audio(
+    audio_b64: str,
+    filename: str,
+    session_id: str,
+    friend: str,
+    cancel_event: Optional[threading.Event] = None
+) -> str:
     """
     指定のsession_idとfriendで音声保存とGPT応答を実行
     """
     proc = get_processor(session_id, friend)
-    result = proc.process(audio_b64, filename)
+    result = proc.process(audio_b64, filename, cancel_event)
     logger.info(f"音声処理結果: {result}")
-    return result
\ No newline at end of file
+    return result
+
+
+def _cached_speech(text: str) -> Optional[str]:
+    with _tts_cache_lock:
+        audio_b64 = _tts_cache.get(text)
+        if audio_b64 is not None:
+            _tts_cache.move_to_end(text)
+        return audio_b64
+
+
+def _cache_speech(text: str, audio_b64: str) -> None:
+    with _tts_cache_lock:
+        _tts_cache[text] = audio_b64
+        _tts_cache.move_to_end(text)
+        while len(_tts_cache) > settings.TTS_CACHE_SIZE:
+            _tts_cache.popitem(last=False)
+
+
+async def reply_resilient(
+    text: str,
+    session_id: str,
+    friend: str,
+    cancel_event: Optional[threading.Event] = None
+) -> str:
+    """
+    reply を期限付き・サーキットブレーカー付きで実行する。
+    期限切れや障害時は生成を打ち切り、定型の返答(FALLBACK_REPLY)を返す（履歴には残さない）。
+    """
+    cancel_event = cancel_event or threading.Event()
+    try:
+        return await llm_breaker.call(
+            lambda: asyncio.to_thread(reply, text, session_id, friend, cancel_event),
+            timeout=settings.LLM_TIMEOUT
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # スレッド側の生成も止める
+        cancel_event.set()
+        logger.warning(f"LLM 応答に失敗したため定型文で返答します: {type(e).__name__} {e}")
+        return FALLBACK_REPLY
+
+
+async def process_audio_resilient(
+    audio_b64: str,
+    filename: str,
+    session_id: str,
+    friend: str,
+    cancel_event: Optional[threading.Event] = None
+) -> str:
+    """
+    process_audio を期限付き・サーキットブレーカー付きで実行する
+    """
+    cancel_event = cancel_event or threading.Event()
+    try:
+        return await llm_breaker.call(
+            lambda: asyncio.to_thread(process_audio, audio_b64, filename, session_id, friend, cancel_event),
+            timeout=settings.LLM_TIMEOUT
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        cancel_event.set()
+        logger.warning(f"音声への応答に失敗したため定型文で返答します: {type(e).__name__} {e}")
+        return FALLBACK_REPLY
+
+
+async def text_to_speech_resilient(text: str) -> str:
+    """
+    text_to_speech をキャッシュ・ヘッジ・サーキットブレーカー付きで実行する。
+    - 同じテキストは合成済みの音声を返す
+    - 応答が TTS_HEDGE_DELAY 秒を超えたら同じリクエストをもう1本送る
+    - 障害時は事前に合成しておいた定型の返答(FALLBACK_REPLY)の音声を、それもなければ空文字(音声なし)を返す
+    """
+    global _fallback_speech
+    with span("tts.cache_lookup"):
+        cached = _cached_speech(text)
+    CACHE_LOOKUPS.inc(cache="tts", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached
+    try:
+        audio_b64 = await tts_breaker.call(
+            lambda: hedged(lambda: text_to_speech(text), delay=settings.TTS_HEDGE_DELAY),
+            timeout=settings.TTS_TIMEOUT
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        if _fallback_speech is not None:
+            logger.warning(f"音声合成に失敗したため定型の音声で返答します: {type(e).__name__} {e}")
+            return _fallback_speech
+        logger.warning(f"音声合成に失敗したため音声なしで返答します: {type(e).__name__} {e}")
+        return ""
+    _cache_speech(text, audio_b64)
+    if text == FALLBACK_REPLY:
+        _fallback_speech = audio_b64
+    return audio_b64
\ No newline at end of file
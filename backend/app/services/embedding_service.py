@@ -0,0 +1,267 @@
+# app/services/embedding_service.py
+#
+# 組織ごとの参照画像による識別。
+# /extend_prompt で受け取ったラベルごとの ZIP から特徴ベクトルを一度だけ取り出してディスクに保存しておき、
+# 識別時は YOLO の検出枠を切り出した画像のベクトルと全参照ベクトルの内積(コサイン類似度)を一度に計算して、
+# 最も近い参照画像のラベルを返す。再学習せずに組織独自の動物(展示個体など)を識別できる。
+#
+# 保存形式（EMBEDDING_INDEX_DIR/<組織ID>/）:
+#   index.npz     vectors: 参照ベクトル (N, D) float16（L2 正規化済み）
+#                 label_ids: 各行のラベル番号 (N,) int32
+#                 labels: ラベル名の一覧
+#                 （作り直し中に読んでも組み合わせがずれないよう、1ファイルにまとめて一度で置き換える）
+#   labels/<ラベル>.npy, .json  ZIP ごとのベクトルと元 ZIP のサイズ・更新時刻（変わっていない ZIP は再計算しない）
+#   .lock         作り直しの排他用（ジョブのプロセスが別でも同じ組織は同時に作らない）
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from app.core.config import Settings
+from app.core.logger import logger
+from app.core.tracing import span
+from app.services.image_service import crop_box, decode_image_bytes, get_image_processor
+
+settings = Settings()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class ImageEmbedder:
+    """
+    画像を L2 正規化した特徴ベクトルにする（モデルは初回に読み込む）
+    """
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self._model = None
+        self._lock = threading.Lock()
+
+    def embed(self, imgs: List[np.ndarray]) -> np.ndarray:
+        with self._lock:
+            if self._model is None:
+                from ultralytics import YOLO
+                self._model = YOLO(self.model_path)
+                logger.info(f"特徴抽出モデル {self.model_path} をロード完了")
+            with span("image.embed", stage="embed", batch=len(imgs)):
+                outputs = self._model.embed(imgs, verbose=False)
+        # バッチごとの (B, D) でも画像ごとの (D,) でも (N, D) にそろえる
+        vectors = np.concatenate([np.atleast_2d(out.cpu().numpy()) for out in outputs]).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+image_embedder = ImageEmbedder(settings.EMBEDDING_MODEL_PATH)
+
+
+class EmbeddingIndex:
+    """
+    1組織分の参照ベクトル。検索はメモリ上の float32 の行列との積で行う
+    """
+    def __init__(self, labels: List[str], vectors: np.ndarray, label_ids: np.ndarray):
+        self.labels = labels
+        self.vectors = vectors
+        self.label_ids = label_ids
+
+    @property
+    def size(self) -> int:
+        return len(self.vectors)
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingIndex":
+        with np.load(path) as data:
+            return cls([str(label) for label in data["labels"]], data["vectors"].astype(np.float32), data["label_ids"])
+
+    def match(self, queries: np.ndarray, threshold: float) -> List[Optional[Tuple[str, float]]]:
+        """
+        各クエリ(L2 正規化済み)に最も近い参照画像の (ラベル, 類似度) を返す。threshold 未満なら None
+        """
+        if self.size == 0:
+            return [None] * len(queries)
+        with span("embedding.search", stage="nn_search", rows=self.size):
+            scores = queries @ self.vectors.T
+            best = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(queries)), best]
+        return [
+            (self.labels[self.label_ids[row]], float(score)) if score >= threshold else None
+            for row, score in zip(best, best_scores)
+        ]
+
+
+class EmbeddingIndexStore:
+    """
+    組織ごとの EmbeddingIndex のキャッシュ。
+    index.npz の更新時刻が変わっていれば読み直すため、別のワーカーが作り直した場合も反映される。
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self._indexes: Dict[int, Tuple[float, EmbeddingIndex]] = {}
+        self._lock = threading.Lock()
+
+    def directory(self, organization_id: int) -> str:
+        return os.path.join(self.root, str(organization_id))
+
+    def get(self, organization_id: int) -> Optional[EmbeddingIndex]:
+        path = os.path.join(self.directory(organization_id), "index.npz")
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._indexes.get(organization_id)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            index = EmbeddingIndex.load(path)
+            self._indexes[organization_id] = (mtime, index)
+            return index
+
+
+embedding_indexes = EmbeddingIndexStore(settings.EMBEDDING_INDEX_DIR)
+
+
+@contextmanager
+def _build_lock(index_dir: str) -> Iterator[None]:
+    # ジョブはプロセスプールの別々のプロセスで動くため、スレッドのロックではなくファイルロックで排他する
+    # （flock は同じプロセス内でも open ごとに排他されるので、スレッドどうしも待ち合わせる）
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, ".lock"), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _zip_images(path: str, limit: int) -> Iterator[np.ndarray]:
+    # ZIP 内の画像を1枚ずつデコードする（展開してディスクに書き出すことはしない）
+    count = 0
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            if info.is_dir() or "__MACOSX" in name or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            img = decode_image_bytes(zf.read(info))
+            if img is None:
+                logger.warning(f"参照画像をデコードできません: {path}:{name}")
+                continue
+            yield img
+            count += 1
+            if count >= limit:
+                return
+
+
+def _embed_zip(path: str) -> np.ndarray:
+    parts, batch = [], []
+    for img in _zip_images(path, settings.EMBEDDING_MAX_IMAGES_PER_LABEL):
+        batch.append(img)
+        if len(batch) >= settings.EMBEDDING_BATCH_SIZE:
+            parts.append(image_embedder.embed(batch))
+            batch = []
+    if batch:
+        parts.append(image_embedder.embed(batch))
+    return np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+
+def _replace_file(path: str, write, mode: str = "wb", **kwargs) -> None:
+    # 読み込み中の他のワーカーが中途半端なファイルを読まないよう、同じディレクトリの一時ファイルに書き終えてから置き換える。
+    # 一時ファイル名は書き込みごとに変える（固定の名前だと同時に書いたプロセスどうしで壊し合う）
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    _replace_file(path, lambda f: np.save(f, array))
+
+
+def _save_json(path: str, data) -> None:
+    _replace_file(path, lambda f: json.dump(data, f, ensure_ascii=False), mode="w", encoding="utf-8")
+
+
+def build_organization_index(organization_id: int) -> int:
+    """
+    組織の ZIP(EXTEND_PROMPTS_DIR/<組織ID>/<ラベル>.zip)から参照ベクトルを作り直し、行数を返す。
+    前回から変わっていない ZIP は保存済みのベクトルを使う。推論を伴うためスレッドで呼び出すこと。
+    """
+    index_dir = embedding_indexes.directory(organization_id)
+    with _build_lock(index_dir):
+        source_dir = os.path.join(settings.EXTEND_PROMPTS_DIR, str(organization_id))
+        cache_dir = os.path.join(index_dir, "labels")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        labels: List[str] = []
+        parts: List[np.ndarray] = []
+        zip_names = sorted(f for f in os.listdir(source_dir) if f.endswith(".zip")) if os.path.isdir(source_dir) else []
+        for filename in zip_names:
+            label = filename[:-len(".zip")]
+            zip_path = os.path.join(source_dir, filename)
+            stat = os.stat(zip_path)
+            stamp = {"size": stat.st_size, "mtime": stat.st_mtime}
+            cache_vectors = os.path.join(cache_dir, f"{label}.npy")
+            cache_meta = os.path.join(cache_dir, f"{label}.json")
+
+            vectors = None
+            if os.path.exists(cache_meta) and os.path.exists(cache_vectors):
+                with open(cache_meta, "r", encoding="utf-8") as f:
+                    if json.load(f) == stamp:
+                        vectors = np.load(cache_vectors).astype(np.float32)
+            if vectors is None:
+                try:
+                    vectors = _embed_zip(zip_path)
+                except zipfile.BadZipFile:
+                    logger.warning(f"ZIP を開けません: {zip_path}")
+                    continue
+                _save_array(cache_vectors, vectors.astype(np.float16))
+                _save_json(cache_meta, stamp)
+                logger.info(f"参照ベクトルを計算: 組織 {organization_id} / {label} ({len(vectors)}枚)")
+            if len(vectors):
+                labels.append(label)
+                parts.append(vectors)
+
+        if parts:
+            vectors = np.concatenate(parts)
+            label_ids = np.concatenate([np.full(len(part), i, dtype=np.int32) for i, part in enumerate(parts)])
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+            label_ids = np.zeros((0,), dtype=np.int32)
+        _replace_file(os.path.join(index_dir, "index.npz"), lambda f: np.savez(
+            f,
+            labels=np.array(labels, dtype=str),
+            vectors=vectors.astype(np.float16),
+            label_ids=label_ids,
+        ))
+        logger.info(f"参照インデックスを作成: 組織 {organization_id} ラベル {len(labels)} 件 / {len(vectors)} 行")
+        return len(vectors)
+
+
+def classify_crops(
+    organization_id: int,
+    imgs: List[np.ndarray],
+    boxes: List[Optional[dict]]
+) -> List[Optional[Tuple[str, float]]]:
+    """
+    検出枠(なければ画像全体)を切り出して組織の参照画像と照合し、画像ごとに (ラベル, 類似度) か None を返す。
+    組織の参照インデックスがなければすべて None。スレッドで呼び出すこと。
+    特徴抽出は get_image_processor() に任せる（INFERENCE_WORKERS > 0 なら推論ワーカーで行う）。
+    """
+    index = embedding_indexes.get(organization_id)
+    if index is None or index.size == 0:
+        return [None] * len(imgs)
+    crops = [crop_box(img, box) for img, box in zip(imgs, boxes)]
+    return index.match(get_image_processor().embed_images(crops), settings.EMBEDDING_MATCH_THRESHOLD)
+
+
+def get_index_info(organization_id: int) -> dict:
+    index = embedding_indexes.get(organization_id)
+    if index is None:
+        return {"built": False, "labels": [], "vectors": 0}
+    return {"built": True, "labels": index.labels, "vectors": index.size}
@@ -1,6 +1,7 @@
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, insert, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
+from sqlalchemy.orm import selectinload
 from app.db.models import ExtendPrompt
 from app.models.db import ExtendPromptCreate, ExtendPromptUpdate
 
@@ -15,12 +16,57 @@ async def create_extend_prompt(db: AsyncSession, data: ExtendPromptCreate) -> Ex
     await db.refresh(ep)
     return ep
 
+async def bulk_create_extend_prompts(db: AsyncSession, items: List[ExtendPromptCreate]) -> List[ExtendPrompt]:
+    """
+    複数の ExtendPrompt を1回の INSERT ... RETURNING で追加し、1回だけ commit する。
+    呼び出し側で flush 済みの変更(新しい Organization など)も同じトランザクションで確定する。
+    """
+    if not items:
+        await db.commit()
+        return []
+    res = await db.scalars(
+        insert(ExtendPrompt).returning(ExtendPrompt),
+        [{"name": item.name, "prompt": item.prompt, "organization_id": item.organization_id} for item in items]
+    )
+    ids = [ep.id for ep in res.all()]
+    # RETURNING で得た行は organization が未ロードで、レスポンスの組み立て時に遅延ロード(MissingGreenlet)になる。
+    # commit 前に organization ごと読み直しておく
+    res = await db.scalars(
+        select(ExtendPrompt)
+        .options(selectinload(ExtendPrompt.organization))
+        .where(ExtendPrompt.id.in_(ids))
+        .order_by(ExtendPrompt.id)
+        .execution_options(populate_existing=True)
+    )
+    created = list(res.all())
+    await db.commit()
+    return created
+
 async def get_extend_prompt(db: AsyncSession, ep_id: int) -> ExtendPrompt | None:
     res = await db.execute(select(ExtendPrompt).where(ExtendPrompt.id == ep_id))
     return res.scalar_one_or_none()
 
-async def list_extend_prompts(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[ExtendPrompt]:
-    res = await db.execute(select(ExtendPrompt).offset(skip).limit(limit))
+async def list_extend_prompts(
+    db: AsyncSession,
+    organization_id: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = 100
+) -> List[ExtendPrompt]:
+    """
+    id 順のキーセットページング。after には前のページの最後の id を渡す。
+    応答に含める organization は selectinload でまとめて読み込む（ページあたり2クエリ）
+    """
+    stmt = (
+        select(ExtendPrompt)
+        .options(selectinload(ExtendPrompt.organization))
+        .order_by(ExtendPrompt.id)
+        .limit(limit)
+    )
+    if organization_id is not None:
+        stmt = stmt.where(ExtendPrompt.organization_id == organization_id)
+    if after is not None:
+        stmt = stmt.where(ExtendPrompt.id > after)
+    res = await db.execute(stmt)
     return res.scalars().all()
 
 async def update_extend_prompt(db: AsyncSession, ep_id: int, data: ExtendPromptUpdate) -> ExtendPrompt | None:
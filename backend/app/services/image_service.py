@@ -1,32 +1,49 @@
 # app/services/image_service.py
-
+#
+# ultralytics(torch) と OpenCV は import だけで数秒かかるため、モジュールの先頭では読み込まず
+# 使う関数・モデルを作るときに読み込む（起動と --reload を速くするため）
 import os
-import json
 import base64
 import glob
-from typing import Optional, Tuple
-from ultralytics import YOLO
-import cv2
-from app.core.logger import logger
+import logging
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from app.core.config import Settings
+from app.core.logger import logger, log_event
+from app.core.prompts import load_prompts
+from app.core.tracing import span
 
-PROMPTS_JSON_PATH = "app/core/prompts.json"
+settings = Settings()
 
 def save_ws_image(image_base64: str, filename: str) -> str:
     save_dir = "received_images"
     os.makedirs(save_dir, exist_ok=True)
     filepath = os.path.join(save_dir, filename)
-    data = base64.b64decode(image_base64)
-    with open(filepath, "wb") as f:
+    with span("image.base64_decode", stage="base64_decode"):
+        data = base64.b64decode(image_base64)
+    with span("image.save"), open(filepath, "wb") as f:
         f.write(data)
-    logger.info(f"WS画像を保存: {filepath}")
+    log_event("image.saved", level=logging.DEBUG, rate_limit=5, path=filepath, size=len(data))
     return filepath
 
+def decode_image_bytes(data: bytes) -> Optional[np.ndarray]:
+    """
+    画像のバイト列(JPEG/PNG など)をメモリ上で BGR 配列にデコードする。デコードできなければ None
+    """
+    import cv2
+    with span("image.decode", stage="image_decode"):
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
 class ImageProcessor:
     def __init__(self, folder_path="received_images", model_path="models/best.pt", flg: int = 0):
+        from ultralytics import YOLO
         self.folder_path = folder_path
         os.makedirs(folder_path, exist_ok=True)
         # モデル選択フラグによる切り替え
         self.flg = flg
+        # 同じインスタンスを複数のスレッドから使うため、推論はひとつずつ行う
+        self._infer_lock = threading.Lock()
         if flg == 0:
             # 従来の YOLOv8 モデルを使用
             self.model = YOLO(model_path)
@@ -39,13 +56,21 @@ class ImageProcessor:
             # デフォルトにフォールバック
             self.model = YOLO(model_path)
             logger.info(f"デフォルトモデル {model_path} をロード完了")
-        self.prompts = self._load_prompts()
+        self.prompts = load_prompts()
 
-    def _load_prompts(self):
-        with open(PROMPTS_JSON_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        logger.info(f"Prompts.json をロード完了: {list(data.keys())}")
-        return data
+    def warm_up(self, size: int = 640) -> None:
+        """
+        空の画像で一度推論しておく（初回の推論だけにかかる準備の時間を、最初のリクエストに持ち込まない）
+        """
+        with span("image.warm_up"):
+            self.detect_top_boxes_in_arrays([np.zeros((size, size, 3), dtype=np.uint8)])
+
+    def embed_images(self, imgs: List[np.ndarray]) -> np.ndarray:
+        """
+        画像を L2 正規化した特徴ベクトル (N, D) にする（組織の参照画像との照合に使う）
+        """
+        from app.services.embedding_service import image_embedder
+        return image_embedder.embed(imgs)
 
     def _get_latest_image_files(self):
         return sorted(
@@ -70,24 +95,32 @@ class ImageProcessor:
                 return None
             image_path = files[0]
 
-        results = self.model(image_path)[0]
-        if not results.boxes:
-            logger.warning("物体が検出されませんでした。")
+        import cv2
+        with span("image.decode", stage="image_decode"):
+            img = cv2.imread(image_path)
+        if img is None:
+            logger.warning(f"画像を読み込めませんでした: {image_path}")
             return None
+        return self.detect_top_box_in_array(img, conf_threshold)
 
-        # 最も信頼度の高いボックスを選択
-        top = max(results.boxes, key=lambda b: float(b.conf[0]))
-        conf = float(top.conf[0])
-        if conf < conf_threshold:
-            logger.info(f"信頼度 {conf:.2f} がしきい値 {conf_threshold} 未満のため None を返します")
+    def detect_top_box_in_array(self, img: np.ndarray, conf_threshold: float = 0.0) -> Optional[dict]:
+        """
+        デコード済みの画像について detect_top_box と同じ結果を返す
+        """
+        box = self.detect_top_boxes_in_arrays([img])[0]
+        if box is None:
+            # 追跡中はフレームごとに呼ばれるので件数を抑える
+            log_event("detect.empty", level=logging.WARNING, rate_limit=1)
             return None
 
-        # 座標を整数に変換
-        x1, y1, x2, y2 = map(int, top.xyxy[0].tolist())
-        label = self.model.names[int(top.cls[0])]
+        conf = box["confidence"]
+        if conf < conf_threshold:
+            log_event("detect.low_confidence", level=logging.INFO, rate_limit=1, confidence=round(conf, 2), threshold=conf_threshold)
+            return None
 
+        x1, y1, x2, y2 = box["xyxy"]
         return {
-            "label": label,
+            "label": box["label"],
             "confidence": conf,
             "bbox": {
                 "x": x1,
@@ -112,16 +145,21 @@ class ImageProcessor:
                     return default_label, 0.0
                 image_path = files[0]
 
-            # 推論
-            results = self.model(image_path)[0]
-            if len(results.boxes) == 0:
+            # 画像読み込み＆推論（注釈の描画にも同じ画像を使う）
+            import cv2
+            with span("image.decode", stage="image_decode"):
+                img = cv2.imread(image_path)
+            if img is None:
+                logger.warning(f"画像を読み込めませんでした: {image_path}")
+                return default_label, 0.0
+            top = self.detect_top_boxes_in_arrays([img])[0]
+            if top is None:
                 logger.warning("物体が検出されませんでした。")
                 return default_label, 0.0
 
-            # 最も信頼度の高いボックスを選択
-            top = max(results.boxes, key=lambda b: float(b.conf[0]))
-            label = self.model.names[int(top.cls[0])]
-            confidence = float(top.conf[0])
+            # 最も信頼度の高いボックス
+            label = top["label"]
+            confidence = top["confidence"]
 
             logger.info(f"検出結果: {label} (信頼度: {confidence:.2f})")
 
@@ -129,9 +167,8 @@ class ImageProcessor:
                 logger.info(f"信頼度 {confidence:.2f} がしきい値 {conf_threshold} 未満のため default に切り替え")
                 label = default_label
 
-            # 画像読み込み＆描画
-            img = cv2.imread(image_path)
-            x1, y1, x2, y2 = map(int, top.xyxy[0].tolist())
+            # 描画
+            x1, y1, x2, y2 = top["xyxy"]
             cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
             cv2.putText(
                 img,
@@ -161,3 +198,84 @@ class ImageProcessor:
         except Exception as e:
             logger.error(f"物体検出エラー: {e}")
             return default_label, 0.0
+
+    def detect_top_boxes_in_arrays(self, imgs: List[np.ndarray]) -> List[Optional[dict]]:
+        """
+        複数の画像をまとめて1回で推論し、画像ごとに最も信頼度の高い検出結果
+        {"label", "confidence", "xyxy"} を返す（検出できなければ None。しきい値による判定はしない）
+        他の検出メソッドはすべてこのメソッドを通して推論する
+        """
+        with self._infer_lock, span("image.inference", stage="inference", batch=len(imgs)):
+            results = self.model(imgs, verbose=False)
+        with span("image.post_process", stage="post_process"):
+            return [top_box(result, self.model.names) for result in results]
+
+    @staticmethod
+    def label_for_box(box: Optional[dict], conf_threshold: float = 0.3) -> Tuple[str, float]:
+        """
+        detect_top_boxes_in_arrays の結果を (ラベル, 信頼度) にする。検出なし・しきい値未満は default
+        """
+        default_label = "default"
+        if box is None:
+            log_event("detect.empty", level=logging.WARNING, rate_limit=1)
+            return default_label, 0.0
+        if box["confidence"] < conf_threshold:
+            log_event("detect.low_confidence", level=logging.INFO, rate_limit=1, confidence=round(box["confidence"], 2), threshold=conf_threshold)
+            return default_label, box["confidence"]
+        return box["label"], box["confidence"]
+
+
+def top_box(result, names) -> Optional[dict]:
+    """
+    YOLO の推論結果1枚分から最も信頼度の高いボックスを {"label", "confidence", "xyxy"} にする（なければ None）
+    """
+    if len(result.boxes) == 0:
+        return None
+    top = max(result.boxes, key=lambda b: float(b.conf[0]))
+    return {
+        "label": names[int(top.cls[0])],
+        "confidence": float(top.conf[0]),
+        "xyxy": tuple(map(int, top.xyxy[0].tolist())),
+    }
+
+
+def crop_box(img: np.ndarray, box: Optional[dict], margin: float = 0.1) -> np.ndarray:
+    """
+    検出枠の周り(幅・高さの margin 倍の余白付き)を切り出す。検出がなければ画像全体を返す
+    """
+    if box is None:
+        return img
+    height, width = img.shape[:2]
+    x1, y1, x2, y2 = box["xyxy"]
+    dx, dy = int((x2 - x1) * margin), int((y2 - y1) * margin)
+    x1, y1 = max(0, x1 - dx), max(0, y1 - dy)
+    x2, y2 = min(width, x2 + dx), min(height, y2 + dy)
+    if x2 <= x1 or y2 <= y1:
+        return img
+    return img[y1:y2, x1:x2]
+
+
+_image_processor: Optional[ImageProcessor] = None
+_image_processor_lock = threading.Lock()
+
+
+def get_image_processor() -> ImageProcessor:
+    """
+    プロセス内で共有する ImageProcessor を返す（モデルは最初に呼ばれたときに読み込む）。
+    INFERENCE_WORKERS > 0 なら、推論をワーカープロセスで行う PooledImageProcessor を返す。
+    読み込みに時間がかかるので、イベントループからはスレッドで呼び出すこと。
+    """
+    global _image_processor
+    if _image_processor is None:
+        with _image_processor_lock:
+            if _image_processor is None:
+                if settings.INFERENCE_WORKERS > 0:
+                    from app.services.inference_pool import PooledImageProcessor, inference_pool
+                    _image_processor = PooledImageProcessor(inference_pool)
+                else:
+                    _image_processor = ImageProcessor()
+    return _image_processor
+
+
+def image_processor_loaded() -> bool:
+    return _image_processor is not None
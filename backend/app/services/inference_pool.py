@@ -0,0 +1,408 @@
+# app/services/inference_pool.py
+#
+# YOLO の推論を別プロセスのワーカーで行うプール。
+# スレッドでは GIL のため前処理・後処理(リサイズ・NMS・ボックスの選択など)が1コアに収まってしまうので、
+# モデルを1度だけ読み込んだワーカープロセスを複数立ち上げ、推論をそちらに振り分ける。
+# - ワーカーごとに共有メモリの領域を1つ持つ。デコード済みの画像はその領域にコピーして渡す（画像は pickle しない）
+# - パイプで送るのは依頼の種類と画像の形、結果(画像ごとの最も信頼度の高いボックス、または特徴ベクトル)だけ
+# - 検出(detect)のほか、組織の参照画像との照合に使う特徴抽出(embed)もワーカーで行う（分類モデルは最初の依頼で読み込む）
+# - ワーカーは CPU アフィニティで使うコアを分けられる（torch のスレッド数もそのコア数に合わせる）
+# ImageProcessor と同じ API(PooledImageProcessor)で使えるため、WebSocket・identify の呼び出し側は変わらない。
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.core.config import Settings
+from app.core.logger import logger
+from app.core.metrics import counter, gauge
+from app.core.prompts import load_prompts
+from app.core.tracing import span
+from app.services.image_service import ImageProcessor, top_box
+
+settings = Settings()
+
+INFERENCE_POOL_RESTARTS = counter("inference_pool_restarts_total", "応答しなくなり再起動した推論ワーカー数")
+
+
+class InferenceWorkerError(RuntimeError):
+    """
+    ワーカー内の推論で例外が起きた（ワーカー自体は動き続けている）
+    """
+
+
+def parse_cpu_affinity(spec: str, workers: int) -> List[Optional[List[int]]]:
+    """
+    INFERENCE_CPU_AFFINITY をワーカーごとのコア番号の一覧にする。
+    - "": 固定しない
+    - "auto": このプロセスが使えるコアをワーカー数で均等に分ける
+    - "0-3;4-7" のような ";" 区切り: 先頭からワーカーに順に割り当てる（足りなければ繰り返す）
+    """
+    spec = spec.strip()
+    if not spec or not hasattr(os, "sched_setaffinity"):
+        return [None] * workers
+    if spec == "auto":
+        cpus = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(cpus) // workers)
+        return [
+            cpus[(i * per_worker) % len(cpus):(i * per_worker) % len(cpus) + per_worker]
+            for i in range(workers)
+        ]
+    groups = []
+    for group in spec.split(";"):
+        cpus = []
+        for part in group.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if "-" in part:
+                first, last = part.split("-")
+                cpus.extend(range(int(first), int(last) + 1))
+            else:
+                cpus.append(int(part))
+        if not cpus:
+            raise ValueError(f"Invalid INFERENCE_CPU_AFFINITY: {spec!r}")
+        groups.append(cpus)
+    return [groups[i % len(groups)] for i in range(workers)]
+
+
+def _worker_main(
+    index: int,
+    model_path: str,
+    embedding_model_path: str,
+    cpus: Optional[List[int]],
+    threads: int,
+    shm_name: str,
+    conn
+) -> None:
+    """
+    ワーカープロセスの本体。モデルを読み込んで ("ready", クラス名) を返した後、
+    (種類, 画像の形の一覧) を受け取るたびに共有メモリ上の画像を推論し、
+    ("ok", 画像ごとのボックス) か ("ok", 画像ごとの特徴ベクトル) を返す
+    """
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    try:
+        # ワーカー同士で同じコアを取り合わないよう、torch のスレッド数を割り当て分に抑える
+        import torch
+        torch.set_num_threads(threads)
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+        # 初回の推論だけにかかる準備をここで済ませておく
+        model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+        shm = SharedMemory(name=shm_name)
+        from app.services.embedding_service import ImageEmbedder
+        embedder = ImageEmbedder(embedding_model_path)
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", dict(model.names)))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        kind, shapes = request
+        try:
+            offset = 0
+            imgs = []
+            for shape in shapes:
+                imgs.append(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset))
+                offset += int(np.prod(shape))
+            if kind == "embed":
+                vectors = embedder.embed(imgs)
+                del imgs
+                conn.send(("ok", list(vectors)))
+                continue
+            results = model(imgs, verbose=False)
+            # 共有メモリを閉じられるよう、領域を参照する配列はここで手放す
+            del imgs
+            conn.send(("ok", [top_box(result, model.names) for result in results]))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    shm.close()
+
+
+class _Worker:
+    def __init__(self, index: int, cpus: Optional[List[int]]):
+        self.index = index
+        self.cpus = cpus
+        self.process = None
+        self.conn = None
+        self.shm: Optional[SharedMemory] = None
+
+
+class InferencePool:
+    def __init__(
+        self,
+        workers: int,
+        model_path: str = "models/best.pt",
+        embedding_model_path: str = "yolov8n-cls.pt",
+        cpu_affinity: str = "",
+        shm_bytes: int = 64 * 1024 * 1024,
+        max_batch: int = 8,
+        timeout: float = 30.0,
+        start_timeout: float = 120.0,
+    ):
+        self.workers = workers
+        self.model_path = model_path
+        self.embedding_model_path = embedding_model_path
+        self.cpu_affinity = cpu_affinity
+        # 共有メモリのうち画像に使う大きさ
+        self.frame_bytes = shm_bytes
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.names: Dict[int, str] = {}
+        self._workers: List[_Worker] = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    def start(self) -> None:
+        """
+        ワーカーを起動し、すべてのワーカーがモデルを読み込み終えるまで待つ（時間がかかるのでスレッドで呼ぶこと）
+        """
+        with self._lock:
+            if self._started:
+                return
+            affinities = parse_cpu_affinity(self.cpu_affinity, self.workers)
+            self._workers = [_Worker(i, cpus) for i, cpus in enumerate(affinities)]
+            try:
+                # まとめて起動してからそろうのを待つ（モデルの読み込みを並行させる）
+                for worker in self._workers:
+                    self._spawn(worker)
+                for worker in self._workers:
+                    self._wait_ready(worker)
+            except Exception:
+                self._shutdown_workers()
+                raise
+            for worker in self._workers:
+                self._idle.put(worker)
+            self._started = True
+            logger.info(
+                f"推論ワーカーを起動: workers={self.workers}, affinity={[w.cpus for w in self._workers]}"
+            )
+
+    def stop(self) -> None:
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+            self._shutdown_workers()
+            self._idle = queue.Queue()
+
+    def _spawn(self, worker: _Worker) -> None:
+        worker.shm = SharedMemory(create=True, size=self.frame_bytes)
+        worker.conn, child_conn = self._ctx.Pipe()
+        threads = len(worker.cpus) if worker.cpus else max(1, (os.cpu_count() or 1) // self.workers)
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker.index, self.model_path, self.embedding_model_path, worker.cpus, threads, worker.shm.name, child_conn),
+            name=f"inference-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+
+    def _wait_ready(self, worker: _Worker) -> None:
+        kind, value = self._receive(worker, self.start_timeout)
+        if kind != "ready":
+            raise RuntimeError(f"Inference worker {worker.index} failed to start: {value}")
+        self.names = value
+
+    def _receive(self, worker: _Worker, timeout: float) -> Tuple[str, Any]:
+        deadline = time.monotonic() + timeout
+        while not worker.conn.poll(0.1):
+            if not worker.process.is_alive():
+                raise RuntimeError(f"Inference worker {worker.index} exited (code {worker.process.exitcode})")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Inference worker {worker.index} did not respond in {timeout}s")
+        try:
+            return worker.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Inference worker {worker.index} exited") from None
+
+    def _close_worker(self, worker: _Worker) -> None:
+        if worker.process is not None and worker.process.is_alive():
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+        if worker.conn is not None:
+            worker.conn.close()
+        if worker.shm is not None:
+            worker.shm.close()
+            worker.shm.unlink()
+        worker.process, worker.conn, worker.shm = None, None, None
+
+    def _shutdown_workers(self) -> None:
+        for worker in self._workers:
+            self._close_worker(worker)
+
+    def _restart(self, worker: _Worker) -> None:
+        """
+        応答しなくなった・落ちたワーカーを作り直して空きに戻す（途中の推論の結果は捨てる）。
+        作り直せなければそのワーカーは外し、残りのワーカーで続ける
+        """
+        INFERENCE_POOL_RESTARTS.inc()
+        logger.warning(f"推論ワーカー {worker.index} を再起動します")
+        try:
+            self._close_worker(worker)
+            self._spawn(worker)
+            self._wait_ready(worker)
+        except Exception as e:
+            logger.error(f"推論ワーカー {worker.index} を再起動できませんでした: {e}")
+            self._close_worker(worker)
+            return
+        self._idle.put(worker)
+
+    def _submit(self, worker: _Worker, kind: str, imgs: Sequence[np.ndarray], start: int) -> int:
+        """
+        imgs[start:] を共有メモリに入る分(最大 max_batch 枚)だけ書き込んで kind の推論を依頼し、依頼した枚数を返す
+        """
+        offset = 0
+        shapes = []
+        for img in imgs[start:start + self.max_batch]:
+            if img.dtype != np.uint8 or img.ndim != 3:
+                raise ValueError(f"Unsupported frame: dtype={img.dtype}, shape={img.shape}")
+            if offset + img.nbytes > self.frame_bytes:
+                if not shapes:
+                    raise ValueError(f"Frame too large for inference shared memory: {img.nbytes} bytes")
+                break
+            view = np.ndarray(img.shape, dtype=np.uint8, buffer=worker.shm.buf, offset=offset)
+            view[...] = img
+            del view
+            shapes.append(img.shape)
+            offset += img.nbytes
+        worker.conn.send((kind, shapes))
+        return len(shapes)
+
+    def _collect(self, worker: _Worker, count: int) -> List[Any]:
+        kind, value = self._receive(worker, self.timeout)
+        if kind != "ok":
+            raise InferenceWorkerError(f"Inference failed in worker {worker.index}: {value}")
+        if len(value) != count:
+            raise InferenceWorkerError(f"Worker {worker.index} returned {len(value)} results for {count} frames")
+        return value
+
+    def detect_top_boxes(self, imgs: Sequence[np.ndarray]) -> List[Optional[dict]]:
+        """
+        ImageProcessor.detect_top_boxes_in_arrays と同じ結果を、ワーカーで推論して返す
+        """
+        return self._run("detect", imgs)
+
+    def embed(self, imgs: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        ImageEmbedder.embed と同じ (N, D) の特徴ベクトルを、ワーカーで計算して返す
+        """
+        vectors = self._run("embed", imgs)
+        return np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def _run(self, kind: str, imgs: Sequence[np.ndarray]) -> List[Any]:
+        """
+        max_batch 枚ずつに分け、空いているワーカーがあれば並行して推論させ、画像ごとの結果を返す
+        """
+        if not self._started:
+            raise RuntimeError("Inference pool is not started")
+        results: List[Any] = [None] * len(imgs)
+        pending: List[Tuple[_Worker, int, int]] = []
+        error: Optional[Exception] = None
+        next_index = 0
+        while next_index < len(imgs) or pending:
+            # 依頼中のものがなければ空くまで待ち、あれば空いているワーカーにだけ追加で依頼する
+            while next_index < len(imgs) and error is None:
+                try:
+                    worker = self._idle.get(block=not pending, timeout=self.timeout)
+                except queue.Empty:
+                    if not pending:
+                        error = TimeoutError("No inference worker became available")
+                    break
+                try:
+                    count = self._submit(worker, kind, imgs, next_index)
+                except ValueError as e:
+                    self._idle.put(worker)
+                    error = e
+                    break
+                except OSError as e:
+                    # パイプが切れている（ワーカーが落ちている）
+                    self._restart(worker)
+                    error = e
+                    break
+                pending.append((worker, next_index, count))
+                next_index += count
+            if not pending:
+                break
+            worker, first, count = pending.pop(0)
+            try:
+                results[first:first + count] = self._collect(worker, count)
+            except InferenceWorkerError as e:
+                error = error or e
+            except Exception as e:
+                error = error or e
+                self._restart(worker)
+                continue
+            self._idle.put(worker)
+        if error is not None:
+            raise error
+        return results
+
+    def get_state_info(self) -> Dict[str, Any]:
+        return {
+            "started": self._started,
+            "workers": self.workers,
+            "idle": self._idle.qsize() if self._started else 0,
+            "affinity": [worker.cpus for worker in self._workers],
+        }
+
+
+class PooledImageProcessor(ImageProcessor):
+    """
+    推論を InferencePool のワーカーで行う ImageProcessor（このプロセスにはモデルを読み込まない）
+    """
+    def __init__(self, pool: InferencePool, folder_path="received_images"):
+        self.folder_path = folder_path
+        os.makedirs(folder_path, exist_ok=True)
+        self.flg = 0
+        self.pool = pool
+        self.model = None
+        self.prompts = load_prompts()
+        pool.start()
+
+    def detect_top_boxes_in_arrays(self, imgs: List[np.ndarray]) -> List[Optional[dict]]:
+        with span("image.inference", stage="inference", batch=len(imgs), pool=True):
+            return self.pool.detect_top_boxes(imgs)
+
+    def embed_images(self, imgs: List[np.ndarray]) -> np.ndarray:
+        with span("image.embed", stage="embed", batch=len(imgs), pool=True):
+            return self.pool.embed(imgs)
+
+
+inference_pool = InferencePool(
+    workers=settings.INFERENCE_WORKERS,
+    embedding_model_path=settings.EMBEDDING_MODEL_PATH,
+    cpu_affinity=settings.INFERENCE_CPU_AFFINITY,
+    shm_bytes=settings.INFERENCE_SHM_BYTES,
+    max_batch=settings.BATCH_INFERENCE_SIZE,
+    timeout=settings.INFERENCE_TIMEOUT,
+)
+
+gauge(
+    "inference_pool_idle_workers", "空いている推論ワーカー数",
+    collect=lambda: {(): inference_pool.get_state_info()["idle"]}
+)
@@ -0,0 +1,317 @@
+# app/services/job_queue.py
+#
+# データベース(job テーブル)に永続化するバックグラウンドジョブのキュー。
+# HTTP リクエストではジョブを登録して ID を返すだけにし、重い処理(ZIP の検証・サムネイル・特徴抽出など)は
+# 各ワーカープロセスのランナーがジョブを取り出してプロセスプールで実行する。
+# - 取り出しは status='pending' を条件にした UPDATE で行うため、複数のワーカープロセスが同じジョブを二重に実行しない
+# - 失敗したジョブは待ち時間を倍々にしながら max_attempts 回まで再実行する
+# - running のまま locked_until を過ぎたジョブ(実行中にプロセスが落ちたもの)は再び取り出される
+#   （max_attempts 回に達していれば failed にする）
+# - プロセスプールの子プロセスが落ちてプールが使えなくなったら、プールを作り直してジョブを再実行する
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import socket
+import traceback
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Set
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import Settings
+from app.core.logger import logger
+from app.core.metrics import counter
+from app.db.models import Job
+from app.db.session import AsyncSessionLocal
+
+settings = Settings()
+
+# ジョブの種類と実行する関数（"モジュール:関数"。関数は payload の dict を受け取り、JSON にできる値を返す）
+# 別プロセスで実行するため、関数はモジュールのトップレベルに定義する
+JOB_HANDLERS: Dict[str, str] = {
+    "process_prompt_upload": "app.services.prompt_jobs:process_prompt_upload",
+    "build_embedding_index": "app.services.prompt_jobs:build_embedding_index",
+}
+
+JOBS_FINISHED = counter("jobs_finished_total", "実行を終えたジョブ数", labels=("kind", "outcome"))
+
+
+def _utcnow() -> datetime:
+    # DateTime 列はタイムゾーンなしなので UTC の naive な値で比べる
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def run_job(kind: str, payload: Dict[str, Any]) -> Any:
+    """
+    ジョブを1件実行する（プロセスプールの中で呼ばれる）
+    """
+    module_name, func_name = JOB_HANDLERS[kind].split(":")
+    func = getattr(importlib.import_module(module_name), func_name)
+    return func(payload)
+
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "payload": json.loads(job.payload),
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "run_after": job.run_after,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+class JobQueue:
+    def __init__(
+        self,
+        workers: int,
+        executor: str = "process",
+        poll_interval: float = 2.0,
+        lease_seconds: float = 1800.0,
+        retry_backoff: float = 5.0,
+    ):
+        self.workers = workers
+        self.executor_kind = executor
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retry_backoff = retry_backoff
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor: Optional[Executor] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        if self._runner is not None or self.workers <= 0:
+            return
+        self._executor = self._new_executor()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+        logger.info(f"ジョブキューを開始: workers={self.workers} ({self.executor_kind})")
+
+    def _new_executor(self) -> Executor:
+        if self.executor_kind == "process":
+            # 推論ライブラリのスレッドを抱えたまま fork しないよう spawn で起動する
+            return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+
+    def _replace_executor(self, broken: Executor) -> None:
+        """
+        壊れたプロセスプールを新しいものに取り替える。
+        同じプールで実行中だったジョブはすべて BrokenProcessPool になるため、最初の1件だけが作り直す
+        """
+        if self._executor is not broken:
+            return
+        broken.shutdown(wait=False)
+        self._executor = self._new_executor()
+        logger.warning("ジョブのプロセスプールが壊れたため作り直しました")
+
+    async def stop(self) -> None:
+        """
+        新しいジョブの取り出しをやめ、実行中のジョブの完了を待つ
+        """
+        if self._runner is None:
+            return
+        self._runner.cancel()
+        self._runner = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+        self._executor = None
+
+    async def enqueue(
+        self,
+        db: AsyncSession,
+        kind: str,
+        payload: Dict[str, Any],
+        max_attempts: Optional[int] = None
+    ) -> Job:
+        """
+        ジョブを登録して commit する（実行はランナーが行う）
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = _utcnow()
+        job = Job(
+            kind=kind,
+            payload=json.dumps(payload, ensure_ascii=False),
+            status="pending",
+            attempts=0,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            run_after=now,
+            created_at=now,
+        )
+        db.add(job)
+        await db.commit()
+        logger.info(f"ジョブを登録: {kind} #{job.id}")
+        # このワーカーのランナーが空いていれば、ポーリングを待たずに取り出させる
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def _run(self) -> None:
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await self._claim()
+            except Exception as e:
+                self._slots.release()
+                logger.error(f"ジョブの取り出しに失敗: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if job is None:
+                self._slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _claim(self) -> Optional[Job]:
+        now = _utcnow()
+        async with AsyncSessionLocal() as db:
+            # 実行中にリースが切れたまま max_attempts 回に達したジョブ(毎回止まる・プロセスごと落とすもの)は再実行しない
+            expired = (await db.execute(
+                update(Job)
+                .where(Job.status == "running", Job.locked_until < now, Job.attempts >= Job.max_attempts)
+                .values(
+                    status="failed",
+                    error="実行中にリースの期限が切れました",
+                    locked_by=None,
+                    locked_until=None,
+                    finished_at=now,
+                )
+                .returning(Job.id, Job.kind, Job.attempts, Job.max_attempts)
+            )).all()
+            if expired:
+                await db.commit()
+                for job_id, kind, attempts, max_attempts in expired:
+                    JOBS_FINISHED.inc(kind=kind, outcome="failed")
+                    logger.error(f"ジョブ失敗: {kind} #{job_id} ({attempts}/{max_attempts}) 実行中にリースの期限切れ")
+            candidate = (await db.execute(
+                select(Job.id)
+                .where(or_(
+                    (Job.status == "pending") & (Job.run_after <= now),
+                    (Job.status == "running") & (Job.locked_until < now) & (Job.attempts < Job.max_attempts),
+                ))
+                .order_by(Job.run_after, Job.id)
+                .limit(1)
+            )).scalar_one_or_none()
+            if candidate is None:
+                return None
+            # 取り出した時点の状態のままなら自分のものにする（他のワーカーが先に取った場合は 0 行）
+            claimed = (await db.execute(
+                update(Job)
+                .where(
+                    Job.id == candidate,
+                    or_(
+                        (Job.status == "pending") & (Job.run_after <= now),
+                        (Job.status == "running") & (Job.locked_until < now) & (Job.attempts < Job.max_attempts),
+                    ),
+                )
+                .values(
+                    status="running",
+                    attempts=Job.attempts + 1,
+                    locked_by=self.worker_id,
+                    locked_until=now + timedelta(seconds=self.lease_seconds),
+                    started_at=now,
+                )
+                .returning(Job)
+            )).scalar_one_or_none()
+            await db.commit()
+            return claimed
+
+    async def _execute(self, job: Job) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._executor
+            try:
+                result = await loop.run_in_executor(executor, run_job, job.kind, json.loads(job.payload))
+            except BrokenProcessPool as e:
+                # 子プロセスが落ちると、このジョブ自体に問題がなくてもプールごと使えなくなる。
+                # プールを作り直し、待たずに再実行する（原因のジョブが繰り返し落とす場合も max_attempts で止まる）
+                self._replace_executor(executor)
+                await self._fail(job, e, delay=0.0)
+            except Exception as e:
+                await self._fail(job, e)
+            else:
+                await self._finish(job, {
+                    "status": "done",
+                    "result": json.dumps(result, ensure_ascii=False, default=str),
+                    "error": None,
+                })
+                JOBS_FINISHED.inc(kind=job.kind, outcome="done")
+                logger.info(f"ジョブ完了: {job.kind} #{job.id}")
+        finally:
+            self._slots.release()
+
+    async def _fail(self, job: Job, error: Exception, delay: Optional[float] = None) -> None:
+        detail = "".join(traceback.format_exception_only(type(error), error)).strip()
+        if job.attempts < job.max_attempts:
+            if delay is None:
+                delay = self.retry_backoff * (2 ** (job.attempts - 1))
+            await self._finish(job, {
+                "status": "pending",
+                "run_after": _utcnow() + timedelta(seconds=delay),
+                "error": detail,
+            }, finished=False)
+            JOBS_FINISHED.inc(kind=job.kind, outcome="retry")
+            logger.warning(f"ジョブ失敗、{delay:.0f}秒後に再実行: {job.kind} #{job.id} ({job.attempts}/{job.max_attempts}) {detail}")
+        else:
+            await self._finish(job, {"status": "failed", "error": detail})
+            JOBS_FINISHED.inc(kind=job.kind, outcome="failed")
+            logger.error(f"ジョブ失敗: {job.kind} #{job.id} ({job.attempts}/{job.max_attempts}) {detail}")
+
+    async def _finish(self, job: Job, values: Dict[str, Any], finished: bool = True) -> None:
+        if finished:
+            values["finished_at"] = _utcnow()
+        async with AsyncSessionLocal() as db:
+            # リースが切れて別のワーカーが取り直していれば上書きしない
+            await db.execute(
+                update(Job)
+                .where(Job.id == job.id, Job.locked_by == self.worker_id, Job.attempts == job.attempts)
+                .values(locked_by=None, locked_until=None, **values)
+            )
+            await db.commit()
+
+
+async def get_job(db: AsyncSession, job_id: int) -> Optional[Job]:
+    res = await db.execute(select(Job).where(Job.id == job_id))
+    return res.scalar_one_or_none()
+
+
+async def list_jobs(db: AsyncSession, status: Optional[str] = None, after: Optional[int] = None, limit: int = 100):
+    """
+    新しい順のキーセットページング。after には前のページの最後の id を渡す
+    """
+    stmt = select(Job).order_by(Job.id.desc()).limit(limit)
+    if status is not None:
+        stmt = stmt.where(Job.status == status)
+    if after is not None:
+        stmt = stmt.where(Job.id < after)
+    res = await db.execute(stmt)
+    return res.scalars().all()
+
+
+job_queue = JobQueue(
+    workers=settings.JOB_WORKERS,
+    executor=settings.JOB_EXECUTOR,
+    poll_interval=settings.JOB_POLL_INTERVAL,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+    retry_backoff=settings.JOB_RETRY_BACKOFF,
+)
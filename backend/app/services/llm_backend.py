@@ -0,0 +1,160 @@
+# app/services/llm_backend.py
+
+import math
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Generator, List
+from dotenv import load_dotenv
+from app.core.config import Settings
+from app.core.logger import logger
+
+settings = Settings()
+
+Messages = List[Dict[str, str]]
+
+
+class LLMBackend(ABC):
+    """
+    会話生成に使う LLM の共通インターフェース
+    """
+    @abstractmethod
+    def stream(self, messages: Messages, model: str) -> Generator[str, None, None]:
+        """
+        応答テキストを生成された順に少しずつ返す
+        """
+
+    def complete(self, messages: Messages, model: str) -> str:
+        """
+        応答テキストをまとめて返す
+        """
+        return "".join(self.stream(messages, model))
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    OpenAI の Chat Completions API を使うバックエンド
+    """
+    def __init__(self, api_key: str | None = None):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key)
+
+    def stream(self, messages: Messages, model: str) -> Generator[str, None, None]:
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True
+        )
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # 途中で打ち切られた場合も接続を閉じる
+            response.close()
+
+    def complete(self, messages: Messages, model: str) -> str:
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=messages
+        )
+        return response.choices[0].message.content
+
+
+class LocalStubBackend(LLMBackend):
+    """
+    ネットワークなしで会話パイプラインを負荷試験するためのスタブ。
+    入力が同じなら同じ応答・同じ待ち時間を返す(決定的)。
+
+    - 最初のトークンまでの待ち時間(TTFT)は latency 分布(fixed / normal / lognormal)から選ぶ
+    - 以降は tokens_per_sec の速さで reply_tokens 個のトークンを返す
+    - streaming=False の場合は全トークン分待ってからまとめて返す
+    """
+    REPLIES = [
+        "やあ、来てくれてうれしいよ。",
+        "ふむふむ、それでどうしたの？",
+        "今日はいい天気だね。一緒に散歩しない？",
+        "おなかがすいてきたなあ。",
+        "それはおもしろい話だね。もっと聞かせて！",
+    ]
+
+    def __init__(
+        self,
+        latency: str = "lognormal",
+        ttft_ms: float = 300.0,
+        ttft_jitter_ms: float = 100.0,
+        tokens_per_sec: float = 50.0,
+        reply_tokens: int = 40,
+        streaming: bool = True,
+        seed: int = 0,
+    ):
+        if latency not in ("fixed", "normal", "lognormal"):
+            raise ValueError(f"未対応の latency 分布です: {latency}")
+        self.latency = latency
+        self.ttft_ms = ttft_ms
+        self.ttft_jitter_ms = ttft_jitter_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.streaming = streaming
+        self.seed = seed
+
+    def _rng(self, messages: Messages, model: str) -> random.Random:
+        # 同じ会話内容なら同じ乱数列になるようにする
+        last = messages[-1]["content"] if messages else ""
+        return random.Random(f"{self.seed}:{model}:{len(messages)}:{last}")
+
+    def _sample_ttft(self, rng: random.Random) -> float:
+        mean = self.ttft_ms / 1000
+        jitter = self.ttft_jitter_ms / 1000
+        if self.latency == "fixed" or mean <= 0:
+            return max(0.0, mean)
+        if self.latency == "normal":
+            return max(0.0, rng.gauss(mean, jitter))
+        # 平均が mean になる対数正規分布
+        sigma = math.sqrt(math.log1p((jitter / mean) ** 2))
+        return rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+    def _tokens(self, rng: random.Random) -> List[str]:
+        text = ""
+        while len(text) < self.reply_tokens * 2:
+            text += rng.choice(self.REPLIES)
+        text = text[:self.reply_tokens * 2]
+        # 日本語は2文字を1トークンとみなす
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+    def stream(self, messages: Messages, model: str) -> Generator[str, None, None]:
+        rng = self._rng(messages, model)
+        tokens = self._tokens(rng)
+        interval = 1 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+        time.sleep(self._sample_ttft(rng))
+        if not self.streaming:
+            time.sleep(interval * len(tokens))
+            yield "".join(tokens)
+            return
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(interval)
+            yield token
+
+
+def create_llm_backend(name: str) -> LLMBackend:
+    """
+    設定名から LLM バックエンドを生成する ("openai" / "local")
+    """
+    if name == "openai":
+        load_dotenv()
+        return OpenAIBackend(api_key=os.getenv("OPENAI_API_KEY"))
+    if name == "local":
+        logger.info("ローカルスタブの LLM バックエンドを使用します")
+        return LocalStubBackend(
+            latency=settings.LOCAL_LLM_LATENCY,
+            ttft_ms=settings.LOCAL_LLM_TTFT_MS,
+            ttft_jitter_ms=settings.LOCAL_LLM_TTFT_JITTER_MS,
+            tokens_per_sec=settings.LOCAL_LLM_TOKENS_PER_SEC,
+            reply_tokens=settings.LOCAL_LLM_REPLY_TOKENS,
+            streaming=settings.LOCAL_LLM_STREAMING,
+            seed=settings.LOCAL_LLM_SEED,
+        )
+    raise ValueError(f"未対応の LLM バックエンドです: {name}")
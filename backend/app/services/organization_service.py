@@ -1,6 +1,7 @@
 from sqlalchemy import select, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
+from sqlalchemy.orm import selectinload
 from app.db.models import Organization
 from app.models.db import OrganizationCreate, OrganizationUpdate
 
@@ -11,12 +12,24 @@ async def create_organization(db: AsyncSession, data: OrganizationCreate) -> Org
     await db.refresh(org)
     return org
 
-async def get_organization(db: AsyncSession, org_id: int) -> Organization | None:
-    res = await db.execute(select(Organization).where(Organization.id == org_id))
+async def get_organization(db: AsyncSession, org_id: int, with_prompts: bool = False) -> Organization | None:
+    """
+    with_prompts=True なら extend_prompts もまとめて読み込む（プロンプトの数によらず2クエリ）
+    """
+    stmt = select(Organization).where(Organization.id == org_id)
+    if with_prompts:
+        stmt = stmt.options(selectinload(Organization.extend_prompts))
+    res = await db.execute(stmt)
     return res.scalar_one_or_none()
 
-async def list_organizations(db: AsyncSession, skip: int = 0, limit: int = 100) -> List[Organization]:
-    res = await db.execute(select(Organization).offset(skip).limit(limit))
+async def list_organizations(db: AsyncSession, after: Optional[int] = None, limit: int = 100) -> List[Organization]:
+    """
+    id 順のキーセットページング。after には前のページの最後の id を渡す（OFFSET と違いページが深くても一定の速さ）
+    """
+    stmt = select(Organization).order_by(Organization.id).limit(limit)
+    if after is not None:
+        stmt = stmt.where(Organization.id > after)
+    res = await db.execute(stmt)
     return res.scalars().all()
 
 async def update_organization(db: AsyncSession, org_id: int, data: OrganizationUpdate) -> Organization | None:
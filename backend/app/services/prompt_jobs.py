@@ -0,0 +1,70 @@
+# app/services/prompt_jobs.py
+#
+# /extend_prompt でアップロードされた ZIP の後処理（job_queue のプロセスプールで実行される）
+import os
+import zipfile
+from typing import Any, Dict
+from app.core.config import Settings
+from app.core.logger import logger
+from app.services.embedding_service import IMAGE_EXTENSIONS, build_organization_index
+from app.services.image_service import decode_image_bytes
+
+settings = Settings()
+
+
+def _validate_zip(zip_path: str, thumbnail_path: str) -> Dict[str, Any]:
+    """
+    ZIP 内の画像をすべてデコードできるか確認し、最初の1枚からサムネイルを作る
+    """
+    import cv2
+    images, invalid = 0, []
+    thumbnail = None
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            if info.is_dir() or "__MACOSX" in name or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            img = decode_image_bytes(zf.read(info))
+            if img is None:
+                invalid.append(name)
+                continue
+            images += 1
+            if thumbnail is None:
+                height, width = img.shape[:2]
+                scale = settings.THUMBNAIL_SIZE / max(height, width)
+                if scale < 1:
+                    img = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+                thumbnail = img
+    if thumbnail is not None:
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        cv2.imwrite(thumbnail_path, thumbnail)
+    return {"images": images, "invalid": invalid, "thumbnail": thumbnail_path if thumbnail is not None else None}
+
+
+def process_prompt_upload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    payload: {"organization_id": int, "labels": [ラベル名, ...]}
+    ラベルごとの ZIP を検証してサムネイルを作り、組織の参照インデックスを作り直す。
+    画像を1枚も含まない ZIP があっても他のラベルの処理は続け、結果に記録する。
+    """
+    organization_id = payload["organization_id"]
+    source_dir = os.path.join(settings.EXTEND_PROMPTS_DIR, str(organization_id))
+    labels: Dict[str, Any] = {}
+    for label in payload["labels"]:
+        zip_path = os.path.join(source_dir, f"{label}.zip")
+        thumbnail_path = os.path.join(settings.THUMBNAILS_DIR, str(organization_id), f"{label}.jpg")
+        try:
+            labels[label] = _validate_zip(zip_path, thumbnail_path)
+        except (zipfile.BadZipFile, FileNotFoundError) as e:
+            labels[label] = {"images": 0, "invalid": [], "thumbnail": None, "error": str(e)}
+        if labels[label]["images"] == 0:
+            logger.warning(f"画像を含まない ZIP: 組織 {organization_id} / {label}")
+    vectors = build_organization_index(organization_id)
+    return {"labels": labels, "vectors": vectors}
+
+
+def build_embedding_index(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    payload: {"organization_id": int}
+    """
+    return {"vectors": build_organization_index(payload["organization_id"])}
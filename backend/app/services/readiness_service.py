@@ -0,0 +1,110 @@
+# app/services/readiness_service.py
+#
+# 起動時の準備(ウォームアップ)と、トラフィックを受けてよいかの判定(/ready)。
+# 重いライブラリとモデルは import 時には読み込まないため、起動直後のワーカーはまだ推論できない。
+# lifespan でウォームアップをバックグラウンドで始め、終わるまで /ready は 503 を返す。
+# /health-check(プロセスが生きていて依存先が正常か)とは別に、ロードバランサーやオーケストレーターが
+# 準備の済んだワーカーにだけ振り分けるために使う。
+# ウォームアップしない設定(WARMUP_ON_STARTUP=False)では、モデルとプロンプトは最初に使うときに読み込むので、
+# 読み込み前でも準備済みとして扱う（そうしないとトラフィックが来ず、いつまでも読み込まれない）。
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from sqlalchemy import text
+from app.core.config import Settings
+from app.core.logger import logger
+from app.core.prompts import load_prompts, prompts_loaded
+from app.db.session import engine
+from app.services.audio_service import get_llm, warm_up_fallback_speech
+from app.services.image_service import get_image_processor, image_processor_loaded
+
+settings = Settings()
+
+
+class Readiness:
+    def __init__(self, warm_up: bool = True, db_timeout: float = 1.0):
+        self.warm_up_enabled = warm_up
+        self.db_timeout = db_timeout
+        self._task: Optional[asyncio.Task] = None
+        # 準備の各段階の所要時間とエラー {"prompts": {...}, "model": {...}}
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def start(self) -> None:
+        if not self.warm_up_enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._warm_up())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run_stage(self, name: str, func) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(func)
+        except Exception as e:
+            self._stages[name] = {"elapsed_ms": round((time.perf_counter() - start) * 1000, 1), "error": str(e)}
+            logger.error(f"ウォームアップに失敗: {name}: {e}")
+        else:
+            self._stages[name] = {"elapsed_ms": round((time.perf_counter() - start) * 1000, 1), "error": None}
+            logger.info(f"ウォームアップ完了: {name} ({self._stages[name]['elapsed_ms']}ms)")
+
+    async def _warm_up(self) -> None:
+        await self._run_stage("prompts", load_prompts)
+        # モデルを読み込んで一度推論しておく
+        await self._run_stage("model", lambda: get_image_processor().warm_up())
+        # LLM クライアントの import も最初の会話ターンに持ち込まない（/ready の判定には使わない）
+        await self._run_stage("llm", get_llm)
+        # LLM と TTS が同時に落ちたときに返す定型の返答の音声（/ready の判定には使わない）
+        await self._run_stage("fallback_speech", warm_up_fallback_speech)
+
+    def _stage_ready(self, name: str) -> bool:
+        """
+        ウォームアップの段階がエラーなく終わったか（推論を一度終えるまではモデルを読み込んだだけでは準備済みにしない）
+        """
+        if not self.warm_up_enabled:
+            return True
+        stage = self._stages.get(name)
+        return stage is not None and stage["error"] is None
+
+    async def check_db(self) -> Optional[str]:
+        """
+        DB に接続して SELECT 1 を実行する。問題なければ None、失敗すればエラーの内容
+        """
+        async def ping() -> None:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+
+        try:
+            await asyncio.wait_for(ping(), timeout=self.db_timeout)
+        except Exception as e:
+            return str(e) or type(e).__name__
+        return None
+
+    async def get_state_info(self) -> Dict[str, Any]:
+        """
+        モデル・DB・プロンプトの準備ができているかを返す（DB は呼ばれるたびに確認する）
+        """
+        db_error = await self.check_db()
+        components = {
+            "model": {"ready": self._stage_ready("model"), "loaded": image_processor_loaded(), **self._stages.get("model", {})},
+            "db": {"ready": db_error is None, "error": db_error},
+            "prompts": {"ready": self._stage_ready("prompts"), "loaded": prompts_loaded(), **self._stages.get("prompts", {})},
+        }
+        return {
+            "ready": all(component["ready"] for component in components.values()),
+            "warming_up": self._task is not None and not self._task.done(),
+            "components": components,
+        }
+
+
+readiness = Readiness(
+    warm_up=settings.WARMUP_ON_STARTUP,
+    db_timeout=settings.READY_DB_TIMEOUT,
+)
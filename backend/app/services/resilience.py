@@ -0,0 +1,139 @@
+# app/services/resilience.py
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+from app.core.logger import logger
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """
+    サーキットブレーカーが開いているため、依存先を呼ばずに失敗したことを表す例外
+    """
+    def __init__(self, name: str):
+        super().__init__(f"{name} のサーキットブレーカーが開いています")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    外部依存(OpenAI / gTTS)ごとのサーキットブレーカー。
+    - closed: 通常どおり呼び出す。連続で failure_threshold 回失敗したら open へ
+    - open: reset_timeout 秒の間は呼び出さずに即座に失敗する
+    - half_open: 1回だけ試し、成功すれば closed、失敗すれば再び open へ
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.total_failures = 0
+        self.total_rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            logger.info(f"サーキットブレーカー {self.name}: half_open")
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info(f"サーキットブレーカー {self.name}: closed")
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.total_failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"サーキットブレーカー {self.name}: open (連続失敗 {self.failures} 回)")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    async def call(self, factory: Callable[[], Awaitable[T]], timeout: float) -> T:
+        """
+        factory が返す処理を期限 timeout 秒で実行する。
+        ブレーカーが開いていれば CircuitOpenError、期限切れなら asyncio.TimeoutError を投げる。
+        """
+        if not self.allow():
+            self.total_rejected += 1
+            raise CircuitOpenError(self.name)
+        try:
+            result = await asyncio.wait_for(factory(), timeout=timeout)
+        except asyncio.CancelledError:
+            # 呼び出し側の取り消しは依存先の失敗ではない
+            self._trial_in_flight = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def get_state_info(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "total_failures": self.total_failures,
+            "rejected": self.total_rejected,
+        }
+
+
+async def hedged(fn: Callable[[], T], delay: float, max_attempts: int = 2) -> T:
+    """
+    冪等な同期処理 fn をスレッドで実行し、delay 秒たっても終わらなければ同じ処理をもう1本走らせる。
+    先に成功した方の結果を返し、残りは待たない。失敗した場合もすぐに次の試行を始める。
+    """
+    pending = {asyncio.ensure_future(asyncio.to_thread(fn))}
+    launched = 1
+    last_error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=delay if launched < max_attempts else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+            if launched < max_attempts:
+                # 遅い・失敗した試行を待たずにもう1本走らせる
+                pending.add(asyncio.ensure_future(asyncio.to_thread(fn)))
+                launched += 1
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# 依存先ごとのブレーカー
+breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+    return breakers[name]
+
+
+def get_breaker_states() -> Dict[str, Dict[str, Any]]:
+    """
+    全ブレーカーの状態を取得（ヘルスチェック用）
+    """
+    return {name: breaker.get_state_info() for name, breaker in breakers.items()}
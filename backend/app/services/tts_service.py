@@ -2,7 +2,7 @@ import io
 import base64
 
 import numpy as np
-import soundfile as sf
+from app.core.tracing import span
 
 # fastrtc-jp の Style-Bert-VITS2 モデルをインポート
 # from fastrtc_jp.text_to_speech.style_bert_vits2 import (
@@ -34,6 +34,7 @@ def synthesize_audio(reply: str) -> tuple[str, str]:
     # audio = np.concatenate([chunk[1] for chunk in chunks])
 
     # # 3. WAV に書き込み
+    # import soundfile as sf
     # buffer = io.BytesIO()
     # sf.write(buffer, audio, sr, format="WAV")
     # buffer.seek(0)
@@ -42,4 +43,5 @@ def synthesize_audio(reply: str) -> tuple[str, str]:
     # audio_b64 = base64.b64encode(buffer.read()).decode("utf-8")
 
     # return reply, audio_b64
-    return reply, "dummy_audio_base64_string"  # ダミーの音声データを返す
\ No newline at end of file
+    with span("tts.dummy"):
+        return reply, "dummy_audio_base64_string"  # ダミーの音声データを返す
\ No newline at end of file
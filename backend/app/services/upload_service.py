@@ -0,0 +1,139 @@
+# app/services/upload_service.py
+#
+# 画像アップロードの読み込み。
+# Starlette の request.form() は大きなファイルを一時ファイルに書き出すため、
+# multipart を自前で逐次パースし、ファイル1つ分ずつメモリ上のバイト列として取り出す。
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from app.core.config import Settings
+
+settings = Settings()
+
+
+@dataclass
+class UploadedImage:
+    filename: str
+    data: bytes
+
+
+class _PartCollector:
+    """
+    MultipartParser のコールバックを受けて、完了したファイルパートを溜めておく
+    """
+    def __init__(self, field: Optional[str], max_bytes: int):
+        self.field = field
+        self.max_bytes = max_bytes
+        self.completed: List[UploadedImage] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: List[Tuple[bytes, bytes]] = []
+        self._name: Optional[str] = None
+        self._filename: Optional[str] = None
+        self._buffer: Optional[bytearray] = None
+
+    def on_part_begin(self) -> None:
+        self._headers = []
+        self._name = None
+        self._filename = None
+        self._buffer = None
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers.append((self._header_field.lower(), self._header_value))
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        for field, value in self._headers:
+            if field == b"content-disposition":
+                _, options = parse_options_header(value)
+                self._name = options.get(b"name", b"").decode("utf-8", "replace")
+                if b"filename" in options:
+                    self._filename = options[b"filename"].decode("utf-8", "replace")
+        # 対象のファイルフィールドだけ本文を溜める（テキストのフィールドは読み捨てる）
+        if self._filename is not None and (self.field is None or self._name == self.field):
+            self._buffer = bytearray()
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._buffer is None:
+            return
+        if len(self._buffer) + (end - start) > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Image too large: {self._filename}")
+        self._buffer += data[start:end]
+
+    def on_part_end(self) -> None:
+        if self._buffer is not None:
+            self.completed.append(UploadedImage(filename=self._filename or "", data=bytes(self._buffer)))
+        self._buffer = None
+
+
+async def iter_uploaded_images(
+    request: Request,
+    field: Optional[str] = "file",
+    max_bytes: Optional[int] = None
+) -> AsyncIterator[UploadedImage]:
+    """
+    リクエスト本文から画像を1つずつ取り出す。
+    - multipart/form-data: field のファイルパート（None なら全ファイル）を、受信し終えた順に返す
+    - それ以外(image/jpeg, application/octet-stream など): 本文全体を1枚の画像として返す
+    呼び出し側が処理している間は本文を読み進めないため、保持するのは受信中のファイル1つ分と未処理の完了分だけになる。
+    1ファイルが max_bytes を超えた場合は 413 を送出する。
+    """
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+
+    if content_type != b"multipart/form-data":
+        buffer = bytearray()
+        async for chunk in request.stream():
+            if len(buffer) + len(chunk) > max_bytes:
+                raise HTTPException(status_code=413, detail="Image too large")
+            buffer += chunk
+        if not buffer:
+            raise HTTPException(status_code=400, detail="Image data is required")
+        yield UploadedImage(filename="", data=bytes(buffer))
+        return
+
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="Missing multipart boundary")
+    collector = _PartCollector(field, max_bytes)
+    parser = MultipartParser(boundary, {
+        "on_part_begin": collector.on_part_begin,
+        "on_part_data": collector.on_part_data,
+        "on_part_end": collector.on_part_end,
+        "on_header_field": collector.on_header_field,
+        "on_header_value": collector.on_header_value,
+        "on_header_end": collector.on_header_end,
+        "on_headers_finished": collector.on_headers_finished,
+    })
+    found = False
+    async for chunk in request.stream():
+        parser.write(chunk)
+        while collector.completed:
+            found = True
+            yield collector.completed.pop(0)
+    parser.finalize()
+    for image in collector.completed:
+        found = True
+        yield image
+    if not found:
+        raise HTTPException(status_code=400, detail="Image data is required")
+
+
+async def read_uploaded_image(request: Request, field: str = "file") -> UploadedImage:
+    """
+    リクエスト本文から最初の画像1枚を取り出す
+    """
+    images = iter_uploaded_images(request, field=field)
+    try:
+        return await images.__anext__()
+    finally:
+        await images.aclose()
@@ -0,0 +1,129 @@
+# app/services/warmup_service.py
+
+import asyncio
+from dataclasses import dataclass
+from typing import Dict
+from app.core.config import Settings
+from app.core.logger import logger
+from app.managers.connection_manager import manager
+from app.models.websocket import TextMessage, AudioMessage
+from app.services.admission_service import admission_controller, AdmissionRejected
+from app.services.audio_service import get_processor, release_processors, llm_breaker
+
+settings = Settings()
+
+
+@dataclass
+class PrefetchedGreeting:
+    friend: str
+    text: str
+    audio_b64: str
+
+
+class GreetingPrefetcher:
+    """
+    会話相手が決まった時点で、セッション生成と最初の挨拶(テキスト+音声)を先読みする。
+    - 準備ができた時点でクライアントが接続していればすぐに届ける
+    - 未接続ならキャッシュしておき、接続時に届ける
+    - 会話相手が変わった・ユーザーが先に話しかけた・切断された場合は破棄する
+    """
+    def __init__(self, enabled: bool = True, ttl: float = 60.0):
+        self.enabled = enabled
+        # 未接続のクライアント向けに先読みした挨拶を保持する時間(秒)
+        self.ttl = ttl
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._ready: Dict[str, PrefetchedGreeting] = {}
+
+    def schedule(self, client_id: str, friend: str) -> None:
+        """
+        client_id の会話相手 friend に対する挨拶の先読みを開始する
+        """
+        if not self.enabled or not friend or friend == "default":
+            return
+        # 以前の会話相手向けの先読みは不要になるので破棄
+        self.discard(client_id)
+        self._tasks[client_id] = asyncio.create_task(self._prefetch(client_id, friend))
+        logger.info(f"挨拶の先読みを開始: client_id={client_id}, friend={friend}")
+
+    async def _prefetch(self, client_id: str, friend: str) -> None:
+        try:
+            # セッション(AudioProcessor)を先に作っておく
+            proc = get_processor(client_id, friend)
+            async with admission_controller.admit(client_id):
+                # 障害中は先読みしない(ブレーカーが開いていれば即座に失敗する)
+                text, audio_b64 = await llm_breaker.call(
+                    lambda: asyncio.to_thread(proc.greet),
+                    timeout=settings.LLM_TIMEOUT
+                )
+        except asyncio.CancelledError:
+            raise
+        except AdmissionRejected:
+            # 混雑時は先読みをあきらめ、通常の会話に枠を譲る
+            return
+        except Exception as e:
+            logger.warning(f"挨拶の先読みに失敗: client_id={client_id}, friend={friend}, error={e}")
+            return
+        finally:
+            if self._tasks.get(client_id) is asyncio.current_task():
+                del self._tasks[client_id]
+
+        # 待っている間に会話相手が変わっていたら破棄
+        if manager.get_friend(client_id) != friend:
+            logger.info(f"会話相手が変わったため先読みした挨拶を破棄: client_id={client_id}, friend={friend}")
+            return
+
+        greeting = PrefetchedGreeting(friend=friend, text=text, audio_b64=audio_b64)
+        self._ready[client_id] = greeting
+        if client_id in manager.active_connections:
+            await self.deliver(client_id)
+        else:
+            # 別のワーカーに接続された場合などに備え、いつまでも残さない
+            asyncio.get_running_loop().call_later(self.ttl, self._expire, client_id, greeting)
+
+    async def deliver(self, client_id: str) -> bool:
+        """
+        先読み済みの挨拶があればクライアントに送信する
+
+        Returns:
+            bool: 送信したかどうか
+        """
+        greeting = self._ready.pop(client_id, None)
+        if greeting is None:
+            return False
+        if manager.get_friend(client_id) != greeting.friend:
+            logger.info(f"会話相手が変わったため先読みした挨拶を破棄: client_id={client_id}, friend={greeting.friend}")
+            return False
+
+        get_processor(client_id, greeting.friend).remember_greeting(greeting.text)
+        await manager.send_message(
+            client_id,
+            TextMessage(data=greeting.text)
+        )
+        await manager.send_message(
+            client_id,
+            AudioMessage(data=greeting.audio_b64, format="mp3")
+        )
+        logger.info(f"先読みした挨拶を送信: client_id={client_id}, friend={greeting.friend}")
+        return True
+
+    def _expire(self, client_id: str, greeting: PrefetchedGreeting) -> None:
+        if self._ready.get(client_id) is greeting:
+            del self._ready[client_id]
+            # 接続されないままなら、先読みのために作ったセッションも残さない
+            if client_id not in manager.active_connections:
+                release_processors(client_id)
+
+    def discard(self, client_id: str) -> None:
+        """
+        client_id の先読み中・先読み済みの挨拶を破棄する
+        """
+        task = self._tasks.pop(client_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+        self._ready.pop(client_id, None)
+
+
+# グローバルインスタンス
+greeting_prefetcher = GreetingPrefetcher(enabled=settings.SPECULATIVE_GREETING)
+# 他ワーカーで会話相手が決まった場合も、ソケットを持つこのワーカーで先読みする
+manager.add_friend_listener(greeting_prefetcher.schedule)
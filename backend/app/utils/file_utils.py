@@ -1,4 +1,8 @@
+import asyncio
 import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterable, Tuple
 from app.core.logger import logger
 
 
@@ -19,4 +23,38 @@ def save_file(data: bytes, directory: str, filename: str) -> str:
     with open(filepath, "wb") as f:
         f.write(data)
     logger.info(f"ファイル保存: {filepath}")
-    return filepath
\ No newline at end of file
+    return filepath
+
+
+def _copy_to_temp(src: BinaryIO, directory: str, chunk_size: int) -> Tuple[str, int]:
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(src, f, chunk_size)
+            size = f.tell()
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, size
+
+
+async def save_stream_temp(src: BinaryIO, directory: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    ファイルオブジェクトの内容を指定ディレクトリ内の一時ファイル(他と重ならない名前)に書き出し、そのパスを返す。
+    既存のファイルは置き換えないので、確定してから os.replace で本来の名前にし、取りやめたら discard_files で消す。
+    """
+    ensure_dir(directory)
+    tmp_path, size = await asyncio.to_thread(_copy_to_temp, src, directory, chunk_size)
+    logger.info(f"一時ファイル保存: {tmp_path} ({size} bytes)")
+    return tmp_path
+
+
+def discard_files(paths: Iterable[str]) -> None:
+    """
+    一時ファイルを削除する（既にないものは無視する）
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,65 @@
+"""
+会話パイプライン(LLM + TTS)の負荷試験。
+ネットワークなしで動くように、LLM はローカルスタブ、TTS はダミーに切り替えて実行する。
+
+backend ディレクトリで実行:
+    python -m benchmarks.conversation_load --clients 50 --turns 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("LLM_BACKEND", "local")
+os.environ.setdefault("TTS_BACKEND", "dummy")
+
+from app.services.admission_service import admission_controller, AdmissionRejected  # noqa: E402
+from app.services.audio_service import chat as audio_chat  # noqa: E402
+
+
+async def run_client(client_id: str, turns: int, latencies: list, rejected: list) -> None:
+    for turn in range(turns):
+        start = time.perf_counter()
+        try:
+            async with admission_controller.admit(client_id):
+                await asyncio.to_thread(audio_chat, f"こんにちは {turn}", session_id=client_id, friend="dog")
+        except AdmissionRejected as e:
+            rejected.append(e.reason)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    args = parser.parse_args()
+
+    latencies: list = []
+    rejected: list = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(f"bench_{i}", args.turns, latencies, rejected) for i in range(args.clients)
+    ))
+    elapsed = time.perf_counter() - start
+
+    print(f"clients={args.clients} turns={args.turns} elapsed={elapsed:.2f}s")
+    print(f"completed={len(latencies)} rejected={len(rejected)} throughput={len(latencies) / elapsed:.1f} turns/s")
+    if latencies:
+        print(
+            f"latency mean={statistics.mean(latencies) * 1000:.0f}ms "
+            f"p50={percentile(latencies, 0.5) * 1000:.0f}ms "
+            f"p95={percentile(latencies, 0.95) * 1000:.0f}ms "
+            f"p99={percentile(latencies, 0.99) * 1000:.0f}ms"
+        )
+    print(f"admission={admission_controller.get_state_info()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
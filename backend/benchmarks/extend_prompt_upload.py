@@ -0,0 +1,152 @@
+"""
+/extend_prompt をアプリ(ASGI)経由で呼び出す一連の確認と所要時間。
+一時ディレクトリの SQLite と ZIP の保存先を使い、次を確認する:
+- 新しい組織へのアップロードが 202 と {job_id, extend_prompts[].organization} を返し、ZIP とジョブが保存される
+- 同じ組織・同じ name のアップロードは 409 になり、既存の ZIP は書き換えられず一時ファイルも残らない
+- ディレクトリを指す name(../ など)のアップロードは 400 になり、何も書き出されない
+
+backend ディレクトリで実行:
+    python -m benchmarks.extend_prompt_upload --labels 20
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+from typing import Dict, List, Tuple
+
+WORKDIR = tempfile.mkdtemp(prefix="extend_prompt_check_")
+# 設定はアプリの import 時に読まれるので、先に一時ディレクトリを向けておく
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{WORKDIR}/check.db"
+os.environ["EXTEND_PROMPTS_DIR"] = os.path.join(WORKDIR, "extend_prompts")
+
+from app.db.models import Base, Job  # noqa: E402
+from app.db.session import AsyncSessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+
+def make_zip(marker: str) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("marker.txt", marker)
+    return buf.getvalue()
+
+
+def multipart(fields: Dict[str, str], files: List[Tuple[str, str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        )
+    for name, filename, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/zip\r\n\r\n".encode("utf-8") + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def post(path: str, body: bytes, content_type: str) -> Tuple[int, dict]:
+    """
+    HTTP クライアントを使わずに ASGI アプリを直接呼び出す
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    received = False
+    status = 0
+    chunks: List[bytes] = []
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.sleep(3600)
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, json.loads(b"".join(chunks) or b"null")
+
+
+async def upload(organization: str, labels: List[str], marker: str) -> Tuple[int, dict]:
+    items = json.dumps([{"name": label, "prompt": f"あなたは{label}です。"} for label in labels], ensure_ascii=False)
+    body, content_type = multipart(
+        {"organization_name": organization, "items": items},
+        [("files", f"{label}.zip", make_zip(marker)) for label in labels],
+    )
+    return await post("/extend_prompt", body, content_type)
+
+
+def read_marker(org_id: int, label: str) -> str:
+    path = os.path.join(os.environ["EXTEND_PROMPTS_DIR"], str(org_id), f"{label}.zip")
+    with zipfile.ZipFile(path) as zf:
+        return zf.read("marker.txt").decode("utf-8")
+
+
+async def main(labels: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    names = [f"label{i}" for i in range(labels)]
+
+    start = time.perf_counter()
+    status, body = await upload("check-org", names, "ORIGINAL")
+    elapsed = time.perf_counter() - start
+    assert status == 202, (status, body)
+    assert len(body["extend_prompts"]) == labels, body
+    org_id = body["extend_prompts"][0]["organization"]["id"]
+    assert all(ep["organization"]["name"] == "check-org" for ep in body["extend_prompts"]), body
+    assert all(read_marker(org_id, name) == "ORIGINAL" for name in names)
+    async with AsyncSessionLocal() as db:
+        job = await db.get(Job, body["job_id"])
+        assert job is not None and job.kind == "process_prompt_upload", job
+    print(f"upload: 202 labels={labels} job_id={body['job_id']} ({elapsed * 1000:.1f}ms)")
+
+    # 既存の name を含むアップロードは拒否され、保存済みの ZIP もジョブもそのまま
+    status, body = await upload("check-org", [names[0], "new-label"], "REJECTED")
+    assert status == 409, (status, body)
+    assert read_marker(org_id, names[0]) == "ORIGINAL"
+    directory = os.path.join(os.environ["EXTEND_PROMPTS_DIR"], str(org_id))
+    assert sorted(os.listdir(directory)) == sorted(f"{name}.zip" for name in names), os.listdir(directory)
+    async with AsyncSessionLocal() as db:
+        assert await db.scalar(select(func.count()).select_from(Job)) == 1
+    print("duplicate: 409, existing ZIP unchanged")
+
+    for bad in ("../escape", "a/b", "..", "a\\b"):
+        status, body = await upload("check-org", [bad], "BAD")
+        assert status == 400, (bad, status, body)
+    assert sorted(os.listdir(os.environ["EXTEND_PROMPTS_DIR"])) == [str(org_id)], os.listdir(os.environ["EXTEND_PROMPTS_DIR"])
+    assert sorted(os.listdir(directory)) == sorted(f"{name}.zip" for name in names), os.listdir(directory)
+    print("unsafe names: 400, nothing written")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--labels", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.labels))
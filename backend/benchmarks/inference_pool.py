@@ -0,0 +1,70 @@
+"""
+画像認識の推論を、このプロセスのスレッドで行う場合と推論ワーカー(別プロセス)で行う場合の比較。
+同時に concurrency 個のリクエストが1枚ずつ推論する状況で、スループットと1回あたりの所要時間(p50/p99)を出す。
+
+backend ディレクトリで実行（models/best.pt が必要）:
+    python -m benchmarks.inference_pool --workers 4 --concurrency 8 --frames 400
+    python -m benchmarks.inference_pool --workers 4 --affinity auto
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from app.services.image_service import ImageProcessor
+from app.services.inference_pool import InferencePool
+
+
+def run(detect: Callable[[List[np.ndarray]], List[Optional[dict]]], frames: List[np.ndarray], concurrency: int) -> None:
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def one(frame: np.ndarray) -> None:
+        start = time.perf_counter()
+        detect([frame])
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, frames))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"  {len(frames) / elapsed:7.1f} frames/s"
+        f"  p50={latencies[len(latencies) // 2] * 1000:6.1f}ms"
+        f"  p99={latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:6.1f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--affinity", default="")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=400)
+    parser.add_argument("--model", default="models/best.pt")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(args.frames)]
+
+    print("in-process (threads)")
+    processor = ImageProcessor(model_path=args.model)
+    processor.warm_up()
+    run(processor.detect_top_boxes_in_arrays, frames, args.concurrency)
+
+    print(f"inference pool (workers={args.workers}, affinity={args.affinity or 'none'})")
+    pool = InferencePool(workers=args.workers, model_path=args.model, cpu_affinity=args.affinity)
+    pool.start()
+    try:
+        run(pool.detect_top_boxes, frames, args.concurrency)
+    finally:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+ExtendPrompt のラベル検索(get_prompt_for_label)の所要時間が、テーブルの件数に依存しないことの確認。
+(organization_id, name) の複合インデックスの有無で、組織数(=件数)を増やしながら1回あたりの検索時間を比べる。
+組織ごとのラベルの種類は同じなので、name だけのインデックスでは同じ name を持つ全組織の行をたどることになる。
+
+backend ディレクトリで実行（一時的な SQLite ファイルを使う）:
+    python -m benchmarks.prompt_lookup --sizes 1000 10000 100000 --lookups 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.db.models import Base, ExtendPrompt, Organization
+from app.services.get_extend_prompt_service import get_prompt_for_label
+
+LABELS_PER_ORGANIZATION = 50
+INDEX_NAME = "ix_extend_prompt_organization_id_name"
+
+
+async def populate(session: AsyncSession, organizations: int) -> None:
+    await session.execute(insert(Organization), [{"name": f"org{i}"} for i in range(organizations)])
+    rows = [
+        {"name": f"label{j}", "prompt": "あなたは動物です。", "organization_id": org_id}
+        for org_id in range(1, organizations + 1)
+        for j in range(LABELS_PER_ORGANIZATION)
+    ]
+    for start in range(0, len(rows), 10000):
+        await session.execute(insert(ExtendPrompt), rows[start:start + 10000])
+    await session.commit()
+
+
+async def measure(size: int, lookups: int, indexed: bool) -> float:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        if not indexed:
+            # 以前と同じ name だけのインデックスの状態
+            await conn.execute(text(f"DROP INDEX {INDEX_NAME}"))
+    async with AsyncSession(engine) as session:
+        organizations = max(1, size // LABELS_PER_ORGANIZATION)
+        await populate(session, organizations)
+        keys = [
+            (random.randint(1, organizations), f"label{random.randrange(LABELS_PER_ORGANIZATION)}")
+            for _ in range(lookups)
+        ]
+        plan = (await session.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM extend_prompt WHERE organization_id = 1 AND name = 'label0'"
+        ))).all()
+        start = time.perf_counter()
+        for org_id, label in keys:
+            await get_prompt_for_label(session, org_id, label)
+        elapsed = time.perf_counter() - start
+    await engine.dispose()
+    os.remove(path)
+    print(f"size={size:>8} indexed={str(indexed):<5} {elapsed / lookups * 1e6:8.1f}us/lookup  plan: {plan[-1][-1]}")
+    return elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+    for size in args.sizes:
+        await measure(size, args.lookups, indexed=True)
+        await measure(size, args.lookups, indexed=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
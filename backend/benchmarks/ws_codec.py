@@ -0,0 +1,107 @@
+"""
+/ws メッセージの変換コストの比較。
+以前の Pydantic モデル + 標準 json の経路と、msgspec の型付きコーデックを実際のメッセージ構成で比べる。
+
+backend ディレクトリで実行:
+    python -m benchmarks.ws_codec --rounds 2000
+"""
+import argparse
+import base64
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+from app.models.websocket import (
+    AudioMessage, BoundingBox, TextMessage, TrackingResult, TrackingStatus, TranscriptPartial,
+    decode, encode,
+)
+
+
+class LegacyWebSocketMessage(BaseModel):
+    """
+    以前の送信用モデル（比較用）
+    """
+    type: str
+    data: Optional[str] = None
+    format: Optional[str] = None
+
+
+def legacy_encode(message: Dict[str, Any]) -> str:
+    if message["type"] in ("tracking_result", "tracking_status"):
+        # 追跡系はその場で dict を組み立てていた
+        return json.dumps(message)
+    return json.dumps(LegacyWebSocketMessage(**message).dict())
+
+
+def legacy_decode(raw: str) -> Dict[str, Any]:
+    data = json.loads(raw)
+    data.get("type")
+    return data
+
+
+def build_mix() -> tuple:
+    """
+    1ラウンド分のメッセージ。追跡中の1秒あたりの構成をおおよそ再現する:
+    追跡結果 10件・状態 1件・途中の文字起こし 3件・テキスト返答 1件・音声返答(約50KB) 1件、
+    受信は画像フレーム(約100KB) 10件・音声フレーム 25件・テキスト 1件
+    """
+    bbox = {"x": 0.12, "y": 0.34, "width": 0.45, "height": 0.5}
+    audio_b64 = base64.b64encode(os.urandom(37 * 1024)).decode()
+    image_b64 = base64.b64encode(os.urandom(75 * 1024)).decode()
+    pcm_b64 = base64.b64encode(os.urandom(640)).decode()
+
+    legacy_out = (
+        [{"type": "tracking_result", "object_name": "dog", "confidence": 0.87, "boundingBox": bbox}] * 10
+        + [{"type": "tracking_status", "status": "starting", "message": "dogの追跡を開始します"}]
+        + [{"type": "transcript_partial", "data": "こんにちは今日は"}] * 3
+        + [{"type": "text", "data": "ワン！今日も元気だよ。一緒に遊ぼう！"}]
+        + [{"type": "audio", "data": audio_b64, "format": "mp3"}]
+    )
+    typed_out = (
+        [TrackingResult(object_name="dog", confidence=0.87, bounding_box=BoundingBox(**bbox))] * 10
+        + [TrackingStatus(status="starting", message="dogの追跡を開始します")]
+        + [TranscriptPartial(data="こんにちは今日は")] * 3
+        + [TextMessage(data="ワン！今日も元気だよ。一緒に遊ぼう！")]
+        + [AudioMessage(data=audio_b64, format="mp3")]
+    )
+    inbound = (
+        [json.dumps({"type": "image", "data": image_b64})] * 10
+        + [json.dumps({"type": "audio_chunk", "data": pcm_b64, "sample_rate": 16000})] * 25
+        + [json.dumps({"type": "message", "content": "こんにちは"})]
+    )
+    return legacy_out, typed_out, inbound
+
+
+def measure(label: str, rounds: int, fn) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed * 1000:8.1f}ms  ({elapsed / rounds * 1e6:7.1f}us/round)")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    legacy_out, typed_out, inbound = build_mix()
+    # 出力が同じ JSON になることを確認しておく
+    for legacy, typed in zip(legacy_out, typed_out):
+        expected = {k: v for k, v in legacy.items() if v is not None}
+        assert json.loads(encode(typed)) == expected, typed
+
+    print(f"rounds={args.rounds} outbound={len(typed_out)} inbound={len(inbound)} per round")
+    legacy_enc = measure("encode legacy", args.rounds, lambda: [legacy_encode(m) for m in legacy_out])
+    typed_enc = measure("encode msgspec", args.rounds, lambda: [encode(m) for m in typed_out])
+    legacy_dec = measure("decode legacy", args.rounds, lambda: [legacy_decode(r) for r in inbound])
+    typed_dec = measure("decode msgspec", args.rounds, lambda: [decode(r) for r in inbound])
+    print(f"encode speedup x{legacy_enc / typed_enc:.1f}, decode speedup x{legacy_dec / typed_dec:.1f}")
+
+
+if __name__ == "__main__":
+    main()